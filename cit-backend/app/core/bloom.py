@@ -0,0 +1,47 @@
+"""
+Filtro de Bloom em memória
+
+Responde "com certeza não existe" ou "talvez exista". Usado para recusar
+códigos digitados errado (ou chutados) sem consultar o MongoDB; um
+"talvez" sempre é confirmado no banco.
+
+As k posições vêm de um único blake2b de 128 bits (hashing duplo de
+Kirsch-Mitzenmacher: h1 + i*h2).
+"""
+import hashlib
+import math
+
+
+class BloomFilter:
+
+    __slots__ = ("capacity", "error_rate", "size", "hash_count", "bits", "count")
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        # m = -n ln p / (ln 2)^2 ; k = m/n ln 2
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @property
+    def full(self) -> bool:
+        """Acima da capacidade a taxa de falsos positivos passa do valor configurado"""
+        return self.count >= self.capacity
@@ -0,0 +1,207 @@
+"""
+Invalidação de caches em memória entre workers
+
+Cada escopo ("catalog", "company", "users", "sessions") tem um documento de
+versão na coleção `cache_versions`. Quem altera dados chama `publish`, que
+executa os handlers locais na hora e incrementa a versão no MongoDB; os
+demais workers percebem a mudança no próximo ciclo de polling e executam
+os mesmos handlers. (Change streams exigiriam replica set; o polling
+funciona também com o MongoDB standalone do docker-compose.)
+"""
+import asyncio
+import inspect
+import logging
+import secrets
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from pymongo import ReturnDocument
+from app.core.config import settings
+from app.database.mongo import get_database
+
+logger = logging.getLogger(__name__)
+
+_handlers: Dict[str, List[Callable]] = {}
+_key_handlers: Dict[str, List[Callable]] = {}
+_pending_keys: Dict[str, Tuple[Set[str], asyncio.Task]] = {}
+_known_versions: Dict[str, int] = {}
+_poll_task: Optional[asyncio.Task] = None
+_pending: Set[asyncio.Task] = set()
+# "shared" quando as versões locais refletem as do MongoDB; senão um valor
+# exclusivo do processo, para que ETags derivados das versões não colidam
+_epoch = secrets.token_hex(4)
+_diverged = False
+
+
+def subscribe(scope: str, handler: Callable) -> None:
+    """Registra um handler (sync ou async, sem argumentos) chamado quando o escopo muda"""
+    _handlers.setdefault(scope, []).append(handler)
+
+
+def subscribe_keys(scope: str, handler: Callable) -> None:
+    """Registra um handler (sync ou async) chamado com a lista de chaves alteradas do escopo"""
+    _key_handlers.setdefault(scope, []).append(handler)
+
+
+def get_version(scope: str) -> int:
+    return _known_versions.get(scope, 0)
+
+
+def epoch() -> str:
+    return _epoch
+
+
+async def _run_handlers(scope: str) -> None:
+    for handler in _handlers.get(scope, []):
+        try:
+            result = handler()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.error(f"Erro ao invalidar cache '{scope}': {e}")
+
+
+async def _run_key_handlers(scope: str, keys: List[str]) -> None:
+    for handler in _key_handlers.get(scope, []):
+        try:
+            result = handler(keys)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.error(f"Erro ao invalidar chaves do cache '{scope}': {e}")
+
+
+async def publish(scope: str) -> None:
+    """Invalida o escopo neste worker e sinaliza os demais"""
+    global _epoch, _diverged
+    db = get_database()
+    try:
+        doc = await db.cache_versions.find_one_and_update(
+            {"_id": scope},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        _known_versions[scope] = max(doc["version"], _known_versions.get(scope, 0))
+    except Exception as e:
+        # Sem o MongoDB os outros workers dependem do TTL dos caches, e as
+        # versões deste worker deixam de ser comparáveis com as dos demais
+        logger.error(f"Erro ao publicar invalidação '{scope}': {e}")
+        _epoch = secrets.token_hex(4)
+        _diverged = True
+
+    await _run_handlers(scope)
+
+
+def publish_nowait(scope: str) -> None:
+    """Versão de `publish` para código síncrono (agenda a publicação no event loop)"""
+    task = asyncio.get_running_loop().create_task(publish(scope))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+async def publish_keys(scope: str, keys: List[str]) -> None:
+    """Invalida só as chaves indicadas, neste worker e nos demais"""
+    global _epoch, _diverged
+    db = get_database()
+    try:
+        doc = await db.cache_versions.find_one_and_update(
+            {"_id": scope},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        version = doc["version"]
+        await db.cache_invalidations.insert_one({
+            "_id": f"{scope}:{version}",
+            "keys": keys,
+            "at": datetime.now(timezone.utc)
+        })
+        # Versões anteriores ainda não vistas podem ser de outros workers: não avança o conhecido
+        if _known_versions.get(scope, 0) == version - 1:
+            _known_versions[scope] = version
+    except Exception as e:
+        logger.error(f"Erro ao publicar invalidação '{scope}': {e}")
+        _epoch = secrets.token_hex(4)
+        _diverged = True
+
+    await _run_key_handlers(scope, keys)
+
+
+def publish_keys_nowait(scope: str, keys) -> None:
+    """
+    Versão de `publish_keys` para código síncrono. As chaves publicadas no
+    mesmo ciclo do event loop saem juntas em uma única publicação.
+    """
+    pending = _pending_keys.get(scope)
+    if pending is not None and not pending[1].done():
+        pending[0].update(str(key) for key in keys)
+        return
+
+    batch = {str(key) for key in keys}
+
+    async def flush() -> None:
+        # Chaves que chegarem a partir daqui vão para a próxima publicação
+        if _pending_keys.get(scope, (None,))[0] is batch:
+            del _pending_keys[scope]
+        await publish_keys(scope, sorted(batch))
+
+    task = asyncio.get_running_loop().create_task(flush())
+    _pending_keys[scope] = (batch, task)
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+async def _published_keys(scope: str, known: int, version: int) -> Optional[List[str]]:
+    """Chaves das versões (known, version], ou None se alguma não tiver chaves gravadas"""
+    if version - known > settings.CACHE_SYNC_MAX_KEYED_VERSIONS:
+        return None
+    db = get_database()
+    ids = [f"{scope}:{number}" for number in range(known + 1, version + 1)]
+    docs = await db.cache_invalidations.find({"_id": {"$in": ids}}).to_list(length=len(ids))
+    if len(docs) != len(ids):
+        return None
+    return sorted({key for doc in docs for key in doc["keys"]})
+
+
+async def poll_once() -> None:
+    """Aplica as invalidações publicadas por outros workers"""
+    db = get_database()
+    async for doc in db.cache_versions.find({}):
+        scope, version = doc["_id"], doc.get("version", 0)
+        known = _known_versions.get(scope, 0)
+        if version > known:
+            _known_versions[scope] = version
+            if scope in _key_handlers:
+                keys = await _published_keys(scope, known, version)
+                if keys is not None:
+                    await _run_key_handlers(scope, keys)
+                    continue
+            await _run_handlers(scope)
+
+
+async def _poll_loop() -> None:
+    while True:
+        await asyncio.sleep(settings.CACHE_SYNC_INTERVAL_SECONDS)
+        try:
+            await poll_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Falha no polling de invalidação de cache: {e}")
+
+
+async def start() -> None:
+    """Carrega as versões atuais e inicia o polling"""
+    global _poll_task, _epoch
+    await poll_once()
+    if not _diverged:
+        _epoch = "shared"
+    if _poll_task is None or _poll_task.done():
+        _poll_task = asyncio.create_task(_poll_loop())
+
+
+async def stop() -> None:
+    global _poll_task
+    if _poll_task is not None:
+        _poll_task.cancel()
+        _poll_task = None
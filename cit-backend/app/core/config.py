@@ -1,14 +1,171 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, Optional
 
 
 class Settings(BaseSettings):
     MONGODB_URL: str = "mongodb://localhost:27017"
     DATABASE_NAME: str = "cit"
+    MONGODB_MIN_POOL_SIZE: int = 5
     SECRET_KEY: str = "your-secret-key-here"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
-    
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 14
+
+    # Hashing de senhas (bcrypt)
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 32
+
+    # Readiness / warm-up
+    READINESS_CACHE_SECONDS: float = 2.0
+    READINESS_MONGO_TIMEOUT_SECONDS: float = 2.0
+
+    # Cache de usuários (documentos lidos por ID)
+    USER_CACHE_TTL_SECONDS: int = 30
+    USER_CACHE_MAX_SIZE: int = 1024
+
+    # Cache de empresas (lojas)
+    COMPANY_CACHE_TTL_SECONDS: int = 300
+    COMPANY_NEGATIVE_CACHE_SECONDS: int = 60
+
+    # Cache HTTP (ETag) do catálogo e das lojas
+    HTTP_CACHE_MAX_AGE: int = 60
+    HTTP_CACHE_STALE_WHILE_REVALIDATE: int = 300
+
+    # Compressão de respostas
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+
+    # Logging (json | text); LOG_SAMPLING mantém uma fração dos INFO/DEBUG por logger
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_SAMPLING: Dict[str, float] = {}
+
+    # Rate limiting (memory | mongo); RATE_LIMITS sobrescreve regras: {"login": "10/60"}
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_STORAGE: str = "memory"
+    RATE_LIMITS: Dict[str, str] = {}
+    # Com TRUST_PROXY a chave é o endereço PROXY_HOPS posições a partir da direita
+    # do X-Forwarded-For (o gravado pelo proxy mais externo; os da esquerda vêm do cliente)
+    RATE_LIMIT_TRUST_PROXY: bool = False
+    RATE_LIMIT_PROXY_HOPS: int = 1
+
+    # Proxies cujo X-Forwarded-For o uvicorn aceita (IPs separados por vírgula)
+    FORWARDED_ALLOW_IPS: str = "127.0.0.1"
+
+    # Produção com vários workers (0 = um por CPU disponível)
+    WEB_CONCURRENCY: int = 0
+    BACKGROUND_JOBS_ENABLED: bool = True
+    LEADER_LEASE_SECONDS: float = 30.0
+    LEADER_HEARTBEAT_SECONDS: float = 10.0
+    CACHE_SYNC_INTERVAL_SECONDS: float = 2.0
+    # Invalidações por chave (usuários): quanto tempo ficam gravadas e quantas
+    # versões um worker atrasado ainda lê antes de descartar o escopo inteiro
+    CACHE_SYNC_KEYED_RETENTION_SECONDS: int = 3600
+    CACHE_SYNC_MAX_KEYED_VERSIONS: int = 200
+
+    # Métricas Prometheus (GET /metrics); METRICS_TOKEN exige "Authorization: Bearer <token>"
+    METRICS_ENABLED: bool = True
+    METRICS_TOKEN: str = ""
+    METRICS_MULTIPROC_DIR: str = ""
+    METRICS_FLUSH_SECONDS: float = 15.0
+    METRICS_LOOP_LAG_INTERVAL_SECONDS: float = 0.5
+
+    # Log de consultas lentas (coleção limitada `slow_queries`)
+    SLOW_QUERY_ENABLED: bool = True
+    SLOW_QUERY_THRESHOLD_MS: float = 100.0
+    SLOW_QUERY_COLLECTION_SIZE_MB: int = 16
+    SLOW_QUERY_BUFFER_SIZE: int = 1000
+    SLOW_QUERY_FLUSH_SECONDS: float = 5.0
+
+    # Profiling sob demanda (endpoints /admin/profile)
+    PROFILE_MAX_SECONDS: float = 30.0
+    PROFILE_MAX_DISTINCT_STACKS: int = 20000
+    PROFILE_TRACEMALLOC_MAX_SECONDS: float = 300.0
+    PROFILE_MAX_SNAPSHOTS: int = 5
+
+    # Tracing: spans amostrados exportados em OTLP/JSON (coletor ou arquivo);
+    # TRACING_SERVER_TIMING expõe as durações no header Server-Timing
+    TRACING_ENABLED: bool = False
+    TRACING_SAMPLE_RATE: float = 0.01
+    TRACING_SERVER_TIMING: bool = False
+    TRACING_SERVICE_NAME: str = "cit-api"
+    TRACING_OTLP_ENDPOINT: str = ""
+    TRACING_EXPORT_FILE: str = "traces.jsonl"
+    TRACING_EXPORT_FILE_MAX_MB: int = 50
+    TRACING_FLUSH_SECONDS: float = 5.0
+
+    # Pedidos em lote (POST /client/orders/bulk): máximo de vouchers por carrinho
+    BULK_ORDER_MAX_UNITS: int = 500
+    # Pedidos/lotes pagos cuja entrega (horas ou códigos) não terminou são refeitos pelo líder
+    FULFILLMENT_RECOVERY_INTERVAL_SECONDS: float = 60.0
+    FULFILLMENT_RECOVERY_GRACE_SECONDS: float = 120.0
+    FULFILLMENT_RECOVERY_BATCH_SIZE: int = 100
+
+    # Estoque de códigos de acesso (pedidos com fulfillment "code"), reposto pelo líder
+    ACCESS_CODE_LENGTH: int = 10
+    ACCESS_CODE_POOL_TARGET: int = 5000
+    ACCESS_CODE_POOL_LOW_WATERMARK: int = 1000
+    ACCESS_CODE_BATCH_SIZE: int = 1000
+    ACCESS_CODE_REFILL_INTERVAL_SECONDS: float = 30.0
+
+    # Filtro de Bloom do resgate de códigos no portal (POST /portal/redeem)
+    PORTAL_FILTER_ERROR_RATE: float = 0.001
+    PORTAL_FILTER_MIN_CAPACITY: int = 100_000
+    PORTAL_FILTER_REFRESH_SECONDS: float = 2.0
+    PORTAL_FILTER_REBUILD_SECONDS: float = 3600.0
+
+    # Controladores de hotspot: {"nome": "chave"} aceitas no header X-API-Key
+    CONTROLLER_API_KEYS: Dict[str, str] = {}
+
+    # Medição de uso (POST /controller/usage): gravação em lote na coleção time-series
+    USAGE_FLUSH_MAX_EVENTS: int = 5000
+    USAGE_FLUSH_INTERVAL_SECONDS: float = 1.0
+    USAGE_MAX_EVENTS_PER_REQUEST: int = 1000
+    USAGE_MAX_EVENT_SECONDS: float = 86400.0
+    USAGE_LEASE_SECONDS: float = 60.0
+    USAGE_RETENTION_DAYS: int = 400
+    USAGE_DEDUP_DAYS: int = 7
+
+    # Autorização dos controladores (GET /controller/authorize): índice de saldo em memória
+    BALANCE_INDEX_MAX_SIZE: int = 200_000
+    BALANCE_INDEX_TTL_SECONDS: float = 5.0
+    BALANCE_INDEX_NEGATIVE_TTL_SECONDS: float = 30.0
+    AUTHORIZE_RECHECK_SECONDS: int = 60
+
+    # Expiração de pedidos pendentes: prazo da cobrança PIX + tolerância para webhooks atrasados
+    ORDER_PAYMENT_WINDOW_MINUTES: int = 60
+    ORDER_EXPIRY_GRACE_MINUTES: int = 10
+    ORDER_EXPIRY_INTERVAL_SECONDS: float = 60.0
+    ORDER_EXPIRY_BATCH_SIZE: int = 500
+    ORDER_EXPIRY_MAX_ROUNDS: int = 20
+
+    # Arquivamento de pedidos finalizados antigos (orders -> orders_archive)
+    ARCHIVE_AFTER_MONTHS: int = 12
+    ARCHIVE_BATCH_SIZE: int = 1000
+    ARCHIVE_MAX_BATCHES: int = 50
+    ARCHIVE_INTERVAL_SECONDS: float = 3600.0
+    ARCHIVE_SUMMARY_CACHE_SIZE: int = 10_000
+    ARCHIVE_SUMMARY_CACHE_TTL_SECONDS: float = 3600.0
+
+    # Cubo de vendas (GET /admin/analytics/cube): pool de processos e cache pela marca d'água
+    ANALYTICS_WORKERS: int = 1
+    ANALYTICS_MIN_REFRESH_SECONDS: float = 60.0
+    ANALYTICS_FETCH_BATCH_SIZE: int = 10_000
+    ANALYTICS_CACHE_SIZE: int = 256
+    ANALYTICS_CACHE_TTL_SECONDS: float = 3600.0
+
+    # Livro de horas: chaves recentes guardadas no usuário e compactação em snapshots
+    LEDGER_RECENT_KEYS: int = 50
+    LEDGER_CAS_ATTEMPTS: int = 5
+    LEDGER_APPLY_GRACE_SECONDS: float = 60.0
+    LEDGER_FOLD_AFTER_HOURS: float = 720.0
+    LEDGER_COMPACT_BATCH_SIZE: int = 5000
+    LEDGER_COMPACT_INTERVAL_SECONDS: float = 300.0
+
     # Mercado Pago
     MERCADOPAGO_ACCESS_TOKEN: str = ""
     MERCADOPAGO_PUBLIC_KEY: str = ""
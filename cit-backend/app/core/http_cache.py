@@ -0,0 +1,106 @@
+"""
+Cache HTTP condicional (ETag / If-None-Match) baseado em versões de dados
+
+Cada escopo ("catalog", "company") tem um contador incrementado sempre que
+os dados mudam, compartilhado entre os workers via app.core.cache_sync. O
+ETag é derivado apenas das versões e da URL, então uma requisição
+condicional pode ser respondida com 304 sem tocar no MongoDB.
+Os corpos dessas respostas ficam em cache já serializados e comprimidos
+(identity / gzip / br) enquanto o ETag não muda. Como as três
+representações compartilham o ETag, ele é fraco (W/"..."): um ETag forte
+teria de ser diferente para cada codificação.
+"""
+import hashlib
+from typing import Awaitable, Callable, Dict, Tuple
+from fastapi import Request, Response
+from app.core import cache_sync
+from app.core.cache import TTLCache
+from app.core.compression import choose_encoding, compress
+from app.core.config import settings
+from app.core.serialization import dumps
+
+def compute_etag(*scopes: str, key: str = "") -> str:
+    """Gera um ETag fraco a partir das versões dos escopos e de uma chave (ex.: slug)"""
+    versions = "-".join(f"{scope}{cache_sync.get_version(scope)}" for scope in scopes)
+    # Com as versões sincronizadas, todos os workers geram o mesmo ETag
+    digest = hashlib.blake2b(f"{cache_sync.epoch()}:{versions}:{key}".encode(), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """
+    Verifica se o If-None-Match da requisição corresponde ao ETag atual
+    (comparação fraca). `*` não conta aqui: ver matches_any_etag.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+def matches_any_etag(request: Request) -> bool:
+    """If-None-Match: * (vale para qualquer versão, mas só de um recurso que existe)"""
+    return request.headers.get("if-none-match", "").strip() == "*"
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    """Headers de cache aplicados às respostas cacheáveis"""
+    return {
+        "ETag": etag,
+        "Cache-Control": (
+            f"public, max-age={settings.HTTP_CACHE_MAX_AGE}, "
+            f"stale-while-revalidate={settings.HTTP_CACHE_STALE_WHILE_REVALIDATE}"
+        ),
+    }
+
+
+def not_modified_response(etag: str) -> Response:
+    """Resposta 304 sem corpo"""
+    return Response(status_code=304, headers=cache_headers(etag))
+
+
+# path -> (etag, {codificação: corpo})
+_bodies = TTLCache(maxsize=1024, ttl=3600)
+
+
+async def cached_json_response(
+    request: Request,
+    scopes: Tuple[str, ...],
+    build: Callable[[], Awaitable[object]]
+) -> Response:
+    """
+    Resposta JSON cacheável: 304 se o cliente já tem a versão atual, senão
+    o corpo pré-comprimido do cache (montado por `build` apenas na primeira vez)
+    """
+    key = request.url.path
+    etag = compute_etag(*scopes, key=key)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+
+    entry = _bodies.get(key)
+    if entry is None or entry[0] != etag:
+        entry = (etag, {"identity": dumps(await build())})
+        _bodies.set(key, entry)
+    variants = entry[1]
+
+    # Só depois de montar o corpo (ou achá-lo em cache): recurso inexistente já respondeu 404
+    if matches_any_etag(request):
+        return not_modified_response(etag)
+
+    headers = cache_headers(etag)
+    headers["Vary"] = "Accept-Encoding"
+
+    encoding = None
+    if settings.COMPRESSION_ENABLED and len(variants["identity"]) >= settings.COMPRESSION_MINIMUM_SIZE:
+        encoding = choose_encoding(request.headers.get("accept-encoding"))
+
+    if encoding is None:
+        body = variants["identity"]
+    else:
+        body = variants.get(encoding)
+        if body is None:
+            body = variants[encoding] = compress(variants["identity"], encoding, best=True)
+        headers["Content-Encoding"] = encoding
+
+    return Response(content=body, media_type="application/json", headers=headers)
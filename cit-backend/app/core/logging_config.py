@@ -0,0 +1,194 @@
+"""
+Logging estruturado e não bloqueante
+
+As corrotinas apenas enfileiram o registro (QueueHandler com fila limitada;
+se a fila encher, o registro é descartado e contado). Uma thread
+(QueueListener) formata em JSON, aplica a redação de dados de cartão e
+PII e escreve no stdout.
+
+LOG_SAMPLING define a fração mantida dos registros abaixo de WARNING por
+logger, ex.: {"app.routes.webhooks": 0.1}. WARNING e acima nunca são
+amostrados.
+"""
+import atexit
+import copy
+import logging
+import queue
+import random
+import re
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+import orjson
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.request_context import current_route
+
+# Chaves cujo valor nunca deve aparecer nos logs
+SENSITIVE_KEYS = {
+    "password", "password_hash", "token", "access_token", "refresh_token", "authorization",
+    "card_number", "security_code", "cvv", "card_token", "identification_number", "cpf",
+    "first_six_digits", "expiration_month", "expiration_year", "email", "payer_email",
+    "identification", "cardholder"
+}
+
+_KEY_VALUE = re.compile(
+    r"""(["']?(?:%s)["']?\s*[:=]\s*)(["']?)[^,'"}\s]+""" % "|".join(sorted(SENSITIVE_KEYS, key=len, reverse=True)),
+    re.IGNORECASE
+)
+_CARD_NUMBER = re.compile(r"\b(?:\d[ -]?){9,15}(\d{4})\b")
+# Só o CPF formatado: 11 dígitos soltos colidiriam com IDs de pagamento
+_CPF = re.compile(r"\b\d{3}\.\d{3}\.\d{3}-\d{2}\b")
+_EMAIL = re.compile(r"\b([A-Za-z0-9._%+-])[A-Za-z0-9._%+-]*@([A-Za-z0-9.-]+\.[A-Za-z]{2,})\b")
+
+REDACTED = "[REDACTED]"
+
+# Atributos padrão do LogRecord; o restante (extra=...) vai para o JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "route"}
+
+
+def redact_text(text: str) -> str:
+    text = _KEY_VALUE.sub(lambda m: f"{m.group(1)}{m.group(2)}{REDACTED}", text)
+    text = _CARD_NUMBER.sub(lambda m: f"****{m.group(1)}", text)
+    text = _CPF.sub(REDACTED, text)
+    return _EMAIL.sub(lambda m: f"{m.group(1)}***@{m.group(2)}", text)
+
+
+def redact(value: Any) -> Any:
+    """Redige recursivamente dicts/listas vindos de `extra`"""
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if str(key).lower() in SENSITIVE_KEYS else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        return redact_text(value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact_text(record.getMessage()),
+        }
+        route = getattr(record, "route", None)
+        if route:
+            entry["route"] = route
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = REDACTED if key.lower() in SENSITIVE_KEYS else redact(value)
+        if record.exc_info:
+            entry["exception"] = redact_text(self.formatException(record.exc_info))
+        return orjson.dumps(entry, default=str).decode()
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legível para desenvolvimento, com a mesma redação"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        return redact_text(super().format(record))
+
+
+class SamplingQueueHandler(QueueHandler):
+    """Amostra e enfileira sem bloquear; formatação fica com a thread do listener"""
+
+    def __init__(self, log_queue: queue.Queue, sampling: Dict[str, float]):
+        super().__init__(log_queue)
+        self.sampling = sampling
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def _sample_rate(self, name: str) -> Optional[float]:
+        # O logger mais específico configurado vale ("app.routes" cobre "app.routes.webhooks")
+        while name:
+            rate = self.sampling.get(name)
+            if rate is not None:
+                return rate
+            name = name.rpartition(".")[0]
+        return None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.levelno < logging.WARNING and self.sampling:
+            rate = self._sample_rate(record.name)
+            if rate is not None and random.random() >= rate:
+                self.sampled_out += 1
+                return
+        try:
+            self.enqueue(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self.queue.put_nowait(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve a mensagem agora (os args podem mudar depois), mas deixa
+        # JSON, redação e traceback para a thread de escrita
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.route = current_route()
+        return record
+
+    def prometheus(self) -> list:
+        return [{
+            "name": "log_records_discarded_total",
+            "type": "counter",
+            "help": "Registros de log descartados por fila cheia ou amostragem",
+            "labelnames": ["reason"],
+            "values": [[["queue_full"], self.dropped], [["sampled"], self.sampled_out]]
+        }]
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging() -> None:
+    """Configura o logger raiz (idempotente) e redireciona os loggers do uvicorn"""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if settings.LOG_FORMAT == "json" else TextFormatter())
+
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    handler = SamplingQueueHandler(log_queue, settings.LOG_SAMPLING)
+    registry.add_collector(handler.prometheus)
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(settings.LOG_LEVEL.upper())
+
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+    # Cada requisição do httpx gera um INFO; só interessa a partir de WARNING
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Esvazia a fila e para a thread de escrita"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
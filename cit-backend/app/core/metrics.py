@@ -0,0 +1,402 @@
+"""
+Métricas no formato de exposição do Prometheus (GET /metrics)
+
+Os valores ficam em shards por thread: o event loop e as threads do Motor
+(onde rodam os listeners do PyMongo) escrevem cada um no seu dicionário,
+sem locks no caminho quente. A leitura soma os shards.
+
+Com vários workers (app.server), cada processo grava um snapshot periódico
+em METRICS_MULTIPROC_DIR e o worker que atende /metrics agrega todos.
+"""
+import asyncio
+import glob
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import orjson
+from pymongo import monitoring
+from app.core.config import settings
+from app.core.request_context import bind_request
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+Labels = Tuple[str, ...]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "values", None)
+        if shard is None:
+            shard = self._local.values = {}
+            self._shards.append(shard)  # list.append é atômico no CPython
+        return shard
+
+    def _items(self) -> Iterable[Tuple[Labels, object]]:
+        for shard in list(self._shards):
+            yield from list(shard.items())
+
+    def snapshot(self) -> dict:
+        return {
+            "type": self.kind,
+            "help": self.documentation,
+            "labelnames": list(self.labelnames),
+            "values": [[list(labels), value] for labels, value in self._collect().items()]
+        }
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def _collect(self) -> Dict[Labels, float]:
+        totals: Dict[Labels, float] = {}
+        for labels, value in self._items():
+            totals[labels] = totals.get(labels, 0.0) + value
+        return totals
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        self._shard()[labels] = value
+
+    def _collect(self) -> Dict[Labels, float]:
+        return dict(self._items())
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        # [contagem por bucket..., +Inf, soma]
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _collect(self) -> Dict[Labels, list]:
+        totals: Dict[Labels, list] = {}
+        for labels, counts in self._items():
+            current = totals.get(labels)
+            if current is None:
+                totals[labels] = list(counts)
+            else:
+                totals[labels] = [a + b for a, b in zip(current, counts)]
+        return totals
+
+    def snapshot(self) -> dict:
+        data = super().snapshot()
+        data["buckets"] = list(self.buckets)
+        return data
+
+
+class Registry:
+    """Métricas do processo e coletores avaliados no momento da leitura"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], List[dict]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[dict]]) -> None:
+        """
+        Registra uma função que devolve métricas prontas, no mesmo formato de
+        `snapshot()`: [{"name", "type", "help", "labelnames", "values"}]
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self) -> Dict[str, dict]:
+        data = {metric.name: metric.snapshot() for metric in self._metrics}
+        for collector in self._collectors:
+            try:
+                for metric in collector():
+                    data[metric.pop("name")] = metric
+            except Exception as e:
+                logger.warning(f"Erro em coletor de métricas: {e}")
+        return data
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "Latência das requisições HTTP", ("method", "route", "status")
+)
+mongo_command_duration = registry.histogram(
+    "mongodb_command_duration_seconds", "Duração dos comandos do MongoDB", ("collection", "command")
+)
+mongo_command_failures = registry.counter(
+    "mongodb_command_failures_total", "Comandos do MongoDB que falharam", ("collection", "command")
+)
+mercadopago_request_duration = registry.histogram(
+    "mercadopago_request_duration_seconds", "Latência das chamadas à API do Mercado Pago", ("method", "endpoint", "outcome")
+)
+webhook_lag = registry.histogram(
+    "webhook_lag_seconds", "Atraso entre a criação do evento no Mercado Pago e o processamento", ("type",), LAG_BUCKETS
+)
+access_code_redemptions = registry.counter(
+    "access_code_redemptions_total", "Tentativas de resgate de código no portal", ("result",)
+)
+usage_events = registry.counter(
+    "usage_events_total", "Eventos de uso recebidos dos controladores", ("result",)
+)
+order_expirations = registry.counter(
+    "order_expirations_total", "Pedidos e lotes pendentes expirados pela tarefa do líder", ("kind",)
+)
+event_loop_lag = registry.histogram(
+    "event_loop_lag_seconds", "Atraso do event loop em relação ao agendamento", (), LOOP_LAG_BUCKETS
+)
+
+
+# ---------------------------------------------------------------------------
+# Exposição (formato texto 0.0.4)
+# ---------------------------------------------------------------------------
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _merge(snapshots: List[Tuple[str, Dict[str, dict]]]) -> Dict[str, dict]:
+    """Soma contadores e histogramas; gauges recebem o label `pid`"""
+    merged: Dict[str, dict] = {}
+    for pid, snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = {key: value for key, value in metric.items() if key != "values"}
+                target["values"] = {}
+                if metric["type"] == "gauge" and len(snapshots) > 1:
+                    target["labelnames"] = list(metric["labelnames"]) + ["pid"]
+            for labels, value in metric["values"]:
+                if metric["type"] == "gauge":
+                    key = tuple(labels) + ((pid,) if len(snapshots) > 1 else ())
+                    target["values"][key] = value
+                    continue
+                key = tuple(labels)
+                current = target["values"].get(key)
+                if current is None:
+                    target["values"][key] = value
+                elif isinstance(value, list):
+                    target["values"][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target["values"][key] = current + value
+    return merged
+
+
+def render_text(metrics: Dict[str, dict]) -> str:
+    lines = []
+    for name in sorted(metrics):
+        metric = metrics[name]
+        names = metric["labelnames"]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for labels, value in sorted(metric["values"].items()):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(names, labels)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + [float("inf")], value[:-1]):
+                cumulative += count
+                le = ("le", _format_value(bound))
+                lines.append(f"{name}_bucket{_format_labels(names, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(names, labels)} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{_format_labels(names, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(settings.METRICS_MULTIPROC_DIR, f"metrics-{pid}.json")
+
+
+def write_snapshot() -> None:
+    """Grava o snapshot deste worker (escrita atômica via rename)"""
+    path = _snapshot_path(os.getpid())
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps({"written_at": time.time(), "metrics": registry.snapshot()}))
+    os.replace(tmp, path)
+
+
+def _read_snapshots() -> List[Tuple[str, Dict[str, dict]]]:
+    own_pid = str(os.getpid())
+    snapshots = [(own_pid, registry.snapshot())]
+    if not settings.METRICS_MULTIPROC_DIR:
+        return snapshots
+
+    stale_after = settings.METRICS_FLUSH_SECONDS * 3
+    now = time.time()
+    for path in glob.glob(os.path.join(settings.METRICS_MULTIPROC_DIR, "metrics-*.json")):
+        pid = os.path.basename(path)[len("metrics-"):-len(".json")]
+        if pid == own_pid:
+            continue
+        try:
+            with open(path, "rb") as f:
+                data = orjson.loads(f.read())
+        except (OSError, ValueError):
+            continue
+        metrics = data["metrics"]
+        if now - data["written_at"] > stale_after:
+            # Worker encerrado: mantém os acumulados, descarta os gauges
+            metrics = {name: metric for name, metric in metrics.items() if metric["type"] != "gauge"}
+        snapshots.append((pid, metrics))
+    return snapshots
+
+
+def render() -> str:
+    """Texto de /metrics com os valores de todos os workers"""
+    return render_text(_merge(_read_snapshots()))
+
+
+# ---------------------------------------------------------------------------
+# Instrumentação
+# ---------------------------------------------------------------------------
+
+class MetricsMiddleware:
+    """Mede a latência por template de rota (ex.: /payment/status/{order_id}) e status"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Também identifica a rota para os listeners do MongoDB
+        bind_request(scope)
+        if not settings.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Rotas inexistentes ficam agrupadas para não explodir a cardinalidade
+            template = getattr(route, "path", None) or "unmatched"
+            http_request_duration.observe(
+                time.perf_counter() - start, scope["method"], template, str(status_code)
+            )
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Duração dos comandos por coleção e operação (roda nas threads do Motor)"""
+
+    def __init__(self):
+        self._collections: Dict[Tuple[object, int], str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            # getMore traz o ID do cursor; a coleção vem em "collection"
+            target = event.command.get("collection", "")
+        self._collections[(event.connection_id, event.request_id)] = target or "-"
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        collection = self._collections.pop((event.connection_id, event.request_id), "-")
+        mongo_command_duration.observe(event.duration_micros / 1_000_000, collection, event.command_name)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        collection = self._collections.pop((event.connection_id, event.request_id), "-")
+        mongo_command_duration.observe(event.duration_micros / 1_000_000, collection, event.command_name)
+        mongo_command_failures.inc(collection, event.command_name)
+
+
+_monitor_task: Optional[asyncio.Task] = None
+
+
+async def _monitor_loop() -> None:
+    interval = settings.METRICS_LOOP_LAG_INTERVAL_SECONDS
+    last_flush = time.monotonic()
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        event_loop_lag.observe(max(0.0, now - start - interval))
+
+        if settings.METRICS_MULTIPROC_DIR and now - last_flush >= settings.METRICS_FLUSH_SECONDS:
+            last_flush = now
+            try:
+                write_snapshot()
+            except OSError as e:
+                logger.warning(f"Erro ao gravar snapshot de métricas: {e}")
+
+
+def start_monitor() -> None:
+    """Inicia a medição do atraso do event loop e a gravação dos snapshots"""
+    global _monitor_task
+    if settings.METRICS_ENABLED and (_monitor_task is None or _monitor_task.done()):
+        _monitor_task = asyncio.create_task(_monitor_loop())
+
+
+async def stop_monitor() -> None:
+    global _monitor_task
+    if _monitor_task is not None:
+        _monitor_task.cancel()
+        _monitor_task = None
+    if settings.METRICS_ENABLED and settings.METRICS_MULTIPROC_DIR:
+        try:
+            write_snapshot()
+        except OSError:
+            pass
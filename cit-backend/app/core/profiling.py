@@ -0,0 +1,203 @@
+"""
+Profiling sob demanda do worker em execução (endpoints admin)
+
+CPU: uma thread amostra `sys._current_frames()` em intervalo fixo durante
+um tempo limitado e agrega as pilhas no formato "collapsed" (uma linha por
+pilha: "raiz;...;folha contagem"), aceito por flamegraph.pl e speedscope.
+
+Memória: tracemalloc ligado sob demanda, com snapshots numerados, top de
+alocações por linha e diff entre snapshots. O tracemalloc desliga sozinho
+após PROFILE_TRACEMALLOC_MAX_SECONDS, já que deixa as alocações mais lentas.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, status
+from app.core.config import settings
+
+MIN_INTERVAL_MS = 5.0
+MAX_STACK_DEPTH = 128
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class CpuProfiler:
+    """Profiler por amostragem; um por worker de cada vez"""
+
+    _lock = threading.Lock()
+
+    def __init__(self, seconds: float, interval_ms: float, all_threads: bool):
+        self.seconds = seconds
+        self.interval = interval_ms / 1000
+        self.all_threads = all_threads
+        # Thread do event loop (quem chamou), a única amostrada por padrão
+        self.target_thread = threading.get_ident()
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+        self.truncated = False
+
+    def _sample(self, own_ident: int) -> None:
+        frames = sys._current_frames()
+        for ident, frame in frames.items():
+            if ident == own_ident or (not self.all_threads and ident != self.target_thread):
+                continue
+            labels: List[str] = []
+            while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            key = ";".join(reversed(labels))
+            if key not in self.stacks and len(self.stacks) >= settings.PROFILE_MAX_DISTINCT_STACKS:
+                self.truncated = True
+                continue
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        next_tick = time.monotonic()
+        while time.monotonic() < deadline:
+            self._sample(own_ident)
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Amostragem atrasada: não tenta compensar (limita o overhead)
+                next_tick = time.monotonic()
+
+    async def run(self) -> str:
+        if not self._lock.acquire(blocking=False):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Já existe um profiling de CPU em andamento neste worker"
+            )
+        try:
+            thread = threading.Thread(target=self._run, name="cpu-profiler", daemon=True)
+            thread.start()
+            # O event loop continua atendendo requisições enquanto é amostrado
+            while thread.is_alive():
+                await asyncio.sleep(0.1)
+        finally:
+            self._lock.release()
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        lines = [f"{stack} {count}" for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1])]
+        return "\n".join(lines) + "\n"
+
+
+class MemoryProfiler:
+    """Snapshots do tracemalloc com limite de quantidade e de tempo ligado"""
+
+    _snapshots: Dict[int, tracemalloc.Snapshot] = {}
+    _next_id: int = 1
+    _stop_handle: Optional[asyncio.TimerHandle] = None
+
+    @classmethod
+    def start(cls, frames: int) -> dict:
+        if tracemalloc.is_tracing():
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="tracemalloc já está ativo")
+        tracemalloc.start(frames)
+        cls._stop_handle = asyncio.get_running_loop().call_later(
+            settings.PROFILE_TRACEMALLOC_MAX_SECONDS, cls.stop
+        )
+        return {"tracing": True, "frames": frames, "auto_stop_seconds": settings.PROFILE_TRACEMALLOC_MAX_SECONDS}
+
+    @classmethod
+    def stop(cls) -> dict:
+        if cls._stop_handle is not None:
+            cls._stop_handle.cancel()
+            cls._stop_handle = None
+        tracemalloc.stop()
+        cls._snapshots.clear()
+        return {"tracing": False}
+
+    @classmethod
+    def status(cls) -> dict:
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "snapshots": sorted(cls._snapshots),
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "overhead_bytes": tracemalloc.get_tracemalloc_memory()
+        }
+
+    @staticmethod
+    def _filtered(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+        return snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    @classmethod
+    async def take_snapshot(cls, top: int) -> dict:
+        if not tracemalloc.is_tracing():
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="tracemalloc não está ativo")
+
+        # Copiar os traces pode levar centenas de ms: fora do event loop
+        snapshot = await asyncio.to_thread(lambda: cls._filtered(tracemalloc.take_snapshot()))
+        snapshot_id = cls._next_id
+        cls._next_id += 1
+        cls._snapshots[snapshot_id] = snapshot
+        # Mantém só os mais recentes: cada snapshot ocupa memória proporcional às alocações
+        while len(cls._snapshots) > settings.PROFILE_MAX_SNAPSHOTS:
+            cls._snapshots.pop(min(cls._snapshots))
+
+        stats = await asyncio.to_thread(snapshot.statistics, "lineno")
+        return {
+            "snapshot_id": snapshot_id,
+            "total_bytes": sum(stat.size for stat in stats),
+            "top": [cls._stat_to_dict(stat) for stat in stats[:top]]
+        }
+
+    @classmethod
+    async def diff(cls, base_id: int, current_id: int, top: int) -> dict:
+        base = cls._snapshots.get(base_id)
+        current = cls._snapshots.get(current_id)
+        if base is None or current is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot não encontrado")
+
+        stats = await asyncio.to_thread(current.compare_to, base, "lineno")
+        return {
+            "base": base_id,
+            "current": current_id,
+            "size_diff_bytes": sum(stat.size_diff for stat in stats),
+            "top": [
+                {
+                    "location": cls._location(stat.traceback),
+                    "size_diff_bytes": stat.size_diff,
+                    "size_bytes": stat.size,
+                    "count_diff": stat.count_diff
+                }
+                for stat in stats[:top]
+            ]
+        }
+
+    @staticmethod
+    def _location(traceback: tracemalloc.Traceback) -> str:
+        frame = traceback[0]
+        return f"{frame.filename}:{frame.lineno}"
+
+    @classmethod
+    def _stat_to_dict(cls, stat: tracemalloc.Statistic) -> dict:
+        return {"location": cls._location(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+
+
+def clamp_cpu_args(seconds: float, interval_ms: float) -> Tuple[float, float]:
+    """Aplica os limites de duração e de frequência de amostragem"""
+    if seconds <= 0 or seconds > settings.PROFILE_MAX_SECONDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Duração deve estar entre 0 e {settings.PROFILE_MAX_SECONDS} segundos"
+        )
+    return seconds, max(interval_ms, MIN_INTERVAL_MS)
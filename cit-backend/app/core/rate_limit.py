@@ -0,0 +1,236 @@
+"""
+Rate limiting por rota com token buckets
+
+Cada regra define um balde (capacidade + taxa de reposição) e a chave usada
+para separar os clientes: IP, usuário autenticado ou slug da loja.
+Os baldes ficam em memória por padrão; com RATE_LIMIT_STORAGE=mongo são
+compartilhados entre workers pela coleção `rate_limits`.
+"""
+import math
+import re
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from starlette.responses import JSONResponse
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.security import decode_access_token
+from app.database.mongo import get_database
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitRule:
+    """Regra de limite para um método + template de rota"""
+
+    def __init__(self, name: str, method: str, path: str, key: str, capacity: int, period_seconds: float):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.key = key  # ip | user | slug
+        self.capacity = capacity
+        self.refill_per_second = capacity / period_seconds
+        # Converte "/store/{slug}/vouchers" em regex com grupos nomeados
+        pattern = re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", path)
+        self.regex = re.compile(f"^{pattern}$")
+
+    def match(self, method: str, path: str) -> Optional[Dict[str, str]]:
+        if method != self.method:
+            return None
+        found = self.regex.match(path)
+        return found.groupdict() if found else None
+
+
+# Limites padrão: "capacidade/período em segundos" (sobrescritos por RATE_LIMITS)
+DEFAULT_RULES = [
+    ("login", "POST", "/auth/login", "ip", "10/60"),
+    ("register", "POST", "/auth/register", "ip", "5/60"),
+    ("refresh", "POST", "/auth/refresh", "ip", "30/60"),
+    ("create_order", "POST", "/client/orders", "user", "20/60"),
+    ("create_bulk_order", "POST", "/client/orders/bulk", "user", "5/60"),
+    ("portal_redeem", "POST", "/portal/redeem", "user", "30/60"),
+    ("store_info", "GET", "/store/{slug}", "ip", "120/60"),
+    ("store_vouchers", "GET", "/store/{slug}/vouchers", "ip", "120/60"),
+    ("store_voucher", "GET", "/store/{slug}/voucher/{voucher_id}", "ip", "120/60"),
+]
+
+
+def build_rules() -> List[RateLimitRule]:
+    """Monta as regras a partir dos padrões e das sobrescritas da configuração"""
+    rules = []
+    for name, method, path, key, spec in DEFAULT_RULES:
+        spec = settings.RATE_LIMITS.get(name, spec)
+        capacity, period = spec.split("/")
+        rules.append(RateLimitRule(name, method, path, key, int(capacity), float(period)))
+    return rules
+
+
+class MemoryBucketStore:
+    """Token buckets mantidos na memória do processo"""
+
+    MAX_KEYS = 100_000
+
+    def __init__(self):
+        self._buckets: Dict[str, List[float]] = {}
+
+    async def consume(self, key: str, rule: RateLimitRule) -> Tuple[bool, float]:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_KEYS:
+                self._prune(now)
+            bucket = self._buckets[key] = [float(rule.capacity), now]
+
+        tokens = min(rule.capacity, bucket[0] + (now - bucket[1]) * rule.refill_per_second)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return True, 0.0
+
+        bucket[0] = tokens
+        return False, (1 - tokens) / rule.refill_per_second
+
+    def _prune(self, now: float) -> None:
+        """Descarta baldes sem uso recente (que já estariam cheios)"""
+        stale = [key for key, (_, last) in self._buckets.items() if now - last > 3600]
+        for key in stale:
+            del self._buckets[key]
+        if len(self._buckets) >= self.MAX_KEYS:
+            self._buckets.clear()
+
+
+class MongoBucketStore:
+    """Token buckets compartilhados entre workers na coleção `rate_limits`"""
+
+    async def consume(self, key: str, rule: RateLimitRule) -> Tuple[bool, float]:
+        db = get_database()
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}, 1000]}
+        refilled = {"$add": [{"$ifNull": ["$tokens", rule.capacity]}, {"$multiply": [elapsed, rule.refill_per_second]}]}
+        pipeline = [
+            {"$set": {"tokens": {"$min": [rule.capacity, refilled]}, "updated_at": "$$NOW"}},
+            {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+            {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}}
+        ]
+
+        try:
+            bucket = await db.rate_limits.find_one_and_update(
+                {"_id": key},
+                pipeline,
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except PyMongoError as e:
+            # Falha aberta: indisponibilidade do store não deve derrubar a API
+            logger.warning(f"Rate limit indisponível ({key}): {e}")
+            return True, 0.0
+
+        if bucket["allowed"]:
+            return True, 0.0
+        return False, (1 - bucket["tokens"]) / rule.refill_per_second
+
+
+class RateLimitCounters:
+    """Contadores de requisições permitidas/bloqueadas por regra"""
+
+    def __init__(self):
+        self.allowed: Dict[str, int] = {}
+        self.limited: Dict[str, int] = {}
+
+    def snapshot(self) -> dict:
+        names = sorted(set(self.allowed) | set(self.limited))
+        return {
+            name: {"allowed": self.allowed.get(name, 0), "limited": self.limited.get(name, 0)}
+            for name in names
+        }
+
+    def prometheus(self) -> list:
+        """Os mesmos números no formato dos coletores de app.core.metrics"""
+        values = [[[name, "allowed"], count] for name, count in self.allowed.items()]
+        values += [[[name, "limited"], count] for name, count in self.limited.items()]
+        return [{
+            "name": "rate_limit_requests_total",
+            "type": "counter",
+            "help": "Requisições avaliadas pelo rate limit, por regra e resultado",
+            "labelnames": ["rule", "result"],
+            "values": values
+        }]
+
+
+rate_limit_counters = RateLimitCounters()
+registry.add_collector(rate_limit_counters.prometheus)
+
+
+def get_client_ip(scope) -> str:
+    """
+    Retorna o IP do cliente. Com RATE_LIMIT_TRUST_PROXY, usa o endereço que
+    o proxy mais externo acrescentou ao X-Forwarded-For: as entradas à
+    esquerda dele vêm do próprio cliente e não servem de chave.
+    """
+    if settings.RATE_LIMIT_TRUST_PROXY:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                addresses = [item.strip() for item in value.decode("latin-1").split(",") if item.strip()]
+                hops = max(1, settings.RATE_LIMIT_PROXY_HOPS)
+                if len(addresses) >= hops:
+                    return addresses[-hops]
+                break
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def get_user_key(scope) -> Optional[str]:
+    """Extrai o ID do usuário do token Bearer (sem consultar o banco)"""
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer":
+                return None
+            payload = decode_access_token(token)
+            if payload:
+                return payload.get("uid") or payload.get("sub")
+    return None
+
+
+class RateLimitMiddleware:
+    """Middleware ASGI que aplica os token buckets antes do roteamento"""
+
+    def __init__(self, app, rules: Optional[List[RateLimitRule]] = None):
+        self.app = app
+        self.rules = rules if rules is not None else build_rules()
+        self.store = MongoBucketStore() if settings.RATE_LIMIT_STORAGE == "mongo" else MemoryBucketStore()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.RATE_LIMIT_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        for rule in self.rules:
+            params = rule.match(scope["method"], scope["path"])
+            if params is not None:
+                break
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        if rule.key == "user":
+            key = get_user_key(scope) or get_client_ip(scope)
+        elif rule.key == "slug":
+            key = params.get("slug", "")
+        else:
+            key = get_client_ip(scope)
+
+        allowed, retry_after = await self.store.consume(f"{rule.name}:{key}", rule)
+        if allowed:
+            rate_limit_counters.allowed[rule.name] = rate_limit_counters.allowed.get(rule.name, 0) + 1
+            await self.app(scope, receive, send)
+            return
+
+        rate_limit_counters.limited[rule.name] = rate_limit_counters.limited.get(rule.name, 0) + 1
+        response = JSONResponse(
+            {"detail": "Muitas requisições. Tente novamente em instantes."},
+            status_code=429,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        await response(scope, receive, send)
@@ -0,0 +1,32 @@
+"""
+Contexto da requisição em andamento (contextvars)
+
+O Motor copia o contexto para as threads onde executa o PyMongo, então os
+listeners de comandos conseguem saber qual rota (ou tarefa em segundo
+plano) originou cada consulta.
+"""
+from contextvars import ContextVar
+from typing import Optional
+
+_request_scope: ContextVar[Optional[dict]] = ContextVar("request_scope", default=None)
+_task_label: ContextVar[str] = ContextVar("task_label", default="background")
+
+
+def bind_request(scope: dict) -> None:
+    """Associa o escopo ASGI à requisição corrente (chamado pelo middleware mais externo)"""
+    _request_scope.set(scope)
+
+
+def set_task_label(label: str) -> None:
+    """Identifica o trabalho fora de requisições (ex.: "job:expire-orders")"""
+    _task_label.set(label)
+
+
+def current_route() -> str:
+    """Método + template da rota em andamento, ou o rótulo da tarefa"""
+    scope = _request_scope.get()
+    if scope is None:
+        return _task_label.get()
+    # O roteador grava a rota no escopo antes de chamar o endpoint
+    route = scope.get("route")
+    return f"{scope['method']} {getattr(route, 'path', None) or 'unmatched'}"
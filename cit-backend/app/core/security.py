@@ -1,10 +1,96 @@
+import asyncio
+import hashlib
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Optional, Tuple
+from fastapi import HTTPException, status
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from app.core.config import settings
+from app.core.metrics import registry
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes com custo diferente de BCRYPT_ROUNDS são marcados para atualização
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+# Executor dedicado ao bcrypt, para não bloquear o event loop
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+
+
+class PasswordHashMetrics:
+    """Métricas do executor de hashing de senhas"""
+
+    def __init__(self):
+        self.in_flight = 0  # Tarefas em execução + aguardando na fila
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - settings.PASSWORD_HASH_WORKERS)
+
+    def observe(self, seconds: float) -> None:
+        self.completed += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def snapshot(self) -> dict:
+        return {
+            "workers": settings.PASSWORD_HASH_WORKERS,
+            "max_queue": settings.PASSWORD_HASH_MAX_QUEUE,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "avg_ms": round(self.total_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 2)
+        }
+
+    def prometheus(self) -> list:
+        """Os mesmos números no formato dos coletores de app.core.metrics"""
+        def metric(name, kind, documentation, value):
+            return {"name": name, "type": kind, "help": documentation, "labelnames": [], "values": [[[], value]]}
+
+        return [
+            metric("password_hash_in_flight", "gauge", "Hashes em execução ou na fila", self.in_flight),
+            metric("password_hash_queue_depth", "gauge", "Hashes aguardando um worker livre", self.queue_depth),
+            metric("password_hash_completed_total", "counter", "Hashes concluídos", self.completed),
+            metric("password_hash_rejected_total", "counter", "Hashes rejeitados com 503 por fila cheia", self.rejected),
+            metric("password_hash_rehashed_total", "counter", "Senhas re-hasheadas com o custo atual", self.rehashed),
+            metric("password_hash_seconds_total", "counter", "Tempo total gasto em hashing", self.total_seconds),
+        ]
+
+
+hash_metrics = PasswordHashMetrics()
+registry.add_collector(hash_metrics.prometheus)
+
+
+async def _run_hash_task(fn, *args):
+    """Executa uma operação de bcrypt no executor dedicado, respeitando o limite da fila"""
+    if hash_metrics.in_flight >= settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_QUEUE:
+        hash_metrics.rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servidor sobrecarregado. Tente novamente em instantes.",
+            headers={"Retry-After": "1"}
+        )
+    
+    hash_metrics.in_flight += 1
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_hash_executor, fn, *args)
+    finally:
+        hash_metrics.in_flight -= 1
+        hash_metrics.observe(time.perf_counter() - start)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -17,6 +103,27 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verifica a senha fora do event loop"""
+    return await _run_hash_task(pwd_context.verify, plain_password, hashed_password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifica a senha fora do event loop e, se o custo do hash mudou,
+    retorna também o novo hash a ser persistido
+    """
+    valid, new_hash = await _run_hash_task(pwd_context.verify_and_update, plain_password, hashed_password)
+    if new_hash:
+        hash_metrics.rehashed += 1
+    return valid, new_hash
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Gera o hash da senha fora do event loop"""
+    return await _run_hash_task(pwd_context.hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Cria um token JWT"""
     to_encode = data.copy()
@@ -30,6 +137,17 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
+def create_refresh_token() -> Tuple[str, str]:
+    """Gera um refresh token opaco e retorna (token, hash armazenado no banco)"""
+    token = secrets.token_urlsafe(48)
+    return token, hash_refresh_token(token)
+
+
+def hash_refresh_token(token: str) -> str:
+    """Hash do refresh token (o valor em claro nunca é persistido)"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
 def decode_access_token(token: str) -> Optional[dict]:
     """Decodifica e valida um token JWT"""
     try:
@@ -0,0 +1,118 @@
+"""
+Serialização JSON rápida (orjson) para respostas da API
+
+As rotas de listagem montam dicts diretamente a partir dos documentos do
+MongoDB e retornam `json_response(...)`, evitando a criação de modelos
+Pydantic, a revalidação contra o `response_model` e o encoder da stdlib.
+ObjectId é convertido para string; datetime sai em ISO 8601 (mesmo formato
+de `datetime.isoformat()`).
+"""
+from typing import Any, Dict, Optional
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse, Response
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Tipo não serializável: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """Serializa para bytes JSON (suporta ObjectId e datetime)"""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class MongoJSONResponse(JSONResponse):
+    """JSONResponse renderizada com orjson, aceitando documentos do MongoDB"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def json_response(content: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Resposta JSON pronta, que o FastAPI entrega sem revalidar"""
+    return MongoJSONResponse(content, status_code=status_code, headers=headers)
+
+
+def voucher_to_dict(voucher: dict) -> dict:
+    """Documento de voucher -> formato de VoucherResponse"""
+    return {
+        "id": str(voucher["_id"]),
+        "name": voucher["name"],
+        "hours": voucher["hours"],
+        "price": voucher["price"],
+        "active": voucher["active"],
+        "description": voucher.get("description"),
+        "created_at": voucher["created_at"]
+    }
+
+
+def order_to_dict(order: dict) -> dict:
+    """Documento de pedido -> formato de OrderResponse"""
+    return {
+        "id": str(order["_id"]),
+        "user_id": order["user_id"],
+        "voucher_id": order["voucher_id"],
+        "payment_method": order["payment_method"],
+        "status": order["status"],
+        "total_amount": order["total_amount"],
+        "voucher_hours": order["voucher_hours"],
+        "voucher_name": None,
+        "company": None,
+        "fulfillment": order.get("fulfillment", "balance"),
+        "access_code": order.get("access_code"),
+        "created_at": order["created_at"],
+        "paid_at": order.get("paid_at")
+    }
+
+
+def payment_to_dict(payment: dict, detailed: bool = True) -> dict:
+    """Documento de pagamento -> formato de PaymentResponse"""
+    mercadopago_payment_id = payment.get("mercadopago_payment_id") if detailed else None
+    return {
+        "id": str(payment["_id"]),
+        "order_id": payment["order_id"],
+        "payment_method": payment["payment_method"],
+        "status": payment["status"],
+        "amount": payment["amount"],
+        "pix_qrcode": payment.get("pix_qrcode"),
+        "pix_key": payment.get("pix_key"),
+        "card_last_digits": payment.get("card_last_digits"),
+        "mercadopago_payment_id": str(mercadopago_payment_id) if mercadopago_payment_id else None,
+        "status_detail": payment.get("status_detail") if detailed else None,
+        "installments": payment.get("installments") if detailed else None,
+        "created_at": payment["created_at"]
+    }
+
+
+def batch_to_dict(batch: dict) -> dict:
+    """Documento de lote -> formato de BulkOrderResponse"""
+    payment = batch.get("payment") or {}
+    return {
+        "batch_id": str(batch["_id"]),
+        "status": batch["status"],
+        "fulfillment": batch.get("fulfillment", "balance"),
+        "total_orders": batch["total_orders"],
+        "total_amount": batch["total_amount"],
+        "total_hours": batch["total_hours"],
+        "items": [
+            {
+                "voucher_id": item["voucher_id"],
+                "quantity": item["quantity"],
+                "status": item["status"],
+                "error": item.get("error"),
+                "unit_price": item.get("unit_price"),
+                "hours": item.get("hours"),
+                "order_ids": item.get("order_ids", []),
+                "codes": item.get("codes", [])
+            }
+            for item in batch["items"]
+        ],
+        "pix_qrcode": payment.get("pix_qrcode"),
+        "pix_key": payment.get("pix_key"),
+        "fallback_mode": payment.get("fallback_mode", False),
+        "created_at": batch["created_at"],
+        "paid_at": batch.get("paid_at")
+    }
@@ -0,0 +1,225 @@
+"""
+Log de consultas lentas do MongoDB com fingerprint do formato da consulta
+
+Comandos acima de SLOW_QUERY_THRESHOLD_MS são registrados com o formato
+normalizado (valores literais trocados por "?"), coleção, duração,
+documentos retornados/afetados e a rota que os originou. Os registros vão
+para um buffer em memória e são gravados em lote na coleção limitada
+(capped) `slow_queries` por uma tarefa em segundo plano. A tarefa só grava
+depois de garantir que a coleção existe como capped: um insert antes disso
+faria o MongoDB criá-la comum, sem limite de tamanho.
+"""
+import asyncio
+import hashlib
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Optional, Tuple
+import orjson
+from pymongo import monitoring
+from pymongo.errors import CollectionInvalid
+from app.core.config import settings
+from app.core.request_context import current_route
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "slow_queries"
+
+# Campos do comando que definem o formato da consulta
+_SHAPE_FIELDS = ("filter", "query", "sort", "projection", "pipeline", "update", "updates", "deletes", "key", "q", "u")
+
+# Buffer preenchido pelas threads do Motor (deque.append é thread-safe)
+_buffer: Deque[dict] = deque(maxlen=settings.SLOW_QUERY_BUFFER_SIZE)
+_flush_task: Optional[asyncio.Task] = None
+_collection_ready = False
+
+
+def normalize(value: Any) -> Any:
+    """Mantém chaves e operadores, troca literais por "?" """
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(item, (dict, list, tuple)) for item in value):
+            return [normalize(item) for item in value]
+        # $in: [1, 2, 3] e similares têm o mesmo formato com qualquer tamanho
+        return ["?"]
+    return "?"
+
+
+def query_shape(command_name: str, command: dict) -> dict:
+    shape = {}
+    for field in _SHAPE_FIELDS:
+        # No comando "update" a chave homônima é o nome da coleção
+        if field not in command or field == command_name:
+            continue
+        value = command[field]
+        if field in ("updates", "deletes") and isinstance(value, list):
+            # Lote de update/delete: o formato do primeiro item representa o lote
+            value = {key: item for key, item in value[0].items() if key in ("q", "u")} if value else {}
+        if field == "sort":
+            # A ordem e os campos do sort importam, a direção não
+            shape[field] = list(value.keys()) if isinstance(value, dict) else "?"
+            continue
+        shape[field] = normalize(value)
+    return shape
+
+
+def fingerprint(collection: str, command_name: str, shape: dict) -> str:
+    raw = orjson.dumps([collection, command_name, shape], option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+
+def _docs_returned(command_name: str, reply: dict) -> Optional[int]:
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+        return len(batch) if batch is not None else None
+    if command_name in ("update", "delete", "insert", "count", "findAndModify"):
+        n = reply.get("n")
+        if n is None and isinstance(reply.get("lastErrorObject"), dict):
+            n = reply["lastErrorObject"].get("n")
+        return n
+    return None
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Guarda o comando na largada e só calcula o fingerprint se ele for lento"""
+
+    def __init__(self):
+        self._pending: Dict[Tuple[object, int], Tuple[str, dict, str]] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            target = event.command.get("collection", "")
+        if target == COLLECTION:
+            return
+        self._pending[(event.connection_id, event.request_id)] = (target or "-", event.command, current_route())
+
+    def _finish(self, event, reply: Optional[dict], failed: bool) -> None:
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < settings.SLOW_QUERY_THRESHOLD_MS:
+            return
+
+        collection, command, route = pending
+        shape = query_shape(event.command_name, command)
+        _buffer.append({
+            "at": datetime.now(timezone.utc),
+            "fingerprint": fingerprint(collection, event.command_name, shape),
+            "collection": collection,
+            "command": event.command_name,
+            # Documento serializado: operadores como "$in" não podem ser chaves gravadas
+            "shape": orjson.dumps(shape, option=orjson.OPT_SORT_KEYS).decode(),
+            "duration_ms": round(duration_ms, 3),
+            "docs_returned": _docs_returned(event.command_name, reply) if reply else None,
+            # Sem o profiler o servidor não informa docsExamined nas respostas comuns
+            "docs_examined": None,
+            "route": route,
+            "failed": failed
+        })
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, event.reply, False)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, None, True)
+
+
+async def ensure_collection() -> None:
+    """Cria a coleção limitada; uma coleção comum de mesmo nome é convertida para capped"""
+    global _collection_ready
+    from app.database.mongo import get_database
+
+    db = get_database()
+    size = settings.SLOW_QUERY_COLLECTION_SIZE_MB * 1024 * 1024
+    try:
+        await db.create_collection(COLLECTION, capped=True, size=size)
+    except CollectionInvalid:
+        # Já existe: pode ter sido criada comum por um insert de uma versão anterior
+        options = await db[COLLECTION].options()
+        if not options.get("capped"):
+            logger.warning("Coleção de consultas lentas sem limite de tamanho; convertendo para capped")
+            await db.command("convertToCapped", COLLECTION, size=size)
+    _collection_ready = True
+
+
+async def flush() -> None:
+    """Grava os registros acumulados no buffer (mantidos nele até a coleção existir)"""
+    from app.database.mongo import get_database
+
+    if not _collection_ready:
+        return
+    records = []
+    while _buffer:
+        records.append(_buffer.popleft())
+    if records:
+        await get_database()[COLLECTION].insert_many(records, ordered=False)
+
+
+async def _flush_loop() -> None:
+    while not _collection_ready:
+        try:
+            await ensure_collection()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Erro ao criar a coleção de consultas lentas: {e}")
+            await asyncio.sleep(settings.SLOW_QUERY_FLUSH_SECONDS)
+
+    while True:
+        await asyncio.sleep(settings.SLOW_QUERY_FLUSH_SECONDS)
+        try:
+            await flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Erro ao gravar consultas lentas: {e}")
+
+
+def start() -> None:
+    global _flush_task
+    if settings.SLOW_QUERY_ENABLED and (_flush_task is None or _flush_task.done()):
+        _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def stop() -> None:
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        _flush_task = None
+        try:
+            await flush()
+        except Exception:
+            pass
+
+
+async def top_offenders(limit: int = 20, since: Optional[datetime] = None) -> list:
+    """Formatos de consulta que mais consumiram tempo no total"""
+    from app.database.mongo import get_database
+
+    match = {"at": {"$gte": since}} if since else {}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": "$fingerprint",
+            "collection": {"$first": "$collection"},
+            "command": {"$first": "$command"},
+            "shape": {"$first": "$shape"},
+            "count": {"$sum": 1},
+            "total_ms": {"$sum": "$duration_ms"},
+            "max_ms": {"$max": "$duration_ms"},
+            "avg_docs_returned": {"$avg": "$docs_returned"},
+            "routes": {"$addToSet": "$route"},
+            "last_seen": {"$max": "$at"}
+        }},
+        {"$sort": {"total_ms": -1}},
+        {"$limit": limit},
+        {"$addFields": {"avg_ms": {"$round": [{"$divide": ["$total_ms", "$count"]}, 3]}}}
+    ]
+    rows = await get_database()[COLLECTION].aggregate(pipeline).to_list(length=limit)
+    for row in rows:
+        row["fingerprint"] = row.pop("_id")
+    return rows
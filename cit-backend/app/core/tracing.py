@@ -0,0 +1,354 @@
+"""
+Tracing leve por requisição (spans propagados por contextvar)
+
+O TracingMiddleware abre um trace quando a requisição é amostrada
+(TRACING_SAMPLE_RATE ou `traceparent` com flag de amostragem) ou quando o
+header Server-Timing está ligado. Comandos do MongoDB, chamadas HTTP ao
+Mercado Pago e funções marcadas com @traced viram spans filhos.
+
+Sem trace no contexto, `span()` devolve um context manager vazio
+compartilhado: o custo do caminho desligado é uma leitura de ContextVar.
+
+Traces amostrados são exportados em lote no formato OTLP/JSON, para um
+coletor (TRACING_OTLP_ENDPOINT) ou para um arquivo JSON Lines.
+"""
+import asyncio
+import functools
+import logging
+import os
+import random
+import secrets
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional, Tuple
+import httpx
+import orjson
+from pymongo import monitoring
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], kind: int = 1,
+                 start_ns: Optional[int] = None, attributes: Optional[dict] = None):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind  # 1 interno, 2 servidor, 3 cliente (códigos OTLP)
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes or {}
+        self.error = False
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        self.end_ns = end_ns if end_ns is not None else time.time_ns()
+        # list.append é atômico: spans podem terminar nas threads do Motor
+        self.trace.spans.append(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1_000_000
+
+
+class Trace:
+    __slots__ = ("trace_id", "sampled", "spans")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: List[Span] = []
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _ActiveSpan:
+    __slots__ = ("span", "token")
+
+    def __init__(self, span: Span):
+        self.span = span
+        self.token = None
+
+    def __enter__(self) -> Span:
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self.token)
+        if exc_type is not None:
+            self.span.error = True
+        self.span.end()
+        return False
+
+
+def span(name: str, **attributes):
+    """Context manager de span; vazio quando não há trace ativo"""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP
+    parent = _current_span.get()
+    return _ActiveSpan(Span(trace, name, parent.span_id if parent else None, attributes=attributes))
+
+
+def start_span(name: str, kind: int = 1, **attributes) -> Optional[Span]:
+    """Abre um span sem torná-lo o span corrente (para hooks de início/fim)"""
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    parent = _current_span.get()
+    return Span(trace, name, parent.span_id if parent else None, kind=kind, attributes=attributes)
+
+
+def traced(name: str):
+    """Decorator para corrotinas: envolve cada chamada em um span"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return await func(*args, **kwargs)
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ---------------------------------------------------------------------------
+# Middleware
+# ---------------------------------------------------------------------------
+
+def _parse_traceparent(value: str) -> Optional[Tuple[str, str, bool]]:
+    # 00-<trace-id 32 hex>-<parent-id 16 hex>-<flags>
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+def _server_timing(trace: Trace, root: Span) -> str:
+    """Soma as durações por nome de span (ex.: mongo.find.orders;dur=1.8)"""
+    totals: Dict[str, float] = {}
+    for item in list(trace.spans):
+        key = item.name.replace(" ", "_").replace(";", "_").replace(",", "_")
+        totals[key] = totals.get(key, 0.0) + item.duration_ms
+    entries = [f"{name};dur={duration:.1f}" for name, duration in totals.items()]
+    entries.append(f"total;dur={root.duration_ms:.1f}")
+    return ", ".join(entries)
+
+
+class TracingMiddleware:
+    """Abre o trace da requisição, adiciona Server-Timing e enfileira a exportação"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (settings.TRACING_ENABLED or settings.TRACING_SERVER_TIMING):
+            await self.app(scope, receive, send)
+            return
+
+        trace_id, parent_id, sampled = secrets.token_hex(16), None, False
+        if settings.TRACING_ENABLED:
+            sampled = random.random() < settings.TRACING_SAMPLE_RATE
+            for name, value in scope.get("headers", []):
+                if name == b"traceparent":
+                    parsed = _parse_traceparent(value.decode("latin-1"))
+                    if parsed is not None:
+                        trace_id, parent_id, upstream_sampled = parsed
+                        sampled = sampled or upstream_sampled
+                    break
+
+        if not sampled and not settings.TRACING_SERVER_TIMING:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(trace_id, sampled)
+        root = Span(trace, f"{scope['method']} {scope['path']}", parent_id, kind=2)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(root)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                if settings.TRACING_SERVER_TIMING:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", _server_timing(trace, root).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            root.error = True
+            raise
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            route = scope.get("route")
+            if route is not None:
+                root.name = f"{scope['method']} {route.path}"
+            root.attributes["http.method"] = scope["method"]
+            root.end()
+            if trace.sampled:
+                _export_queue.append(trace)
+
+
+# ---------------------------------------------------------------------------
+# MongoDB
+# ---------------------------------------------------------------------------
+
+class TracingCommandListener(monitoring.CommandListener):
+    """Um span por comando; roda nas threads do Motor, que herdam o contexto"""
+
+    def __init__(self):
+        self._pending: Dict[Tuple[object, int], Span] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if _current_trace.get() is None:
+            return
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            target = event.command.get("collection", "")
+        item = start_span(f"mongo.{event.command_name}.{target or '-'}", kind=3, **{"db.system": "mongodb"})
+        self._pending[(event.connection_id, event.request_id)] = item
+
+    def _finish(self, event, error: bool) -> None:
+        item = self._pending.pop((event.connection_id, event.request_id), None)
+        if item is None:
+            return
+        item.error = error
+        item.end(item.start_ns + event.duration_micros * 1000)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, False)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, True)
+
+
+# ---------------------------------------------------------------------------
+# Exportação OTLP/JSON
+# ---------------------------------------------------------------------------
+
+_export_queue: Deque[Trace] = deque(maxlen=1000)
+_export_task: Optional[asyncio.Task] = None
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def to_otlp(traces: List[Trace]) -> dict:
+    spans = []
+    for trace in traces:
+        for item in trace.spans:
+            otlp_span = {
+                "traceId": trace.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                "kind": item.kind,
+                "startTimeUnixNano": str(item.start_ns),
+                "endTimeUnixNano": str(item.end_ns or item.start_ns),
+                "attributes": [_attribute(key, value) for key, value in item.attributes.items()],
+                "status": {"code": 2 if item.error else 1}
+            }
+            if item.parent_id:
+                otlp_span["parentSpanId"] = item.parent_id
+            spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", settings.TRACING_SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "app.core.tracing"}, "spans": spans}]
+        }]
+    }
+
+
+def _append_to_file(payload: bytes) -> None:
+    path = settings.TRACING_EXPORT_FILE
+    try:
+        if os.path.getsize(path) > settings.TRACING_EXPORT_FILE_MAX_MB * 1024 * 1024:
+            os.replace(path, f"{path}.1")
+    except OSError:
+        pass
+    with open(path, "ab") as f:
+        f.write(payload + b"\n")
+
+
+async def flush() -> None:
+    traces = []
+    while _export_queue:
+        traces.append(_export_queue.popleft())
+    if not traces:
+        return
+
+    global _http_client
+    payload = orjson.dumps(to_otlp(traces))
+    if settings.TRACING_OTLP_ENDPOINT:
+        if _http_client is None:
+            _http_client = httpx.AsyncClient(timeout=5.0)
+        response = await _http_client.post(
+            f"{settings.TRACING_OTLP_ENDPOINT.rstrip('/')}/v1/traces",
+            content=payload,
+            headers={"Content-Type": "application/json"}
+        )
+        response.raise_for_status()
+    else:
+        await asyncio.to_thread(_append_to_file, payload)
+
+
+async def _export_loop() -> None:
+    while True:
+        await asyncio.sleep(settings.TRACING_FLUSH_SECONDS)
+        try:
+            await flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Erro ao exportar traces: {e}")
+
+
+def start() -> None:
+    global _export_task
+    if settings.TRACING_ENABLED and (_export_task is None or _export_task.done()):
+        _export_task = asyncio.create_task(_export_loop())
+
+
+async def stop() -> None:
+    global _export_task, _http_client
+    if _export_task is not None:
+        _export_task.cancel()
+        _export_task = None
+        try:
+            await flush()
+        except Exception:
+            pass
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -1,5 +1,12 @@
+import asyncio
+import logging
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo.errors import CollectionInvalid, OperationFailure
+from app.core import slow_queries, tracing
 from app.core.config import settings
+from app.core.metrics import MongoCommandListener
+
+logger = logging.getLogger(__name__)
 
 client: AsyncIOMotorClient = None
 database: AsyncIOMotorDatabase = None
@@ -8,9 +15,20 @@ database: AsyncIOMotorDatabase = None
 async def connect_to_mongo():
     """Conecta ao MongoDB"""
     global client, database
-    client = AsyncIOMotorClient(settings.MONGODB_URL)
+    listeners = []
+    if settings.METRICS_ENABLED:
+        listeners.append(MongoCommandListener())
+    if settings.SLOW_QUERY_ENABLED:
+        listeners.append(slow_queries.SlowQueryListener())
+    if settings.TRACING_ENABLED or settings.TRACING_SERVER_TIMING:
+        listeners.append(tracing.TracingCommandListener())
+    client = AsyncIOMotorClient(
+        settings.MONGODB_URL,
+        minPoolSize=settings.MONGODB_MIN_POOL_SIZE,
+        event_listeners=listeners
+    )
     database = client[settings.DATABASE_NAME]
-    print(f"✓ Conectado ao MongoDB: {settings.DATABASE_NAME}")
+    logger.info("Conectado ao MongoDB", extra={"database": settings.DATABASE_NAME})
 
 
 async def close_mongo_connection():
@@ -18,9 +36,93 @@ async def close_mongo_connection():
     global client
     if client:
         client.close()
-        print("✓ Conexão com MongoDB fechada")
+        logger.info("Conexão com MongoDB fechada")
 
 
 def get_database() -> AsyncIOMotorDatabase:
     """Retorna a instância do banco de dados"""
     return database
+
+
+async def ensure_indexes():
+    """Cria os índices usados pelas consultas mais frequentes"""
+    await database.users.create_index("email")
+    await database.companies.create_index("slug")
+    await database.rate_limits.create_index("updated_at", expireAfterSeconds=3600)
+    await database.cache_invalidations.create_index(
+        "at", expireAfterSeconds=settings.CACHE_SYNC_KEYED_RETENTION_SECONDS
+    )
+    await database.refresh_tokens.create_index("expires_at", expireAfterSeconds=0)
+    await database.refresh_tokens.create_index("family_id")
+    await database.orders.create_index("batch_id", sparse=True)
+    await database.orders.create_index([("status", 1), ("created_at", 1)])
+    await database.orders.create_index([("user_id", 1), ("created_at", -1)])
+    await database.orders.create_index("fulfillment_pending", sparse=True)
+    await database.payments.create_index("order_id")
+    await database.order_batches.create_index([("user_id", 1), ("created_at", -1)])
+    await database.order_batches.create_index([("status", 1), ("created_at", 1)])
+    await database.orders_archive.create_index([("created_at", -1)])
+    await database.orders_archive.create_index([("user_id", 1), ("created_at", -1)])
+    await database.orders_archive.create_index([("company_slug", 1), ("created_at", -1)])
+    await database.orders_archive.create_index("status")
+    await database.payments_archive.create_index("order_id")
+    await database.access_codes.create_index("code", unique=True)
+    await database.access_codes.create_index("status")
+    await database.access_codes.create_index("credit_pending", sparse=True)
+    await _ensure_access_code_order_index()
+    await database.hours_ledger.create_index("idempotency_key", unique=True)
+    await database.hours_ledger.create_index([("user_id", 1), ("_id", -1)])
+    await database.hours_ledger.create_index([("applied", 1), ("at", 1)])
+    await database.hours_ledger.create_index("fold_id", sparse=True)
+
+    await database.usage_event_ids.create_index(
+        "received_at", expireAfterSeconds=settings.USAGE_DEDUP_DAYS * 86400
+    )
+    await database.usage_event_ids.create_index("charge_key", sparse=True)
+    try:
+        await database.create_collection(
+            "usage_events",
+            timeseries={"timeField": "at", "metaField": "meta", "granularity": "minutes"},
+            expireAfterSeconds=settings.USAGE_RETENTION_DAYS * 86400
+        )
+    except CollectionInvalid:
+        pass  # Já existe
+    except OperationFailure as e:
+        # MongoDB < 5.0: sem time-series, a coleção é criada comum no primeiro insert
+        logger.warning(f"Coleção time-series indisponível: {e}")
+
+    await slow_queries.ensure_collection()
+
+
+async def _ensure_access_code_order_index():
+    """Um código por pedido: substitui o índice sparse (não único) de versões anteriores"""
+    indexes = await database.access_codes.index_information()
+    current = indexes.get("order_id_1")
+    if current is not None and current.get("unique"):
+        return
+    if current is not None:
+        await database.access_codes.drop_index("order_id_1")
+    try:
+        await database.access_codes.create_index(
+            "order_id",
+            unique=True,
+            partialFilterExpression={"order_id": {"$exists": True}}
+        )
+    except OperationFailure as e:
+        # Pedidos que já receberam dois códigos: o índice único só entra depois de corrigi-los
+        logger.error(f"Índice único de códigos por pedido não criado: {e}")
+        await database.access_codes.create_index("order_id", sparse=True)
+
+
+async def ping_database(timeout: float) -> bool:
+    """Verifica se o MongoDB responde dentro do tempo limite"""
+    try:
+        await asyncio.wait_for(database.command("ping"), timeout=timeout)
+        return True
+    except Exception:
+        return False
+
+
+async def warm_connection_pool(size: int):
+    """Abre conexões do pool antecipadamente com pings concorrentes"""
+    await asyncio.gather(*(database.command("ping") for _ in range(size)))
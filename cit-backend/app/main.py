@@ -1,15 +1,35 @@
-from fastapi import FastAPI
+import secrets
+from fastapi import FastAPI, Request, status
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from app.core import cache_sync, metrics, slow_queries, tracing
+from app.core.config import settings
+from app.core.logging_config import setup_logging
+from app.core.serialization import MongoJSONResponse, json_response
+from app.core.rate_limit import RateLimitMiddleware
+from app.core.compression import CompressionMiddleware
 from app.database.mongo import connect_to_mongo, close_mongo_connection
-from app.routes import auth, admin, client, payment, public, webhooks
-from app.services.voucher_service import VoucherService
+from app.routes import auth, admin, client, controller, payment, portal, public, webhooks
+from app.services.access_code_service import AccessCodeFilter
+from app.services.analytics_service import AnalyticsService
+from app.services.health_service import HealthService
+from app.services.job_service import JobService
+from app.services.mercadopago_service import MercadoPagoService
+from app.services.usage_service import UsageService
+
+# Antes de tudo: a partir daqui nenhum log escreve direto no stdout
+setup_logging()
 
 app = FastAPI(
     title="CIT API",
     description="API para sistema de gerenciamento de vouchers e pagamentos",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=MongoJSONResponse
 )
 
+# Rate limiting por rota (registrado antes do CORS para que as respostas 429 recebam os headers CORS)
+app.add_middleware(RateLimitMiddleware)
+
 # Configuração CORS
 app.add_middleware(
     CORSMiddleware,
@@ -19,17 +39,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compressão gzip/brotli (respostas pré-comprimidas do cache HTTP passam direto)
+app.add_middleware(CompressionMiddleware)
+
+# Spans por requisição e header Server-Timing (opcionais)
+app.add_middleware(tracing.TracingMiddleware)
+
+# Latência por rota (mais externo: inclui rate limit e compressão)
+app.add_middleware(metrics.MetricsMiddleware)
+
 
 @app.on_event("startup")
 async def startup_event():
     """Evento executado na inicialização da aplicação"""
     await connect_to_mongo()
-    await VoucherService.initialize_default_vouchers()
+    metrics.start_monitor()
+    slow_queries.start()
+    tracing.start()
+    # Índices, caches e pools são preparados em segundo plano;
+    # /health/ready só responde 200 depois do warm-up, que também inicia
+    # a sincronização de caches e a disputa pelo lease das tarefas
+    HealthService.start_warm_up()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Evento executado no encerramento da aplicação"""
+    await HealthService.cancel_warm_up()
+    await JobService.stop()
+    await AccessCodeFilter.stop()
+    await UsageService.stop()
+    await AnalyticsService.stop()
+    await cache_sync.stop()
+    await metrics.stop_monitor()
+    await slow_queries.stop()
+    await tracing.stop()
+    await MercadoPagoService.close_http_client()
     await close_mongo_connection()
 
 
@@ -38,6 +83,8 @@ app.include_router(auth.router)
 app.include_router(admin.router)
 app.include_router(client.router)
 app.include_router(payment.router)
+app.include_router(portal.router)
+app.include_router(controller.router)
 app.include_router(public.router)
 app.include_router(webhooks.router)
 
@@ -53,11 +100,31 @@ async def root():
 
 
 @app.get("/health")
+@app.get("/health/live")
 async def health_check():
-    """Health check"""
+    """Liveness: o processo está de pé e o event loop responde"""
     return {"status": "healthy"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request):
+    """Métricas no formato de exposição do Prometheus"""
+    if not settings.METRICS_ENABLED:
+        return PlainTextResponse("", status_code=status.HTTP_404_NOT_FOUND)
+    expected = f"Bearer {settings.METRICS_TOKEN}"
+    if settings.METRICS_TOKEN and not secrets.compare_digest(request.headers.get("authorization", ""), expected):
+        return PlainTextResponse("", status_code=status.HTTP_401_UNAUTHORIZED)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: MongoDB, índices, Mercado Pago e caches aquecidos"""
+    report = await HealthService.readiness()
+    status_code = status.HTTP_200_OK if report["status"] == "ready" else status.HTTP_503_SERVICE_UNAVAILABLE
+    return json_response(report, status_code=status_code)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -10,7 +10,7 @@ class Order(BaseModel):
     user_id: str
     voucher_id: str
     payment_method: str  # pix | credit | debit
-    status: str = "pending"  # pending | paid | failed
+    status: str = "pending"  # pending | paid | failed | expired
     total_amount: float
     voucher_hours: float  # Horas do voucher comprado
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -9,7 +9,7 @@ class Payment(BaseModel):
     id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
     order_id: str
     payment_method: str  # pix | credit | debit
-    status: str = "pending"  # pending | confirmed | failed
+    status: str = "pending"  # pending | confirmed | failed | expired
     amount: float
     
     # Dados específicos do pagamento
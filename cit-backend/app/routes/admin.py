@@ -1,31 +1,39 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
 from app.routes.auth import get_current_admin
+from app.schemas.user import RoleUpdate
 from app.schemas.voucher import VoucherCreate, VoucherUpdate, VoucherResponse
 from app.services.voucher_service import VoucherService
+from app.services.analytics_service import AnalyticsService
+from app.services.archive_service import ArchiveService
+from app.services.auth_service import AuthService
+from app.services.company_service import CompanyService, generate_slug
+from app.services.job_service import JobService
+from app.services.ledger_service import LedgerService
+from app.services.order_expiry_service import OrderExpiryService
 from app.database.mongo import get_database
+from app.core.security import hash_metrics
+from app.core.rate_limit import rate_limit_counters
+from app.core import slow_queries
+from app.core.analytics_cube import DIMENSIONS, PERIODS
+from app.core.profiling import CpuProfiler, MemoryProfiler, clamp_cpu_args
+from app.core.config import settings
+from app.core.serialization import json_response
 from bson import ObjectId
-from datetime import datetime
-import re
+from datetime import datetime, timedelta, timezone
 import os
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
 
-def generate_slug(name: str) -> str:
-    """Gera um slug a partir do nome da empresa"""
-    slug = name.lower().strip()
-    slug = re.sub(r'[àáâãäå]', 'a', slug)
-    slug = re.sub(r'[èéêë]', 'e', slug)
-    slug = re.sub(r'[ìíîï]', 'i', slug)
-    slug = re.sub(r'[òóôõö]', 'o', slug)
-    slug = re.sub(r'[ùúûü]', 'u', slug)
-    slug = re.sub(r'[ç]', 'c', slug)
-    slug = re.sub(r'[^a-z0-9\s-]', '', slug)
-    slug = re.sub(r'[\s_]+', '-', slug)
-    slug = re.sub(r'-+', '-', slug)
-    slug = slug.strip('-')
-    return slug
+async def _monthly_totals(db, pipeline: list) -> list:
+    """Vendas por mês somando coleção quente e arquivo (os 12 primeiros meses, como antes)"""
+    hot = await db.orders.aggregate(pipeline + [{"$limit": 12}]).to_list(length=12)
+    cold = await ArchiveService.archived_aggregate(pipeline)
+    merged = ArchiveService.merge_groups(hot, cold, ["vendas", "valor"])
+    merged.sort(key=lambda row: (row["_id"]["year"], row["_id"]["month"]))
+    return merged[:12]
 
 
 @router.post("/vouchers", response_model=VoucherResponse, status_code=status.HTTP_201_CREATED)
@@ -84,10 +92,11 @@ async def get_admin_dashboard(current_user: dict = Depends(get_current_admin)):
     # Total de usuários
     total_users = await db.users.count_documents({"role": "client"})
     
-    # Total de pedidos
-    total_orders = await db.orders.count_documents({})
-    paid_orders = await db.orders.count_documents({"status": "paid"})
+    # Total de pedidos (coleção quente + arquivo; pendentes nunca são arquivados)
+    total_orders = await db.orders.count_documents({}) + await ArchiveService.archived_count({})
+    paid_orders = await db.orders.count_documents({"status": "paid"}) + await ArchiveService.archived_count({"status": "paid"})
     pending_orders = await db.orders.count_documents({"status": "pending"})
+    expired_orders = await db.orders.count_documents({"status": "expired"}) + await ArchiveService.archived_count({"status": "expired"})
     
     # Receita total
     pipeline = [
@@ -95,7 +104,8 @@ async def get_admin_dashboard(current_user: dict = Depends(get_current_admin)):
         {"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}
     ]
     revenue_result = await db.orders.aggregate(pipeline).to_list(length=1)
-    total_revenue = revenue_result[0]["total"] if revenue_result else 0
+    revenue_result += await ArchiveService.archived_aggregate(pipeline)
+    total_revenue = sum(row["total"] for row in revenue_result)
     
     # Dados por mês (últimos 6 meses)
     monthly_pipeline = [
@@ -110,11 +120,10 @@ async def get_admin_dashboard(current_user: dict = Depends(get_current_admin)):
                 "valor": {"$sum": "$total_amount"}
             }
         },
-        {"$sort": {"_id.year": 1, "_id.month": 1}},
-        {"$limit": 12}
+        {"$sort": {"_id.year": 1, "_id.month": 1}}
     ]
     
-    monthly_result = await db.orders.aggregate(monthly_pipeline).to_list(length=12)
+    monthly_result = await _monthly_totals(db, monthly_pipeline)
     
     # Formata os dados mensais
     month_names = ["", "Jan", "Fev", "Mar", "Abr", "Mai", "Jun", "Jul", "Ago", "Set", "Out", "Nov", "Dez"]
@@ -138,21 +147,155 @@ async def get_admin_dashboard(current_user: dict = Depends(get_current_admin)):
         "total_orders": total_orders,
         "paid_orders": paid_orders,
         "pending_orders": pending_orders,
+        "expired_orders": expired_orders,
         "total_revenue": total_revenue,
         "monthly_data": monthly_data
     }
 
 
+@router.get("/analytics/cube")
+async def get_analytics_cube(
+    dimensions: str = Query("", description="Combinação de voucher, method e company, separadas por vírgula"),
+    period: Optional[str] = Query(None, description="day, week ou month"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: dict = Depends(get_current_admin)
+):
+    """Receita, pedidos, ticket médio e conversão por voucher × método × empresa × período (apenas admin)"""
+    selected = [dimension.strip() for dimension in dimensions.split(",") if dimension.strip()]
+    invalid = [dimension for dimension in selected if dimension not in DIMENSIONS]
+    if invalid or len(set(selected)) != len(selected):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Dimensões válidas: {', '.join(DIMENSIONS)} (sem repetição)"
+        )
+    if period is not None and period not in PERIODS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Períodos válidos: {', '.join(PERIODS)}"
+        )
+
+    cube = await AnalyticsService.cube(selected, period, since, until)
+    if "voucher" in selected:
+        # Cópias: as linhas do cubo ficam em cache
+        catalog = await VoucherService.get_catalog()
+        cube["rows"] = [
+            {**row, "voucher_name": catalog.by_id[row["voucher"]]["name"] if row["voucher"] in catalog.by_id else None}
+            for row in cube["rows"]
+        ]
+    return json_response(cube)
+
+
+@router.get("/metrics/password-hashing")
+async def get_password_hashing_metrics(current_user: dict = Depends(get_current_admin)):
+    """Retorna latência e fila do executor de hashing de senhas (apenas admin)"""
+    return hash_metrics.snapshot()
+
+
+@router.get("/metrics/rate-limits")
+async def get_rate_limit_metrics(current_user: dict = Depends(get_current_admin)):
+    """Retorna as requisições permitidas e bloqueadas por regra de rate limit (apenas admin)"""
+    return rate_limit_counters.snapshot()
+
+
+@router.get("/jobs")
+async def get_background_jobs(current_user: dict = Depends(get_current_admin)):
+    """Retorna o líder atual e as tarefas em segundo plano registradas (apenas admin)"""
+    return {
+        "lease": await JobService.current_lease(),
+        "worker": JobService.status()
+    }
+
+
+@router.get("/slow-queries")
+async def get_slow_queries(
+    limit: int = 20,
+    since_hours: float = 24,
+    current_user: dict = Depends(get_current_admin)
+):
+    """Lista os formatos de consulta mais lentos, ordenados pelo tempo total (apenas admin)"""
+    since = datetime.now(timezone.utc) - timedelta(hours=since_hours)
+    rows = await slow_queries.top_offenders(limit=min(max(limit, 1), 100), since=since)
+    return json_response({
+        "threshold_ms": settings.SLOW_QUERY_THRESHOLD_MS,
+        "queries": rows
+    })
+
+
+@router.post("/profile/cpu", response_class=PlainTextResponse)
+async def profile_cpu(
+    seconds: float = 10,
+    interval_ms: float = 10,
+    all_threads: bool = False,
+    current_user: dict = Depends(get_current_admin)
+):
+    """
+    Amostra as pilhas deste worker por `seconds` e retorna o formato collapsed
+    (flamegraph.pl / speedscope). Por padrão amostra só a thread do event loop.
+    """
+    seconds, interval_ms = clamp_cpu_args(seconds, interval_ms)
+    profiler = CpuProfiler(seconds, interval_ms, all_threads)
+    body = await profiler.run()
+    return PlainTextResponse(body, headers={
+        "X-Worker-Pid": str(os.getpid()),
+        "X-Profile-Samples": str(profiler.samples),
+        "X-Profile-Truncated": str(profiler.truncated).lower()
+    })
+
+
+@router.post("/profile/memory/start")
+async def profile_memory_start(
+    frames: int = Query(1, ge=1, le=25),
+    current_user: dict = Depends(get_current_admin)
+):
+    """Liga o tracemalloc neste worker (desliga sozinho após o limite configurado)"""
+    return {**MemoryProfiler.start(frames), "pid": os.getpid()}
+
+
+@router.post("/profile/memory/snapshot")
+async def profile_memory_snapshot(
+    top: int = Query(25, ge=1, le=200),
+    current_user: dict = Depends(get_current_admin)
+):
+    """Tira um snapshot e retorna os maiores pontos de alocação"""
+    return {**await MemoryProfiler.take_snapshot(top), "pid": os.getpid()}
+
+
+@router.get("/profile/memory/diff")
+async def profile_memory_diff(
+    base: int,
+    current: int,
+    top: int = Query(25, ge=1, le=200),
+    current_user: dict = Depends(get_current_admin)
+):
+    """Compara dois snapshots: onde a memória cresceu entre eles"""
+    return {**await MemoryProfiler.diff(base, current, top), "pid": os.getpid()}
+
+
+@router.get("/profile/memory")
+async def profile_memory_status(current_user: dict = Depends(get_current_admin)):
+    """Estado do tracemalloc e snapshots disponíveis neste worker"""
+    return {**MemoryProfiler.status(), "pid": os.getpid()}
+
+
+@router.post("/profile/memory/stop")
+async def profile_memory_stop(current_user: dict = Depends(get_current_admin)):
+    """Desliga o tracemalloc e descarta os snapshots"""
+    return {**MemoryProfiler.stop(), "pid": os.getpid()}
+
+
 @router.get("/orders")
 async def get_all_orders(
     skip: int = 0,
     limit: int = 50,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
     current_user: dict = Depends(get_current_admin)
 ):
-    """Lista todos os pedidos (apenas admin)"""
+    """Lista todos os pedidos; o arquivo só é consultado quando o período o alcança (apenas admin)"""
     db = get_database()
     
-    orders = await db.orders.find().sort("created_at", -1).skip(skip).limit(limit).to_list(length=limit)
+    orders = await ArchiveService.find_orders({}, since=since, until=until, skip=skip, limit=limit)
     
     # Enriquece com dados do usuário
     for order in orders:
@@ -161,7 +304,13 @@ async def get_all_orders(
         order["user_email"] = user["email"] if user else "Desconhecido"
         order["id"] = str(order.pop("_id"))
     
-    return orders
+    return json_response(orders)
+
+
+@router.post("/orders/expire")
+async def expire_stale_orders(current_user: dict = Depends(get_current_admin)):
+    """Expira agora os pedidos e lotes pendentes vencidos, sem esperar a tarefa do líder (apenas admin)"""
+    return await OrderExpiryService.expire_stale()
 
 
 @router.get("/users")
@@ -173,13 +322,37 @@ async def get_all_users(
     """Lista todos os usuários (apenas admin)"""
     db = get_database()
     
-    users = await db.users.find({"role": "client"}).skip(skip).limit(limit).to_list(length=limit)
+    users = await db.users.find({"role": "client"}, {"ledger_recent": 0, "ledger_unmarked": 0}).skip(skip).limit(limit).to_list(length=limit)
     
     for user in users:
         user["id"] = str(user.pop("_id"))
         user.pop("password_hash", None)  # Remove o hash da senha
     
-    return users
+    return json_response(users)
+
+
+@router.put("/users/{user_id}/role")
+async def update_user_role(
+    user_id: str,
+    data: RoleUpdate,
+    current_user: dict = Depends(get_current_admin)
+):
+    """Altera o papel do usuário; tokens e sessões abertas com o papel anterior deixam de valer (apenas admin)"""
+    user = await AuthService.set_role(user_id, data.role)
+    return {"id": str(user["_id"]), "role": user["role"], "token_version": user["token_version"]}
+
+
+@router.get("/users/{user_id}/ledger")
+async def get_user_ledger(
+    user_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: dict = Depends(get_current_admin)
+):
+    """
+    Extrato de horas do usuário: snapshot, entradas ainda não compactadas e a
+    diferença para o saldo materializado (apenas admin)
+    """
+    return json_response(await LedgerService.statement(user_id, limit))
 
 
 @router.put("/company")
@@ -206,6 +379,8 @@ async def update_company_info(
         company_data["type"] = "company"
         await db.config.insert_one(company_data)
     
+    await CompanyService.invalidate()
+    
     # Gera a URL da loja
     frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173")
     store_url = f"{frontend_url}/loja/{company_data.get('slug', '')}"
@@ -255,6 +430,8 @@ async def update_financial_info(
         financial_data["type"] = "financial"
         await db.config.insert_one(financial_data)
     
+    await CompanyService.invalidate()
+    
     return {"message": "Informações financeiras atualizadas com sucesso"}
 
 
@@ -363,6 +540,8 @@ async def update_config(
         result = await db.companies.insert_one(update_data)
         company_id = str(result.inserted_id)
     
+    await CompanyService.invalidate()
+    
     # Retorna o slug e company_id para o frontend
     response = {
         "message": "Configurações atualizadas com sucesso",
@@ -397,7 +576,9 @@ async def get_financial_report(current_user: dict = Depends(get_current_admin)):
     
     # Total de pedidos da empresa
     total_orders = await db.orders.count_documents({"company_slug": company_slug})
+    total_orders += await ArchiveService.archived_count({"company_slug": company_slug})
     paid_orders = await db.orders.count_documents({"company_slug": company_slug, "status": "paid"})
+    paid_orders += await ArchiveService.archived_count({"company_slug": company_slug, "status": "paid"})
     pending_orders = await db.orders.count_documents({"company_slug": company_slug, "status": "pending"})
     
     # Receita total
@@ -406,7 +587,8 @@ async def get_financial_report(current_user: dict = Depends(get_current_admin)):
         {"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}
     ]
     revenue_result = await db.orders.aggregate(pipeline).to_list(length=1)
-    total_revenue = revenue_result[0]["total"] if revenue_result else 0
+    revenue_result += await ArchiveService.archived_aggregate(pipeline)
+    total_revenue = sum(row["total"] for row in revenue_result)
     
     # Vendas por mês
     monthly_pipeline = [
@@ -421,10 +603,9 @@ async def get_financial_report(current_user: dict = Depends(get_current_admin)):
                 "valor": {"$sum": "$total_amount"}
             }
         },
-        {"$sort": {"_id.year": 1, "_id.month": 1}},
-        {"$limit": 12}
+        {"$sort": {"_id.year": 1, "_id.month": 1}}
     ]
-    monthly_result = await db.orders.aggregate(monthly_pipeline).to_list(length=12)
+    monthly_result = await _monthly_totals(db, monthly_pipeline)
     
     month_names = ["", "Jan", "Fev", "Mar", "Abr", "Mai", "Jun", "Jul", "Ago", "Set", "Out", "Nov", "Dez"]
     monthly_data = []
@@ -438,9 +619,7 @@ async def get_financial_report(current_user: dict = Depends(get_current_admin)):
         })
     
     # Últimos pedidos
-    recent_orders = await db.orders.find(
-        {"company_slug": company_slug}
-    ).sort("created_at", -1).limit(10).to_list(length=10)
+    recent_orders = await ArchiveService.find_orders({"company_slug": company_slug}, limit=10)
     
     for order in recent_orders:
         order["id"] = str(order.pop("_id"))
@@ -511,6 +690,7 @@ async def migrate_company_data(current_user: dict = Depends(get_current_admin)):
     
     # Insere na nova coleção
     result = await db.companies.insert_one(new_company)
+    await CompanyService.invalidate()
     
     return {
         "message": "Migração concluída com sucesso",
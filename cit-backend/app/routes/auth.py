@@ -1,16 +1,19 @@
+from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status, Body
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app.schemas.user import UserCreate, UserLogin, UserResponse, Token
+from app.schemas.user import UserCreate, UserLogin, UserResponse, Token, RefreshTokenRequest, PasswordChange
 from app.services.auth_service import AuthService
+from app.services.ledger_service import LedgerService
 from app.core.security import decode_access_token
+from bson import ObjectId
 import logging
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 security = HTTPBearer()
 
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Dependency para obter o usuário atual"""
+async def get_current_principal(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Dependency que resolve o usuário pelas claims assinadas do token, conferidas com o usuário em cache"""
     token = credentials.credentials
     payload = decode_access_token(token)
     
@@ -27,24 +30,72 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="Token inválido"
         )
     
-    user = await AuthService.get_user_by_email(email)
+    user_id = payload.get("uid")
+    if user_id is None or not ObjectId.is_valid(user_id):
+        # Tokens antigos não trazem o ID: resolve pelo email uma única vez
+        user = await AuthService.get_user_by_email(email)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Usuário não encontrado"
+            )
+        payload = AuthService.build_token_claims(user)
+        user_id = payload["uid"]
+    
+    if AuthService.is_session_revoked(payload.get("sid")):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Sessão encerrada"
+        )
+    
+    # Documento em cache (uma leitura por usuário a cada USER_CACHE_TTL_SECONDS):
+    # rejeita tokens emitidos antes de troca de senha/papel, e o papel vale o gravado
+    user = await AuthService.get_cached_user(user_id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Usuário não encontrado"
+        )
+    if user.get("token_version", 0) != payload.get("ver", 0):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token inválido ou expirado"
+        )
+    
+    return {
+        "_id": ObjectId(user_id),
+        "email": email,
+        "role": user.get("role", "client"),
+        "token_version": user.get("token_version", 0)
+    }
+
+
+async def get_current_user(principal: dict = Depends(get_current_principal)):
+    """Dependency para obter o documento do usuário atual (via cache)"""
+    user = await AuthService.get_cached_user(str(principal["_id"]))
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Usuário não encontrado"
         )
     
+    if user.get("token_version", 0) > principal["token_version"]:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token inválido ou expirado"
+        )
+    
     return user
 
 
-async def get_current_admin(current_user: dict = Depends(get_current_user)):
+async def get_current_admin(principal: dict = Depends(get_current_principal)):
     """Dependency para verificar se o usuário é admin"""
-    if current_user["role"] != "admin":
+    if principal["role"] != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Acesso negado. Apenas administradores."
         )
-    return current_user
+    return principal
 
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
@@ -68,7 +119,37 @@ async def login(login_data: UserLogin):
     result = await AuthService.authenticate_user(login_data)
     return Token(
         access_token=result["access_token"],
-        token_type=result["token_type"]
+        token_type=result["token_type"],
+        refresh_token=result["refresh_token"]
+    )
+
+
+@router.post("/refresh", response_model=Token)
+async def refresh(data: RefreshTokenRequest):
+    """Renova o access token a partir de um refresh token (sem senha)"""
+    result = await AuthService.refresh_session(data.refresh_token)
+    return Token(
+        access_token=result["access_token"],
+        token_type=result["token_type"],
+        refresh_token=result["refresh_token"]
+    )
+
+
+@router.post("/logout")
+async def logout(data: RefreshTokenRequest):
+    """Encerra a sessão associada ao refresh token"""
+    await AuthService.logout(data.refresh_token)
+    return {"message": "Sessão encerrada"}
+
+
+@router.post("/change_password", response_model=Token)
+async def change_password(data: PasswordChange, principal: dict = Depends(get_current_principal)):
+    """Troca a senha do usuário autenticado; as demais sessões são encerradas"""
+    result = await AuthService.change_password(str(principal["_id"]), data.current_password, data.new_password)
+    return Token(
+        access_token=result["access_token"],
+        token_type=result["token_type"],
+        refresh_token=result["refresh_token"]
     )
 
 
@@ -85,11 +166,16 @@ async def get_me(current_user: dict = Depends(get_current_user)):
     )
 
 @router.post("/update_hours")
-async def update_hours(email: str = Body(...), hours: float = Body(...)):
-    """Atualiza o saldo de horas do usuário cliente pelo email"""
+async def update_hours(email: str = Body(...), hours: float = Body(...), expected_hours: Optional[float] = Body(None)):
+    """
+    Ajusta o saldo de horas do usuário cliente pelo email. O ajuste entra no
+    livro de horas como a diferença para o saldo atual; com expected_hours,
+    responde 409 se o saldo mudou desde que foi lido.
+    """
     logging.warning(f"[update_hours] email recebido: {email}")
     logging.warning(f"[update_hours] hours recebido: {hours}")
-    updated = await AuthService.update_hours_by_email(email, hours)
-    if not updated:
+    user = await AuthService.get_user_by_email(email)
+    if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado ou horas não atualizadas")
+    await LedgerService.set_balance(str(user["_id"]), hours, expected=expected_hours, ref={"email": email})
     return {"message": f"Saldo de horas atualizado para {hours} para o usuário {email}"}
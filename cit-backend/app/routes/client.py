@@ -1,39 +1,38 @@
 from datetime import datetime, timezone
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from bson import ObjectId
-from app.routes.auth import get_current_user
+from app.core import http_cache
+from app.core.serialization import batch_to_dict, json_response, order_to_dict, voucher_to_dict
+from app.routes.auth import get_current_principal
 from app.schemas.voucher import VoucherResponse
-from app.schemas.order import OrderCreate, OrderResponse
+from app.schemas.order import BulkOrderCreate, BulkOrderResponse, OrderCreate, OrderResponse
 from app.services.voucher_service import VoucherService
+from app.services.archive_service import ArchiveService
+from app.services.order_batch_service import OrderBatchService
+from app.services.payment_service import FULFILLMENT_MODES
+from app.services.auth_service import AuthService
+from app.services.company_service import CompanyService
 from app.database.mongo import get_database
 
 router = APIRouter(prefix="/client", tags=["Client"])
 
 
 @router.get("/vouchers", response_model=List[VoucherResponse])
-async def get_vouchers():
+async def get_vouchers(request: Request):
     """Lista todos os vouchers disponíveis (público)"""
-    vouchers = await VoucherService.get_all_vouchers(active_only=True)
-    
-    return [
-        VoucherResponse(
-            id=str(voucher["_id"]),
-            name=voucher["name"],
-            hours=voucher["hours"],
-            price=voucher["price"],
-            active=voucher["active"],
-            description=voucher.get("description"),
-            created_at=voucher["created_at"].isoformat()
-        )
-        for voucher in vouchers
-    ]
+    
+    async def build():
+        vouchers = await VoucherService.get_all_vouchers(active_only=True)
+        return [voucher_to_dict(voucher) for voucher in vouchers]
+    
+    return await http_cache.cached_json_response(request, ("catalog",), build)
 
 
 @router.post("/orders", response_model=OrderResponse, status_code=status.HTTP_201_CREATED)
 async def create_order(
     order_data: OrderCreate,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_principal)
 ):
     """Cria um novo pedido"""
     db = get_database()
@@ -54,29 +53,14 @@ async def create_order(
             detail="Método de pagamento inválido"
         )
     
-    # Busca os dados da empresa para associar ao pedido
-    # Se tiver slug, busca por ele, senão busca a empresa padrão
-    if order_data.company_slug:
-        company_config = await db.config.find_one({
-            "type": "company",
-            "slug": order_data.company_slug
-        })
-        # Se não encontrar pelo slug, tenta buscar e verificar pelo nome
-        if not company_config:
-            company_config = await db.config.find_one({"type": "company"})
-    else:
-        company_config = await db.config.find_one({"type": "company"})
-    
-    company_data = None
-    if company_config:
-        company_data = {
-            "name": company_config.get("name", ""),
-            "slug": company_config.get("slug", order_data.company_slug),
-            "cnpj": company_config.get("cnpj", ""),
-            "email": company_config.get("email", ""),
-            "phone": company_config.get("phone", ""),
-            "address": company_config.get("address", "")
-        }
+    if order_data.fulfillment not in FULFILLMENT_MODES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Modo de entrega inválido"
+        )
+    
+    # Busca os dados da empresa para associar ao pedido (em cache)
+    company_data = await CompanyService.get_order_company(order_data.company_slug)
     
     # Cria o pedido
     order_dict = {
@@ -89,6 +73,7 @@ async def create_order(
         "voucher_name": voucher["name"],
         "company": company_data,
         "company_slug": order_data.company_slug,
+        "fulfillment": order_data.fulfillment,
         "created_at": datetime.now(timezone.utc),
         "paid_at": None
     }
@@ -96,60 +81,72 @@ async def create_order(
     result = await db.orders.insert_one(order_dict)
     order_dict["_id"] = result.inserted_id
     
-    return OrderResponse(
-        id=str(order_dict["_id"]),
-        user_id=order_dict["user_id"],
-        voucher_id=order_dict["voucher_id"],
-        payment_method=order_dict["payment_method"],
-        status=order_dict["status"],
-        total_amount=order_dict["total_amount"],
-        voucher_hours=order_dict["voucher_hours"],
-        created_at=order_dict["created_at"].isoformat(),
-        paid_at=None
-    )
+    return json_response(order_to_dict(order_dict), status_code=status.HTTP_201_CREATED)
+
+
+@router.post("/orders/bulk", response_model=BulkOrderResponse, status_code=status.HTTP_201_CREATED)
+async def create_bulk_order(
+    batch_data: BulkOrderCreate,
+    current_user: dict = Depends(get_current_principal)
+):
+    """Cria vários pedidos de uma vez (carrinho de revendedor) com uma única cobrança PIX"""
+    batch = await OrderBatchService.create_batch(str(current_user["_id"]), batch_data)
+    return json_response(batch_to_dict(batch), status_code=status.HTTP_201_CREATED)
+
+
+@router.get("/orders/bulk/{batch_id}", response_model=BulkOrderResponse)
+async def get_bulk_order(
+    batch_id: str,
+    current_user: dict = Depends(get_current_principal)
+):
+    """Retorna o lote com o resultado de cada item"""
+    batch = await OrderBatchService.get_batch(batch_id, str(current_user["_id"]))
+    return json_response(batch_to_dict(batch))
+
+
+@router.post("/orders/bulk/{batch_id}/confirm")
+async def confirm_bulk_order(
+    batch_id: str,
+    current_user: dict = Depends(get_current_principal)
+):
+    """Confirma o pagamento PIX do lote"""
+    return await OrderBatchService.confirm_batch(batch_id, str(current_user["_id"]))
 
 
 @router.get("/orders", response_model=List[OrderResponse])
-async def get_my_orders(current_user: dict = Depends(get_current_user)):
-    """Lista os pedidos do usuário autenticado"""
-    db = get_database()
+async def get_my_orders(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500),
+    current_user: dict = Depends(get_current_principal)
+):
+    """Lista os pedidos do usuário autenticado (pedidos antigos vêm do arquivo quando o período os alcança)"""
+    orders = await ArchiveService.find_orders(
+        {"user_id": str(current_user["_id"])}, since=since, until=until, skip=skip, limit=limit
+    )
     
-    orders = await db.orders.find(
-        {"user_id": str(current_user["_id"])}
-    ).sort("created_at", -1).to_list(length=100)
-    
-    return [
-        OrderResponse(
-            id=str(order["_id"]),
-            user_id=order["user_id"],
-            voucher_id=order["voucher_id"],
-            payment_method=order["payment_method"],
-            status=order["status"],
-            total_amount=order["total_amount"],
-            voucher_hours=order["voucher_hours"],
-            created_at=order["created_at"].isoformat(),
-            paid_at=order["paid_at"].isoformat() if order.get("paid_at") else None
-        )
-        for order in orders
-    ]
+    return json_response([order_to_dict(order) for order in orders])
 
 
 @router.get("/dashboard")
-async def get_client_dashboard(current_user: dict = Depends(get_current_user)):
+async def get_client_dashboard(current_user: dict = Depends(get_current_principal)):
     """Retorna dados do painel do cliente"""
     db = get_database()
     
-    # Busca dados atualizados do usuário
-    user = await db.users.find_one({"_id": current_user["_id"]})
+    # Busca dados do usuário (cache invalidado a cada alteração de saldo)
+    user = await AuthService.get_cached_user(str(current_user["_id"]))
     
-    # Total de pedidos
+    # Total de pedidos (coleção quente + arquivo)
     total_orders = await db.orders.count_documents({"user_id": str(current_user["_id"])})
+    total_orders += await ArchiveService.archived_count({"user_id": str(current_user["_id"])})
     
     # Pedidos pagos
     paid_orders = await db.orders.count_documents({
         "user_id": str(current_user["_id"]),
         "status": "paid"
     })
+    paid_orders += await ArchiveService.archived_count({"user_id": str(current_user["_id"]), "status": "paid"})
     
     # Total gasto
     pipeline = [
@@ -157,10 +154,11 @@ async def get_client_dashboard(current_user: dict = Depends(get_current_user)):
         {"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}
     ]
     spent_result = await db.orders.aggregate(pipeline).to_list(length=1)
-    total_spent = spent_result[0]["total"] if spent_result else 0
+    spent_result += await ArchiveService.archived_aggregate(pipeline)
+    total_spent = sum(row["total"] for row in spent_result)
     
     return {
-        "hours_balance": user.get("hours_balance", 0.0),
+        "hours_balance": user.get("hours_balance", 0.0) if user else 0.0,
         "total_orders": total_orders,
         "paid_orders": paid_orders,
         "total_spent": total_spent
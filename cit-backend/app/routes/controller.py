@@ -0,0 +1,65 @@
+"""
+Rotas dos controladores de hotspot (autenticação por chave de API)
+"""
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from app.core.config import settings
+from app.core.serialization import json_response
+from app.schemas.usage import AuthorizeResponse, UsageBatch, UsageIngestResponse
+from app.services.access_code_service import AccessCodeFilter, normalize_code
+from app.services.balance_index import BalanceIndex
+from app.services.usage_service import UsageService
+
+router = APIRouter(prefix="/controller", tags=["Controller"])
+
+
+async def get_controller(x_api_key: Optional[str] = Header(None, alias="x-api-key")) -> str:
+    """Dependency que valida o header X-API-Key e retorna o nome do controlador"""
+    if x_api_key:
+        for name, key in settings.CONTROLLER_API_KEYS.items():
+            if secrets.compare_digest(x_api_key.encode(), key.encode()):
+                return name
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Chave de API inválida"
+    )
+
+
+@router.post("/usage", response_model=UsageIngestResponse)
+async def report_usage(
+    batch: UsageBatch,
+    controller: str = Depends(get_controller)
+):
+    """Recebe eventos de uso (segundos e bytes por usuário ou código) em lote"""
+    if len(batch.events) > settings.USAGE_MAX_EVENTS_PER_REQUEST:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Máximo de {settings.USAGE_MAX_EVENTS_PER_REQUEST} eventos por requisição"
+        )
+    return await UsageService.ingest(controller, batch.events)
+
+
+@router.get("/authorize", response_model=AuthorizeResponse)
+async def authorize(
+    user_id: Optional[str] = Query(None),
+    code: Optional[str] = Query(None),
+    controller: str = Depends(get_controller)
+):
+    """Tempo restante de um usuário ou código e quando o controlador deve perguntar de novo"""
+    if (user_id is None) == (code is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Informe user_id ou code"
+        )
+
+    if user_id is not None:
+        remaining, source = await BalanceIndex.remaining_for_user(user_id)
+    else:
+        code = normalize_code(code)
+        if not AccessCodeFilter.might_exist(code):
+            remaining, source = None, "filter"
+        else:
+            remaining, source = await BalanceIndex.remaining_for_code(code)
+
+    return json_response(BalanceIndex.decision(remaining, source))
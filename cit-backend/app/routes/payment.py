@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from app.routes.auth import get_current_user
+from app.routes.auth import get_current_principal
 from app.schemas.order import PaymentCreate, PaymentResponse
+from app.core.serialization import json_response, payment_to_dict
 from app.services.payment_service import PaymentService
 from app.services.mercadopago_service import MercadoPagoService
 
@@ -22,31 +23,18 @@ async def get_mercadopago_public_key():
 @router.post("/process", response_model=PaymentResponse, status_code=status.HTTP_201_CREATED)
 async def process_payment(
     payment_data: PaymentCreate,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_principal)
 ):
     """Processa um pagamento"""
     payment = await PaymentService.process_payment(payment_data)
     
-    return PaymentResponse(
-        id=str(payment["_id"]),
-        order_id=payment["order_id"],
-        payment_method=payment["payment_method"],
-        status=payment["status"],
-        amount=payment["amount"],
-        pix_qrcode=payment.get("pix_qrcode"),
-        pix_key=payment.get("pix_key"),
-        card_last_digits=payment.get("card_last_digits"),
-        mercadopago_payment_id=str(payment.get("mercadopago_payment_id")) if payment.get("mercadopago_payment_id") else None,
-        status_detail=payment.get("status_detail"),
-        installments=payment.get("installments"),
-        created_at=payment["created_at"].isoformat()
-    )
+    return json_response(payment_to_dict(payment), status_code=status.HTTP_201_CREATED)
 
 
 @router.post("/confirm/{order_id}")
 async def confirm_payment(
     order_id: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_principal)
 ):
     """Confirma um pagamento PIX (simulação)"""
     result = await PaymentService.confirm_payment_and_add_hours(order_id)
@@ -56,7 +44,7 @@ async def confirm_payment(
 @router.get("/status/{order_id}")
 async def get_payment_status(
     order_id: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_principal)
 ):
     """Verifica o status de um pagamento - Auto-confirma PIX pendente (simulação)"""
     payment = await PaymentService.get_payment_by_order_id(order_id)
@@ -69,18 +57,14 @@ async def get_payment_status(
     
     # SIMULAÇÃO: Se for PIX pendente, confirma automaticamente
     if payment["payment_method"] == "pix" and payment["status"] == "pending":
-        await PaymentService.confirm_payment_and_add_hours(order_id)
-        # Recarrega o pagamento atualizado
-        payment = await PaymentService.get_payment_by_order_id(order_id)
+        try:
+            await PaymentService.confirm_payment_and_add_hours(order_id)
+        except HTTPException as e:
+            # Ainda não aprovado no Mercado Pago: responde o status atual
+            if e.status_code != status.HTTP_400_BAD_REQUEST:
+                raise
+        else:
+            # Recarrega o pagamento atualizado
+            payment = await PaymentService.get_payment_by_order_id(order_id)
     
-    return PaymentResponse(
-        id=str(payment["_id"]),
-        order_id=payment["order_id"],
-        payment_method=payment["payment_method"],
-        status=payment["status"],
-        amount=payment["amount"],
-        pix_qrcode=payment.get("pix_qrcode"),
-        pix_key=payment.get("pix_key"),
-        card_last_digits=payment.get("card_last_digits"),
-        created_at=payment["created_at"].isoformat()
-    )
+    return json_response(payment_to_dict(payment, detailed=False))
@@ -0,0 +1,18 @@
+"""
+Rotas do portal cativo (hotspot)
+"""
+from fastapi import APIRouter, Depends
+from app.routes.auth import get_current_principal
+from app.schemas.portal import RedeemRequest, RedeemResponse
+from app.services.access_code_service import AccessCodeService
+
+router = APIRouter(prefix="/portal", tags=["Portal"])
+
+
+@router.post("/redeem", response_model=RedeemResponse)
+async def redeem_code(
+    data: RedeemRequest,
+    current_user: dict = Depends(get_current_principal)
+):
+    """Resgata um código de acesso e credita as horas no saldo do usuário"""
+    return await AccessCodeService.redeem(data.code, str(current_user["_id"]))
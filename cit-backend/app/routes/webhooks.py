@@ -7,12 +7,13 @@ import hashlib
 from datetime import datetime, timezone
 from fastapi import APIRouter, Request, HTTPException, status, Header
 from typing import Optional
+from app.core.metrics import webhook_lag
 from app.database.mongo import get_database
 from app.services.mercadopago_service import MercadoPagoService
+from app.services.payment_service import PaymentService
+from app.services.order_batch_service import OrderBatchService
 import logging
 
-# Configura logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/webhooks", tags=["Webhooks"])
@@ -61,6 +62,21 @@ def verify_signature(
         return False
 
 
+def observe_webhook_lag(body: dict) -> None:
+    """Registra o atraso entre a criação do evento no Mercado Pago e a chegada aqui"""
+    created = body.get("date_created")
+    if not isinstance(created, str):
+        return
+    try:
+        created_at = datetime.fromisoformat(created.replace("Z", "+00:00"))
+    except ValueError:
+        return
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    lag = (datetime.now(timezone.utc) - created_at).total_seconds()
+    webhook_lag.observe(max(0.0, lag), body.get("type") or body.get("action") or "unknown")
+
+
 @router.post("/mercadopago")
 async def mercadopago_webhook(
     request: Request,
@@ -79,14 +95,16 @@ async def mercadopago_webhook(
     except:
         body = {}
     
-    logger.info(f"Webhook recebido: {body}")
-    
     # Extrai dados do webhook
     action = body.get("action", "")
     data = body.get("data", {})
     data_id = data.get("id", body.get("id", ""))
     notification_type = body.get("type", "")
     
+    logger.info("Webhook recebido", extra={"type": notification_type, "action": action, "data_id": str(data_id)})
+    logger.debug("Corpo do webhook", extra={"body": body})
+    observe_webhook_lag(body)
+    
     # Valida assinatura (se configurada)
     if x_signature and x_request_id and data_id:
         if not verify_signature(x_signature, x_request_id, str(data_id)):
@@ -151,15 +169,23 @@ async def process_payment_notification(payment_id: str):
             "updated_at": datetime.now(timezone.utc)
         }
         
-        # Se aprovado, adiciona data de pagamento
+        # Se aprovado, adiciona data de pagamento; a marca sai quando a entrega terminar
         if new_status == "paid":
             update_data["paid_at"] = datetime.now(timezone.utc)
+            update_data["fulfillment_pending"] = True
         
-        # Atualiza pelo external_reference (que é o order_id)
-        result = await db.orders.update_one(
-            {"_id": ObjectId(external_reference)},
-            {"$set": update_data}
-        )
+        # Atualiza pelo external_reference (que é o order_id, ou o ID do lote).
+        # Só a transição para "paid" entrega: notificações repetidas do mesmo pagamento não casam.
+        # Pedido expirado só muda com pagamento aprovado: o cancelamento da ordem PIX também notifica;
+        # "pending"/"failed" atrasados não rebaixam um pedido já pago
+        query = {"_id": ObjectId(external_reference)}
+        if new_status == "paid":
+            query["status"] = {"$ne": "paid"}
+        elif new_status in ("pending", "failed"):
+            query["status"] = {"$nin": ["paid", "expired"]}
+        else:
+            query["status"] = {"$ne": "expired"}
+        result = await db.orders.update_one(query, {"$set": update_data})
         
         if result.modified_count > 0:
             logger.info(f"Pedido {external_reference} atualizado para status: {new_status}")
@@ -168,14 +194,8 @@ async def process_payment_notification(payment_id: str):
             if new_status == "paid":
                 order = await db.orders.find_one({"_id": ObjectId(external_reference)})
                 if order:
-                    # Adiciona horas ao usuário
-                    await db.users.update_one(
-                        {"_id": ObjectId(order["user_id"])},
-                        {
-                            "$inc": {"hours_balance": order.get("voucher_hours", 0)},
-                            "$set": {"updated_at": datetime.now(timezone.utc)}
-                        }
-                    )
+                    # Credita as horas ou emite o código de acesso
+                    await PaymentService.fulfill_order(order)
                     
                     # Atualiza o pagamento para confirmado
                     await db.payments.update_one(
@@ -188,9 +208,13 @@ async def process_payment_notification(payment_id: str):
                             }
                         }
                     )
-                    logger.info(f"Horas adicionadas ao usuário {order['user_id']}: {order.get('voucher_hours', 0)}h")
+                    logger.info(f"Pedido {external_reference} entregue ao usuário {order['user_id']}: {order.get('voucher_hours', 0)}h")
+        elif result.matched_count == 0 and await OrderBatchService.apply_payment_status(
+            external_reference, new_status, payment_id
+        ):
+            logger.info(f"Lote {external_reference} processado com status: {new_status}")
         else:
-            logger.warning(f"Pedido {external_reference} não encontrado para atualização")
+            logger.warning(f"Pedido {external_reference} não encontrado, já processado ou expirado (status {new_status} ignorado)")
         
     except Exception as e:
         logger.error(f"Erro ao processar pagamento {payment_id}: {e}")
@@ -1,4 +1,4 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from pydantic import BaseModel
 
 
@@ -6,6 +6,45 @@ class OrderCreate(BaseModel):
     voucher_id: str
     payment_method: str  # pix | credit | debit
     company_slug: Optional[str] = None  # Slug da empresa para associar o pedido
+    fulfillment: str = "balance"  # balance (credita o saldo) | code (emite código de acesso)
+
+
+class BulkOrderItem(BaseModel):
+    voucher_id: str
+    quantity: int
+
+
+class BulkOrderCreate(BaseModel):
+    items: List[BulkOrderItem]
+    payment_method: str = "pix"  # Lotes são cobrados em uma única ordem PIX
+    company_slug: Optional[str] = None
+    fulfillment: str = "balance"  # balance | code (um código de acesso por voucher)
+
+
+class BulkOrderItemResult(BaseModel):
+    voucher_id: str
+    quantity: int
+    status: str  # created | rejected
+    error: Optional[str] = None
+    unit_price: Optional[float] = None
+    hours: Optional[float] = None
+    order_ids: List[str] = []
+    codes: List[str] = []
+
+
+class BulkOrderResponse(BaseModel):
+    batch_id: str
+    status: str
+    fulfillment: str = "balance"
+    total_orders: int
+    total_amount: float
+    total_hours: float
+    items: List[BulkOrderItemResult]
+    pix_qrcode: Optional[str] = None
+    pix_key: Optional[str] = None
+    fallback_mode: bool = False
+    created_at: str
+    paid_at: Optional[str] = None
 
 
 class CompanyInfo(BaseModel):
@@ -26,6 +65,8 @@ class OrderResponse(BaseModel):
     voucher_hours: float
     voucher_name: Optional[str] = None
     company: Optional[CompanyInfo] = None
+    fulfillment: str = "balance"
+    access_code: Optional[str] = None
     created_at: str
     paid_at: Optional[str] = None
 
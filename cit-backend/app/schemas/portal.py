@@ -0,0 +1,12 @@
+from typing import Optional
+from pydantic import BaseModel
+
+
+class RedeemRequest(BaseModel):
+    code: str  # Aceita "ABCDE-12345", com ou sem hífen
+
+
+class RedeemResponse(BaseModel):
+    message: str
+    hours_added: float
+    hours_balance: Optional[float] = None
@@ -0,0 +1,39 @@
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel
+
+
+class UsageEvent(BaseModel):
+    event_id: str  # Único por evento; reenvios com o mesmo ID são ignorados
+    user_id: Optional[str] = None  # Informe user_id ou code
+    code: Optional[str] = None
+    session_id: Optional[str] = None
+    seconds: float
+    bytes_in: int = 0
+    bytes_out: int = 0
+    at: Optional[datetime] = None  # Fim do intervalo medido (padrão: recebimento)
+
+
+class UsageBatch(BaseModel):
+    events: List[UsageEvent]
+
+
+class RejectedUsageEvent(BaseModel):
+    event_id: str
+    error: str
+
+
+class UsageIngestResponse(BaseModel):
+    accepted: int
+    duplicates: int
+    pending: List[str] = []  # Em processamento por outra requisição: reenviar depois
+    rejected: List[RejectedUsageEvent] = []
+
+
+class AuthorizeResponse(BaseModel):
+    allowed: bool
+    remaining_seconds: int
+    recheck_after: int  # Segundos até a próxima consulta
+    expires_at: Optional[int] = None  # Epoch em que o saldo acaba se consumido sem parar
+    reason: Optional[str] = None  # not_found | no_balance
+    source: str  # memory | database | filter
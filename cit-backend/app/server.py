@@ -0,0 +1,64 @@
+"""
+Ponto de entrada de produção: uvicorn com vários workers
+
+O número de workers vem de WEB_CONCURRENCY ou, se 0, das CPUs disponíveis
+para o container (cpuset e quota do cgroup). Com mais de um worker, o rate
+limit passa a usar o MongoDB quando RATE_LIMIT_STORAGE não foi definido,
+já que os buckets em memória não são compartilhados entre processos, e as
+métricas de cada worker são agregadas por um diretório compartilhado.
+
+Uso:
+    python -m app.server
+"""
+import math
+import os
+import tempfile
+import uvicorn
+from app.core.config import settings
+
+
+def available_cpus() -> int:
+    """CPUs que o processo pode usar, respeitando limites do container"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    # cgroup v2: "max 100000" (sem limite) ou "200000 100000" (2 CPUs)
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+
+    return max(1, cpus)
+
+
+def worker_count() -> int:
+    return settings.WEB_CONCURRENCY if settings.WEB_CONCURRENCY > 0 else available_cpus()
+
+
+def main() -> None:
+    workers = worker_count()
+    if workers > 1 and "RATE_LIMIT_STORAGE" not in settings.model_fields_set:
+        # Os workers herdam o ambiente do processo supervisor
+        os.environ["RATE_LIMIT_STORAGE"] = "mongo"
+    if workers > 1 and not settings.METRICS_MULTIPROC_DIR:
+        os.environ["METRICS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="cit-metrics-")
+
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", "8000")),
+        workers=workers,
+        proxy_headers=True,
+        # Só os proxies conhecidos: com "*" o X-Forwarded-For de qualquer cliente seria aceito
+        forwarded_allow_ips=settings.FORWARDED_ALLOW_IPS,
+        timeout_graceful_shutdown=20
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""
+Códigos de acesso (PIN) entregues nos pedidos com fulfillment "code"
+
+Uma tarefa do líder mantém em `access_codes` um estoque de códigos
+aleatórios (secrets) já gravados, com índice único em `code`. Na
+confirmação do pagamento o código é reservado com um único
+find_one_and_update, sem gerar nada no caminho crítico: a latência de
+emissão não depende do volume de vendas. Se o estoque acabar, o código é
+gerado na hora como contingência.
+
+O índice único (parcial) em `order_id` garante um código por pedido:
+confirmações simultâneas do mesmo pedido (webhook repetido, polling de
+status, confirmação manual) recebem todas o mesmo código.
+
+Estados: available -> issued (vinculado ao pedido) -> redeemed.
+
+No resgate, a troca para redeemed grava `credit_pending`, removido depois
+que as horas entram no livro. Um resgate interrompido entre os dois passos
+é creditado pela tarefa do líder (a chave `redeem:{code}` evita crédito
+duplo).
+
+O resgate no portal passa antes por um filtro de Bloom com todos os
+códigos gravados (AccessCodeFilter): códigos inexistentes, a maior parte
+das tentativas, são recusados sem consultar o MongoDB.
+"""
+import asyncio
+import logging
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app.core.bloom import BloomFilter
+from app.core.config import settings
+from app.core.metrics import access_code_redemptions
+from app.database.mongo import get_database
+from app.services.balance_index import BalanceIndex
+from app.services.job_service import JobService
+from app.services.ledger_service import LedgerService
+
+logger = logging.getLogger(__name__)
+
+# Sem caracteres ambíguos (0/O, 1/I/L) para quem digita no portal
+ALPHABET = "23456789ABCDEFGHJKMNPQRSTUVWXYZ"
+
+REFRESH_OVERLAP_SECONDS = 10
+
+
+def generate_code() -> str:
+    return "".join(secrets.choice(ALPHABET) for _ in range(settings.ACCESS_CODE_LENGTH))
+
+
+def normalize_code(code: str) -> str:
+    """Aceita o código com hífens/espaços e em minúsculas"""
+    return "".join(code.split()).replace("-", "").upper()
+
+
+def format_code(code: str) -> str:
+    """XXXXX-XXXXX para exibição"""
+    half = (len(code) + 1) // 2
+    return f"{code[:half]}-{code[half:]}"
+
+
+class AccessCodeFilter:
+    """
+    Filtro de Bloom dos códigos deste worker. A carga inicial lê todos os
+    códigos ainda não resgatados; depois, a cada PORTAL_FILTER_REFRESH_SECONDS,
+    só os documentos com _id maior que o último visto (códigos novos do
+    estoque ou gerados na contingência). Quando o filtro enche, ou a cada
+    PORTAL_FILTER_REBUILD_SECONDS (para descartar os já resgatados), é
+    reconstruído por inteiro e trocado de uma vez.
+    """
+
+    _filter: Optional[BloomFilter] = None
+    _last_id: Optional[ObjectId] = None
+    _built_at: float = 0.0
+    _task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def might_exist(cls, code: str) -> bool:
+        # Sem filtro carregado ainda: não recusa nada, o banco decide
+        return cls._filter is None or code in cls._filter
+
+    @classmethod
+    def remember(cls, code: str) -> None:
+        """Códigos gravados por este worker entram na hora"""
+        if cls._filter is not None and code not in cls._filter:
+            cls._filter.add(code)
+
+    @classmethod
+    async def rebuild(cls) -> None:
+        db = get_database()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        last_id = await db.access_codes.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        total = await db.access_codes.count_documents({"status": {"$ne": "redeemed"}})
+        bloom = BloomFilter(max(total * 2, settings.PORTAL_FILTER_MIN_CAPACITY), settings.PORTAL_FILTER_ERROR_RATE)
+
+        cursor = db.access_codes.find({"status": {"$ne": "redeemed"}}, {"_id": 0, "code": 1}).batch_size(10_000)
+        chunk: List[str] = []
+        async for doc in cursor:
+            chunk.append(doc["code"])
+            if len(chunk) >= 10_000:
+                # Hash de muitos códigos fora do event loop
+                await asyncio.to_thread(cls._add_all, bloom, chunk)
+                chunk = []
+        if chunk:
+            await asyncio.to_thread(cls._add_all, bloom, chunk)
+
+        cls._filter = bloom
+        cls._last_id = last_id["_id"] if last_id else None
+        cls._built_at = started
+        # Códigos gravados durante a leitura: cobertos pelo refresh a partir de last_id
+        await cls.refresh()
+
+    @staticmethod
+    def _add_all(bloom: BloomFilter, codes: List[str]) -> None:
+        for code in codes:
+            bloom.add(code)
+
+    @classmethod
+    async def refresh(cls) -> None:
+        if cls._filter is None:
+            await cls.rebuild()
+            return
+
+        db = get_database()
+        query = {}
+        if cls._last_id is not None:
+            # ObjectIds de processos diferentes não são estritamente crescentes:
+            # relê uma janela antes do último visto (repetidos não contam de novo)
+            since = cls._last_id.generation_time - timedelta(seconds=REFRESH_OVERLAP_SECONDS)
+            query = {"_id": {"$gt": ObjectId.from_datetime(since)}}
+        async for doc in db.access_codes.find(query, {"_id": 1, "code": 1}).sort("_id", 1):
+            if doc["code"] not in cls._filter:
+                cls._filter.add(doc["code"])
+            if cls._last_id is None or doc["_id"] > cls._last_id:
+                cls._last_id = doc["_id"]
+
+    @classmethod
+    async def _refresh_loop(cls) -> None:
+        while True:
+            try:
+                stale = asyncio.get_running_loop().time() - cls._built_at > settings.PORTAL_FILTER_REBUILD_SECONDS
+                if cls._filter is None or cls._filter.full or stale:
+                    await cls.rebuild()
+                else:
+                    await cls.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Erro ao atualizar o filtro de códigos: {e}")
+            await asyncio.sleep(settings.PORTAL_FILTER_REFRESH_SECONDS)
+
+    @classmethod
+    def start(cls) -> None:
+        if cls._task is None or cls._task.done():
+            cls._task = asyncio.create_task(cls._refresh_loop())
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._task is not None:
+            cls._task.cancel()
+            try:
+                await cls._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            cls._task = None
+
+
+class AccessCodeService:
+
+    @staticmethod
+    async def available_count() -> int:
+        db = get_database()
+        return await db.access_codes.count_documents({"status": "available"})
+
+    @staticmethod
+    async def generate_batch(size: int) -> int:
+        """Grava `size` códigos novos; colisões com o estoque são descartadas. Retorna quantos entraram"""
+        db = get_database()
+        now = datetime.now(timezone.utc)
+
+        # Sem repetidos dentro do lote; contra o banco quem decide é o índice único
+        codes = set()
+        while len(codes) < size:
+            codes.add(generate_code())
+
+        documents = [{"code": code, "status": "available", "created_at": now} for code in codes]
+        for code in codes:
+            AccessCodeFilter.remember(code)
+        try:
+            result = await db.access_codes.insert_many(documents, ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            # ordered=False: os demais documentos do lote entram mesmo com colisões
+            return e.details.get("nInserted", 0)
+
+    @staticmethod
+    async def refill_pool() -> None:
+        """Tarefa do líder: repõe o estoque quando fica abaixo do mínimo"""
+        available = await AccessCodeService.available_count()
+        if available >= settings.ACCESS_CODE_POOL_LOW_WATERMARK:
+            return
+
+        missing = settings.ACCESS_CODE_POOL_TARGET - available
+        inserted = 0
+        while inserted < missing:
+            batch = min(settings.ACCESS_CODE_BATCH_SIZE, missing - inserted)
+            added = await AccessCodeService.generate_batch(batch)
+            if added == 0:
+                break
+            inserted += added
+        logger.info("Estoque de códigos reposto", extra={"available": available, "inserted": inserted})
+
+    @staticmethod
+    def _issue_fields(order: dict, now: datetime) -> dict:
+        """Campos gravados na emissão, na mesma escrita que marca o código como issued"""
+        return {
+            "status": "issued",
+            "order_id": str(order["_id"]),
+            "user_id": order["user_id"],
+            "voucher_id": order["voucher_id"],
+            "hours": order["voucher_hours"],
+            "issued_at": now
+        }
+
+    @staticmethod
+    async def _create_issued(fields: dict) -> str:
+        """Contingência com o estoque vazio: gera e já grava como emitido"""
+        db = get_database()
+        while True:
+            code = generate_code()
+            try:
+                await db.access_codes.insert_one({"code": code, "created_at": fields["issued_at"], **fields})
+                AccessCodeFilter.remember(code)
+                return code
+            except DuplicateKeyError:
+                # Colisão de código (tenta outro) ou o pedido já recebeu um em paralelo
+                existing = await AccessCodeService.find_by_order(fields["order_id"])
+                if existing:
+                    return existing
+
+    @staticmethod
+    async def claim(order: dict) -> str:
+        """Reserva um código do estoque para o pedido (uma única operação atômica)"""
+        db = get_database()
+        fields = AccessCodeService._issue_fields(order, datetime.now(timezone.utc))
+
+        # Reentrega: o pedido já recebeu um código numa confirmação anterior
+        existing = await AccessCodeService.find_by_order(fields["order_id"])
+        if existing:
+            return existing
+
+        try:
+            doc = await db.access_codes.find_one_and_update(
+                {"status": "available"},
+                {"$set": fields},
+                projection={"code": 1},
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Confirmação concorrente do mesmo pedido venceu (índice único em order_id);
+            # a escrita foi rejeitada inteira e o código candidato continua no estoque
+            return await AccessCodeService.find_by_order(fields["order_id"])
+        if doc is not None:
+            return doc["code"]
+
+        logger.warning("Estoque de códigos vazio; gerando código na confirmação")
+        return await AccessCodeService._create_issued(fields)
+
+    @staticmethod
+    async def claim_many(orders: List[dict]) -> Dict[str, str]:
+        """
+        Reserva um código por pedido (lotes). Cada código é vinculado ao seu
+        pedido em uma única escrita (status, pedido e horas juntos), todas
+        enviadas em um bulk_write. Pedidos que já têm código o mantêm, então
+        a entrega pode ser repetida. Retorna order_id -> código.
+        """
+        db = get_database()
+        now = datetime.now(timezone.utc)
+
+        codes: Dict[str, str] = {}
+        pending = list(orders)
+        attempts = 0
+        while pending:
+            issued = await db.access_codes.find(
+                {"order_id": {"$in": [str(order["_id"]) for order in pending]}},
+                {"order_id": 1, "code": 1}
+            ).to_list(length=None)
+            codes.update((doc["order_id"], doc["code"]) for doc in issued)
+            pending = [order for order in pending if str(order["_id"]) not in codes]
+            if not pending or attempts >= 5:
+                break
+            attempts += 1
+
+            candidates = await db.access_codes.find(
+                {"status": "available"}, {"_id": 1}
+            ).limit(len(pending)).to_list(length=len(pending))
+            if not candidates:
+                break
+            # Outro worker pode levar parte dos candidatos (o filtro de status não
+            # casa) ou o mesmo pedido (índice único): a próxima volta relê o que ficou
+            try:
+                await db.access_codes.bulk_write(
+                    [
+                        UpdateOne(
+                            {"_id": candidate["_id"], "status": "available"},
+                            {"$set": AccessCodeService._issue_fields(order, now)}
+                        )
+                        for candidate, order in zip(candidates, pending)
+                    ],
+                    ordered=False
+                )
+            except BulkWriteError as e:
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+
+        for order in pending:
+            codes[str(order["_id"])] = await AccessCodeService.claim(order)
+
+        return codes
+
+    @staticmethod
+    async def redeem(raw_code: str, user_id: str) -> dict:
+        """
+        Resgata um código emitido: a troca issued -> redeemed é atômica
+        (um código só credita uma vez) e as horas vão para o saldo do usuário
+        """
+        db = get_database()
+        code = normalize_code(raw_code)
+
+        if len(code) != settings.ACCESS_CODE_LENGTH or any(char not in ALPHABET for char in code):
+            access_code_redemptions.inc("malformed")
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Código inválido")
+
+        if not AccessCodeFilter.might_exist(code):
+            access_code_redemptions.inc("filtered")
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Código inválido")
+
+        now = datetime.now(timezone.utc)
+        redeemed = await db.access_codes.find_one_and_update(
+            # Sem horas o código não chegou a ser vinculado a um pedido
+            {"code": code, "status": "issued", "hours": {"$exists": True}},
+            {"$set": {"status": "redeemed", "redeemed_by": user_id, "redeemed_at": now, "credit_pending": True}},
+            projection={"code": 1, "hours": 1, "used_seconds": 1, "order_id": 1, "redeemed_by": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if redeemed is None:
+            # Existe mas ainda está no estoque, já foi usado, ou era falso positivo do filtro
+            access_code_redemptions.inc("rejected")
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Código inválido ou já utilizado")
+
+        hours, balance = await AccessCodeService._credit(redeemed)
+        BalanceIndex.forget_code(code)
+        access_code_redemptions.inc("redeemed")
+
+        return {
+            "message": "Código resgatado com sucesso",
+            "hours_added": hours,
+            "hours_balance": balance
+        }
+
+    @staticmethod
+    async def _credit(redeemed: dict) -> Tuple[float, Optional[float]]:
+        """Credita no livro o código já marcado como resgatado e remove credit_pending"""
+        db = get_database()
+        # Tempo já usado direto no hotspot (autorização por código) não é creditado
+        hours = max(0.0, redeemed["hours"] - (redeemed.get("used_seconds") or 0.0) / 3600)
+        balance = await LedgerService.record(
+            redeemed["redeemed_by"],
+            hours,
+            "redeem",
+            f"redeem:{redeemed['code']}",
+            {"code": redeemed["code"], "order_id": redeemed.get("order_id")}
+        )
+        await db.access_codes.update_one({"_id": redeemed["_id"]}, {"$unset": {"credit_pending": ""}})
+        return hours, balance
+
+    @staticmethod
+    async def reconcile_redeemed() -> int:
+        """Tarefa do líder: credita resgates interrompidos antes de chegar ao livro"""
+        db = get_database()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.LEDGER_APPLY_GRACE_SECONDS)
+        pending = await db.access_codes.find(
+            {"credit_pending": True, "redeemed_at": {"$lt": cutoff}},
+            {"code": 1, "hours": 1, "used_seconds": 1, "order_id": 1, "redeemed_by": 1}
+        ).limit(settings.LEDGER_COMPACT_BATCH_SIZE).to_list(length=settings.LEDGER_COMPACT_BATCH_SIZE)
+
+        for redeemed in pending:
+            await AccessCodeService._credit(redeemed)
+        if pending:
+            logger.warning("Resgates creditados pela reconciliação", extra={"count": len(pending)})
+        return len(pending)
+
+    @staticmethod
+    async def find_by_order(order_id: str) -> Optional[str]:
+        db = get_database()
+        doc = await db.access_codes.find_one({"order_id": order_id}, {"code": 1})
+        return doc["code"] if doc else None
+
+
+JobService.register("access-code-pool", settings.ACCESS_CODE_REFILL_INTERVAL_SECONDS, AccessCodeService.refill_pool)
+JobService.register("access-code-redeem-reconcile", settings.LEDGER_COMPACT_INTERVAL_SECONDS, AccessCodeService.reconcile_redeemed)
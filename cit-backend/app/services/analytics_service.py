@@ -0,0 +1,155 @@
+"""
+Cubo de vendas (GET /admin/analytics/cube)
+
+Os pedidos (coleção quente e arquivo) são lidos como BSON bruto, só com os
+campos do cubo, e decodificados em colunas NumPy em um pool de processos;
+o agrupamento também roda lá (app.core.analytics_cube). O event loop só
+junta os bytes vindos do cursor.
+
+As colunas ficam em memória e são recarregadas quando a marca d'água dos
+dados muda (último pedido criado, quantidade de pedidos pagos e limite do
+arquivo), no máximo a cada ANALYTICS_MIN_REFRESH_SECONDS. O arquivo é
+imutável entre rodadas de arquivamento e só é relido quando o seu limite
+muda. Os cubos calculados ficam em cache pela marca d'água.
+"""
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from app.core.analytics_cube import Columns, build_cube, decode_orders
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.database.mongo import get_database
+from app.services.archive_service import ArchiveService
+
+_PROJECTION = {
+    "_id": 0,
+    "created_at": 1,
+    "status": 1,
+    "total_amount": 1,
+    "voucher_id": 1,
+    "payment_method": 1,
+    "company_slug": 1
+}
+
+_RAW = CodecOptions(document_class=RawBSONDocument)
+
+
+def _utc_datetime64(value: Optional[datetime]) -> Optional[np.datetime64]:
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(value, "ms")
+
+
+class AnalyticsService:
+
+    _executor: Optional[ProcessPoolExecutor] = None
+    _lock: Optional[asyncio.Lock] = None
+    # (marca d'água, instante da carga, colunas)
+    _hot: Optional[Tuple[tuple, float, Columns]] = None
+    # (limite do arquivo, colunas)
+    _archive: Optional[Tuple[Optional[datetime], Columns]] = None
+    _cubes = TTLCache(maxsize=settings.ANALYTICS_CACHE_SIZE, ttl=settings.ANALYTICS_CACHE_TTL_SECONDS)
+
+    @classmethod
+    async def _run(cls, fn, *args):
+        if cls._executor is None:
+            # spawn: um fork levaria junto as threads do Motor e o estado do event loop
+            cls._executor = ProcessPoolExecutor(
+                max_workers=settings.ANALYTICS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return await asyncio.get_running_loop().run_in_executor(cls._executor, fn, *args)
+
+    @staticmethod
+    async def watermark() -> tuple:
+        """Muda quando um pedido é criado, pago ou estornado, ou quando o arquivo avança"""
+        db = get_database()
+        last = await db.orders.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        paid = await db.orders.count_documents({"status": "paid"})
+        archived_before = await ArchiveService.archived_before()
+        return (
+            str(last["_id"]) if last else None,
+            paid,
+            archived_before.isoformat() if archived_before else None
+        )
+
+    @staticmethod
+    async def _fetch(collection) -> bytes:
+        """Documentos da projeção como BSON concatenado (sem decodificar no event loop)"""
+        cursor = collection.with_options(codec_options=_RAW).find(
+            {}, _PROJECTION, batch_size=settings.ANALYTICS_FETCH_BATCH_SIZE
+        )
+        chunks = []
+        async for doc in cursor:
+            chunks.append(doc.raw)
+        return b"".join(chunks)
+
+    @classmethod
+    async def _snapshot(cls) -> Tuple[tuple, List[Columns]]:
+        """Colunas atuais (recarregadas se a marca d'água mudou) e a marca d'água delas"""
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+
+        # Uma carga por vez: requisições simultâneas esperam e reaproveitam a mesma
+        async with cls._lock:
+            db = get_database()
+            watermark = await cls.watermark()
+            archived_before = await ArchiveService.archived_before()
+
+            archive_reloaded = False
+            if cls._archive is None or cls._archive[0] != archived_before:
+                raw = await cls._fetch(db.orders_archive) if archived_before else b""
+                cls._archive = (archived_before, await cls._run(decode_orders, raw))
+                archive_reloaded = True
+
+            now = time.monotonic()
+            if (
+                cls._hot is None
+                or archive_reloaded
+                or (cls._hot[0] != watermark and now - cls._hot[1] >= settings.ANALYTICS_MIN_REFRESH_SECONDS)
+            ):
+                cls._hot = (watermark, now, await cls._run(decode_orders, await cls._fetch(db.orders)))
+
+            return cls._hot[0], [cls._archive[1], cls._hot[2]]
+
+    @classmethod
+    async def cube(
+        cls,
+        dimensions: Sequence[str],
+        period: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+    ) -> dict:
+        """Receita, pedidos, ticket médio e conversão por combinação das dimensões"""
+        watermark, parts = await cls._snapshot()
+
+        key = (watermark, tuple(dimensions), period, since, until)
+        rows = cls._cubes.get(key)
+        if rows is None:
+            rows = await cls._run(
+                build_cube, parts, list(dimensions), period, _utc_datetime64(since), _utc_datetime64(until)
+            )
+            cls._cubes.set(key, rows)
+
+        return {
+            "dimensions": list(dimensions),
+            "period": period,
+            "since": since,
+            "until": until,
+            "watermark": {"last_order_id": watermark[0], "paid_orders": watermark[1], "archived_before": watermark[2]},
+            "rows": rows
+        }
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
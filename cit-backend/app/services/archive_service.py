@@ -0,0 +1,247 @@
+"""
+Arquivamento de pedidos antigos
+
+Pedidos finalizados (pagos, recusados, cancelados, estornados ou expirados)
+com mais de ARCHIVE_AFTER_MONTHS meses saem de `orders` para
+`orders_archive`, junto com seus pagamentos (`payments` ->
+`payments_archive`). A tarefa do líder move ARCHIVE_BATCH_SIZE pedidos por
+vez: copia para o arquivo (duplicatas de uma rodada interrompida são
+ignoradas) e só então apaga da coleção quente, condicionado ao status
+copiado. Assim `orders` e seus índices ficam com o histórico recente.
+
+O documento `archive_state` guarda `archived_before`: o arquivo só tem
+pedidos criados antes dessa data. Ele é gravado antes de mover qualquer
+documento, então as leituras nunca perdem um pedido em trânsito. As
+listagens só consultam o arquivo quando o período pedido começa antes
+dessa data; os totais dos painéis somam o arquivo, cujas agregações ficam
+em cache até a próxima rodada (escopo "archive" do cache_sync).
+"""
+import calendar
+import heapq
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from pymongo import DeleteOne
+from pymongo.errors import BulkWriteError
+from app.core import cache_sync
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.database.mongo import get_database
+from app.services.job_service import JobService
+
+logger = logging.getLogger(__name__)
+
+ARCHIVABLE_STATUSES = ("paid", "failed", "cancelled", "refunded", "expired")
+
+_STATE_ID = "orders"
+
+
+def _utc(value: datetime) -> datetime:
+    """O MongoDB devolve datas sem fuso (UTC); parâmetros podem vir com ou sem"""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def months_ago(now: datetime, months: int) -> datetime:
+    """Mesma data N meses atrás (limitada ao último dia do mês)"""
+    year, month = divmod(now.year * 12 + now.month - 1 - months, 12)
+    day = min(now.day, calendar.monthrange(year, month + 1)[1])
+    return now.replace(year=year, month=month + 1, day=day)
+
+
+async def _insert_ignoring_duplicates(collection, docs: List[dict]) -> None:
+    if not docs:
+        return
+    try:
+        await collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # Cópia de uma rodada anterior interrompida: o documento já está no arquivo
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+
+class ArchiveService:
+
+    _archived_before: Optional[datetime] = None
+    _state_loaded = False
+    _summaries = TTLCache(maxsize=settings.ARCHIVE_SUMMARY_CACHE_SIZE, ttl=settings.ARCHIVE_SUMMARY_CACHE_TTL_SECONDS)
+
+    @classmethod
+    async def load_state(cls) -> None:
+        db = get_database()
+        state = await db.archive_state.find_one({"_id": _STATE_ID})
+        archived_before = state.get("archived_before") if state else None
+        cls._archived_before = _utc(archived_before) if archived_before is not None else None
+        cls._state_loaded = True
+
+    @classmethod
+    async def _invalidate(cls) -> None:
+        cls._summaries.clear()
+        await cls.load_state()
+
+    @classmethod
+    async def archived_before(cls) -> Optional[datetime]:
+        """Data limite do arquivo, ou None se nada foi arquivado"""
+        if not cls._state_loaded:
+            await cls.load_state()
+        return cls._archived_before
+
+    @classmethod
+    async def needs_archive(cls, since: Optional[datetime] = None) -> bool:
+        """O período que começa em `since` (None = todo o histórico) alcança o arquivo?"""
+        archived_before = await cls.archived_before()
+        if archived_before is None:
+            return False
+        return since is None or _utc(since) < archived_before
+
+    @classmethod
+    async def find_orders(
+        cls,
+        query: dict,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        skip: int = 0,
+        limit: int = 50
+    ) -> List[dict]:
+        """
+        Pedidos do filtro e período, mais recentes primeiro. O arquivo só é
+        consultado se o período o alcança e a coleção quente não bastou.
+        """
+        db = get_database()
+        query = dict(query)
+        created_at: Dict[str, datetime] = {}
+        if since is not None:
+            created_at["$gte"] = since
+        if until is not None:
+            created_at["$lt"] = until
+        if created_at:
+            query["created_at"] = created_at
+
+        wanted = skip + limit
+        hot = await db.orders.find(query).sort("created_at", -1).limit(wanted).to_list(length=wanted)
+
+        archived_before = await cls.archived_before()
+        if not await cls.needs_archive(since):
+            return hot[skip:]
+        # Tudo no arquivo é anterior a archived_before: se a página já está cheia
+        # de pedidos mais novos que isso, o arquivo não entra nela
+        if len(hot) >= wanted and _utc(hot[-1]["created_at"]) >= archived_before:
+            return hot[skip:]
+
+        cold = await db.orders_archive.find(query).sort("created_at", -1).limit(wanted).to_list(length=wanted)
+        merged = heapq.merge(hot, cold, key=lambda order: order["created_at"], reverse=True)
+        return list(merged)[skip:wanted]
+
+    @classmethod
+    async def find_order(cls, order_id) -> Optional[dict]:
+        """Pedido pelo ID, na coleção quente ou no arquivo"""
+        db = get_database()
+        order = await db.orders.find_one({"_id": order_id})
+        if order is None and await cls.needs_archive():
+            order = await db.orders_archive.find_one({"_id": order_id})
+        return order
+
+    @classmethod
+    async def find_payment(cls, order_id: str) -> Optional[dict]:
+        """Pagamento do pedido, na coleção quente ou no arquivo"""
+        db = get_database()
+        payment = await db.payments.find_one({"order_id": order_id})
+        if payment is None and await cls.needs_archive():
+            payment = await db.payments_archive.find_one({"order_id": order_id})
+        return payment
+
+    @classmethod
+    async def archived_count(cls, query: dict) -> int:
+        """count_documents no arquivo, em cache até a próxima rodada de arquivamento"""
+        if not await cls.needs_archive():
+            return 0
+        key = ("count", repr(sorted(query.items())))
+        count = cls._summaries.get(key)
+        if count is None:
+            db = get_database()
+            count = await db.orders_archive.count_documents(query)
+            cls._summaries.set(key, count)
+        return count
+
+    @classmethod
+    async def archived_aggregate(cls, pipeline: List[dict]) -> List[dict]:
+        """aggregate no arquivo, em cache até a próxima rodada de arquivamento"""
+        if not await cls.needs_archive():
+            return []
+        key = ("aggregate", repr(pipeline))
+        rows = cls._summaries.get(key)
+        if rows is None:
+            db = get_database()
+            rows = await db.orders_archive.aggregate(pipeline).to_list(length=None)
+            cls._summaries.set(key, rows)
+        return rows
+
+    @staticmethod
+    def merge_groups(hot: List[dict], cold: List[dict], fields: List[str]) -> List[dict]:
+        """Soma resultados de $group com o mesmo _id (coleção quente + arquivo)"""
+        merged: Dict[Any, dict] = {}
+        for row in list(cold) + list(hot):
+            key = repr(row["_id"])
+            if key not in merged:
+                merged[key] = dict(row)
+                continue
+            for field in fields:
+                merged[key][field] = merged[key].get(field, 0) + row.get(field, 0)
+        return list(merged.values())
+
+    @classmethod
+    async def run(cls) -> None:
+        """Tarefa do líder: move uma leva de pedidos antigos para o arquivo"""
+        db = get_database()
+        cutoff = months_ago(datetime.now(timezone.utc), settings.ARCHIVE_AFTER_MONTHS)
+
+        # Antes de mover: as leituras passam a considerar o arquivo até cutoff
+        await db.archive_state.update_one(
+            {"_id": _STATE_ID},
+            {"$max": {"archived_before": cutoff}},
+            upsert=True
+        )
+        await cache_sync.publish("archive")
+
+        moved = 0
+        for _ in range(settings.ARCHIVE_MAX_BATCHES):
+            count = await cls._move_batch(db, cutoff)
+            moved += count
+            if count < settings.ARCHIVE_BATCH_SIZE:
+                break
+
+        if moved:
+            logger.info("Pedidos arquivados", extra={"orders": moved, "before": cutoff.isoformat()})
+            await cache_sync.publish("archive")
+
+    @staticmethod
+    async def _move_batch(db, cutoff: datetime) -> int:
+        orders = await db.orders.find(
+            {"status": {"$in": list(ARCHIVABLE_STATUSES)}, "created_at": {"$lt": cutoff}}
+        ).sort("created_at", 1).limit(settings.ARCHIVE_BATCH_SIZE).to_list(length=settings.ARCHIVE_BATCH_SIZE)
+        if not orders:
+            return 0
+
+        order_ids = [str(order["_id"]) for order in orders]
+        payments = await db.payments.find({"order_id": {"$in": order_ids}}).to_list(length=None)
+
+        await _insert_ignoring_duplicates(db.payments_archive, payments)
+        await _insert_ignoring_duplicates(db.orders_archive, orders)
+
+        # Condicionado ao status copiado: um pedido alterado nesse meio-tempo fica na coleção quente
+        result = await db.orders.bulk_write(
+            [DeleteOne({"_id": order["_id"], "status": order["status"]}) for order in orders],
+            ordered=False
+        )
+        if result.deleted_count < len(orders):
+            remaining = await db.orders.distinct("_id", {"_id": {"$in": [order["_id"] for order in orders]}})
+            await db.orders_archive.delete_many({"_id": {"$in": remaining}})
+            await db.payments_archive.delete_many({"order_id": {"$in": [str(order_id) for order_id in remaining]}})
+            kept = {str(order_id) for order_id in remaining}
+            payments = [payment for payment in payments if payment["order_id"] not in kept]
+
+        await db.payments.delete_many({"_id": {"$in": [payment["_id"] for payment in payments]}})
+        return result.deleted_count
+
+
+cache_sync.subscribe("archive", ArchiveService._invalidate)
+JobService.register("order-archive", settings.ARCHIVE_INTERVAL_SECONDS, ArchiveService.run)
@@ -1,11 +1,30 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app.database.mongo import get_database
-from app.core.security import verify_password, get_password_hash, create_access_token
+from app.core import cache_sync
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.services.balance_index import BalanceIndex
+from app.core.security import (
+    verify_and_update_password,
+    get_password_hash_async,
+    create_access_token,
+    create_refresh_token,
+    hash_refresh_token
+)
 from app.schemas.user import UserCreate, UserLogin
 from fastapi import HTTPException, status
 
+# Documentos de usuário (sem password_hash) indexados pelo ID
+_user_cache = TTLCache(maxsize=settings.USER_CACHE_MAX_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS)
+
+# Sessões (famílias de refresh token) revogadas neste processo
+_revoked_sessions: set = set()
+
+USER_ROLES = ("client", "admin")
+
 
 class AuthService:
     
@@ -26,9 +45,12 @@ class AuthService:
         user_dict = {
             "name": user_data.name,
             "email": user_data.email,
-            "password_hash": get_password_hash(user_data.password),
+            "password_hash": await get_password_hash_async(user_data.password),
             "role": user_data.role,
             "hours_balance": 0.0,
+            # Saldo nasce no livro de horas: não precisa de entrada de abertura
+            "ledger_opened": True,
+            "token_version": 0,
             "created_at": datetime.now(timezone.utc),
             "updated_at": None
         }
@@ -52,21 +74,216 @@ class AuthService:
             )
         
         # Verifica a senha
-        if not verify_password(login_data.password, user["password_hash"]):
+        valid, new_hash = await verify_and_update_password(login_data.password, user["password_hash"])
+        if not valid:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Email ou senha incorretos"
             )
         
-        # Cria o token
-        access_token = create_access_token(
-            data={"sub": user["email"], "role": user["role"]}
+        # Atualiza o hash de forma transparente se o custo do bcrypt mudou
+        if new_hash:
+            await db.users.update_one(
+                {"_id": user["_id"]},
+                {"$set": {"password_hash": new_hash}}
+            )
+        
+        # Cria a sessão (access token + refresh token)
+        tokens = await AuthService.create_session(user)
+        tokens["user"] = user
+        
+        return tokens
+    
+    @staticmethod
+    async def create_session(user: dict, family_id: Optional[str] = None) -> dict:
+        """Emite um access token e um novo refresh token para a sessão"""
+        db = get_database()
+        
+        family_id = family_id or str(ObjectId())
+        refresh_token, token_hash = create_refresh_token()
+        now = datetime.now(timezone.utc)
+        
+        await db.refresh_tokens.insert_one({
+            "_id": token_hash,
+            "user_id": str(user["_id"]),
+            "family_id": family_id,
+            "token_version": user.get("token_version", 0),
+            "revoked": False,
+            "created_at": now,
+            "expires_at": now + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+        })
+        
+        claims = AuthService.build_token_claims(user)
+        claims["sid"] = family_id
+        
+        return {
+            "access_token": create_access_token(data=claims),
+            "refresh_token": refresh_token,
+            "token_type": "bearer"
+        }
+    
+    @staticmethod
+    async def refresh_session(refresh_token: str) -> dict:
+        """Troca um refresh token válido por um novo par de tokens (rotação)"""
+        db = get_database()
+        token_hash = hash_refresh_token(refresh_token)
+        now = datetime.now(timezone.utc)
+        
+        # Consome o token atomicamente: só uma requisição consegue rotacioná-lo
+        session = await db.refresh_tokens.find_one_and_update(
+            {"_id": token_hash, "revoked": False, "expires_at": {"$gt": now}},
+            {"$set": {"revoked": True, "revoked_at": now, "reason": "rotated"}}
         )
         
+        if session is None:
+            # Reuso de um token já rotacionado indica vazamento: revoga a sessão inteira
+            reused = await db.refresh_tokens.find_one({"_id": token_hash, "reason": "rotated"})
+            if reused:
+                await AuthService.revoke_session(reused["family_id"])
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Refresh token inválido ou expirado"
+            )
+        
+        if session["family_id"] in _revoked_sessions:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Sessão encerrada"
+            )
+        
+        user = await AuthService.get_cached_user(session["user_id"])
+        if user is None or user.get("token_version", 0) != session.get("token_version", 0):
+            await AuthService.revoke_session(session["family_id"])
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Sessão encerrada"
+            )
+        
+        return await AuthService.create_session(user, family_id=session["family_id"])
+    
+    @staticmethod
+    async def revoke_session(family_id: str) -> None:
+        """Revoga todos os refresh tokens de uma sessão"""
+        db = get_database()
+        _revoked_sessions.add(family_id)
+        await db.refresh_tokens.update_many(
+            {"family_id": family_id, "revoked": False},
+            {"$set": {"revoked": True, "revoked_at": datetime.now(timezone.utc), "reason": "revoked"}}
+        )
+        await cache_sync.publish("sessions")
+    
+    @staticmethod
+    async def revoke_user_sessions(user_id: str) -> None:
+        """Revoga todas as sessões abertas do usuário (troca de senha ou de papel)"""
+        db = get_database()
+        family_ids = await db.refresh_tokens.distinct("family_id", {"user_id": user_id, "revoked": False})
+        if not family_ids:
+            return
+        _revoked_sessions.update(family_ids)
+        await db.refresh_tokens.update_many(
+            {"family_id": {"$in": family_ids}, "revoked": False},
+            {"$set": {"revoked": True, "revoked_at": datetime.now(timezone.utc), "reason": "revoked"}}
+        )
+        await cache_sync.publish("sessions")
+    
+    @staticmethod
+    async def _bump_token_version(user_id: ObjectId, fields: dict) -> Optional[dict]:
+        """
+        Aplica a alteração e incrementa token_version na mesma escrita: access
+        tokens e refresh tokens emitidos antes dela deixam de valer
+        """
+        db = get_database()
+        user = await db.users.find_one_and_update(
+            {"_id": user_id},
+            {"$set": {**fields, "updated_at": datetime.now(timezone.utc)}, "$inc": {"token_version": 1}},
+            projection={"password_hash": 0, "ledger_recent": 0, "ledger_unmarked": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if user is None:
+            return None
+        AuthService.invalidate_user(user_id)
+        await AuthService.revoke_user_sessions(str(user_id))
+        return user
+    
+    @staticmethod
+    async def change_password(user_id: str, current_password: str, new_password: str) -> dict:
+        """Troca a senha e abre uma sessão nova; as demais sessões são encerradas"""
+        db = get_database()
+        user = await db.users.find_one({"_id": ObjectId(user_id)}, {"password_hash": 1})
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Usuário não encontrado"
+            )
+        
+        valid, _ = await verify_and_update_password(current_password, user["password_hash"])
+        if not valid:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Senha atual incorreta"
+            )
+        
+        password_hash = await get_password_hash_async(new_password)
+        user = await AuthService._bump_token_version(user["_id"], {"password_hash": password_hash})
+        return await AuthService.create_session(user)
+    
+    @staticmethod
+    async def set_role(user_id: str, role: str) -> dict:
+        """Altera o papel do usuário; tokens emitidos com o papel anterior deixam de valer"""
+        if role not in USER_ROLES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Papel inválido"
+            )
+        if not ObjectId.is_valid(user_id):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="ID do usuário inválido"
+            )
+        
+        user = await AuthService._bump_token_version(ObjectId(user_id), {"role": role})
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Usuário não encontrado"
+            )
+        return user
+    
+    @staticmethod
+    async def logout(refresh_token: str) -> None:
+        """Encerra a sessão associada ao refresh token"""
+        db = get_database()
+        session = await db.refresh_tokens.find_one(
+            {"_id": hash_refresh_token(refresh_token)},
+            {"family_id": 1}
+        )
+        if session:
+            await AuthService.revoke_session(session["family_id"])
+    
+    @staticmethod
+    def is_session_revoked(family_id: Optional[str]) -> bool:
+        """Verifica na memória se a sessão do access token foi revogada"""
+        return family_id is not None and family_id in _revoked_sessions
+    
+    @staticmethod
+    async def load_revoked_sessions() -> None:
+        """Carrega as sessões revogadas enquanto seus access tokens ainda podem estar válidos"""
+        db = get_database()
+        since = datetime.now(timezone.utc) - timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        family_ids = await db.refresh_tokens.distinct(
+            "family_id",
+            {"reason": "revoked", "revoked_at": {"$gte": since}}
+        )
+        _revoked_sessions.update(family_ids)
+    
+    @staticmethod
+    def build_token_claims(user: dict) -> dict:
+        """Monta as claims assinadas usadas para autorização sem consultar o banco"""
         return {
-            "access_token": access_token,
-            "token_type": "bearer",
-            "user": user
+            "sub": user["email"],
+            "uid": str(user["_id"]),
+            "role": user["role"],
+            "ver": user.get("token_version", 0)
         }
     
     @staticmethod
@@ -86,11 +303,45 @@ class AuthService:
         return user
     
     @staticmethod
-    async def update_hours_by_email(email: str, hours: float):
-        """Atualiza o saldo de horas de um usuário pelo email"""
+    async def get_cached_user(user_id: str):
+        """Busca um usuário pelo ID usando o cache em memória (sem password_hash e os campos do livro)"""
+        user = _user_cache.get(user_id)
+        if user is not None:
+            return user
+        
         db = get_database()
-        result = await db.users.update_one(
-            {"email": email},
-            {"$set": {"hours_balance": hours, "updated_at": datetime.now(timezone.utc)}}
-        )
-        return result.modified_count > 0
+        if not ObjectId.is_valid(user_id):
+            return None
+        user = await db.users.find_one({"_id": ObjectId(user_id)}, {"password_hash": 0, "ledger_recent": 0, "ledger_unmarked": 0})
+        if user is not None:
+            _user_cache.set(user_id, user)
+        return user
+    
+    @staticmethod
+    def invalidate_user(user_id) -> None:
+        """Remove o usuário do cache após alterações de saldo, papel ou senha"""
+        _user_cache.invalidate(str(user_id))
+        BalanceIndex.forget_user(user_id)
+        # Os demais workers descartam só este usuário no próximo polling
+        cache_sync.publish_keys_nowait("users", [user_id])
+    
+    @staticmethod
+    def invalidate_users(user_ids) -> None:
+        """
+        Como invalidate_user, para vários usuários de uma vez.
+        Não mexe no BalanceIndex: quem desconta uso ajusta as entradas direto.
+        """
+        user_ids = [str(user_id) for user_id in user_ids]
+        AuthService._forget_users(user_ids)
+        cache_sync.publish_keys_nowait("users", user_ids)
+    
+    @staticmethod
+    def _forget_users(user_ids) -> None:
+        for user_id in user_ids:
+            _user_cache.invalidate(str(user_id))
+
+
+cache_sync.subscribe_keys("users", AuthService._forget_users)
+# Versões sem chaves gravadas (ou um worker muito atrasado): descarta tudo
+cache_sync.subscribe("users", _user_cache.clear)
+cache_sync.subscribe("sessions", AuthService.load_revoked_sessions)
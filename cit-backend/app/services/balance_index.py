@@ -0,0 +1,100 @@
+"""
+Índice em memória do tempo restante por usuário e por código
+
+Atende GET /controller/authorize sem ir ao banco no caso comum. As
+entradas vivem BALANCE_INDEX_TTL_SECONDS: alterações feitas por outros
+workers aparecem no máximo depois desse tempo. No próprio worker, créditos
+(confirmação, resgate, admin) descartam a entrada via
+AuthService.invalidate_user e o consumo medido é descontado na hora.
+"""
+import time
+from typing import Optional, Tuple
+from bson import ObjectId
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.database.mongo import get_database
+
+# Valor guardado para usuário/código inexistente (cache negativo)
+_MISSING = -1.0
+
+
+class BalanceIndex:
+
+    _entries = TTLCache(maxsize=settings.BALANCE_INDEX_MAX_SIZE, ttl=settings.BALANCE_INDEX_TTL_SECONDS)
+
+    @classmethod
+    def forget_user(cls, user_id: str) -> None:
+        cls._entries.invalidate(("user", str(user_id)))
+
+    @classmethod
+    def forget_code(cls, code: str) -> None:
+        cls._entries.invalidate(("code", code))
+
+    @classmethod
+    def consume(cls, kind: str, key: str, seconds: float) -> None:
+        """Desconta o uso medido de uma entrada já em memória (sem estender o TTL)"""
+        remaining = cls._entries.get((kind, key))
+        if remaining is not None and remaining != _MISSING:
+            cls._entries.replace((kind, key), max(0.0, remaining - seconds))
+
+    @classmethod
+    async def remaining_for_user(cls, user_id: str) -> Tuple[Optional[float], str]:
+        """(segundos restantes ou None se não existir, origem: memory | database)"""
+        key = ("user", user_id)
+        remaining = cls._entries.get(key)
+        if remaining is not None:
+            return (None if remaining == _MISSING else remaining), "memory"
+
+        user = None
+        if ObjectId.is_valid(user_id):
+            db = get_database()
+            user = await db.users.find_one({"_id": ObjectId(user_id)}, {"hours_balance": 1})
+
+        if user is None:
+            cls._entries.set(key, _MISSING, ttl=settings.BALANCE_INDEX_NEGATIVE_TTL_SECONDS)
+            return None, "database"
+
+        remaining = max(0.0, (user.get("hours_balance") or 0.0) * 3600)
+        cls._entries.set(key, remaining)
+        return remaining, "database"
+
+    @classmethod
+    async def remaining_for_code(cls, code: str) -> Tuple[Optional[float], str]:
+        """Tempo de um código emitido e ainda não resgatado para o saldo de alguém"""
+        key = ("code", code)
+        remaining = cls._entries.get(key)
+        if remaining is not None:
+            return (None if remaining == _MISSING else remaining), "memory"
+
+        db = get_database()
+        doc = await db.access_codes.find_one({"code": code}, {"status": 1, "hours": 1, "used_seconds": 1})
+
+        if doc is None or doc["status"] == "available":
+            cls._entries.set(key, _MISSING, ttl=settings.BALANCE_INDEX_NEGATIVE_TTL_SECONDS)
+            return None, "database"
+
+        if doc["status"] == "redeemed":
+            # As horas foram para o saldo de um usuário: vale o user_id
+            remaining = 0.0
+        else:
+            remaining = max(0.0, (doc.get("hours") or 0.0) * 3600 - (doc.get("used_seconds") or 0.0))
+        cls._entries.set(key, remaining)
+        return remaining, "database"
+
+    @staticmethod
+    def decision(remaining: Optional[float], source: str) -> dict:
+        """Resposta para o controlador: tempo restante e quando perguntar de novo"""
+        if remaining is None:
+            return {"allowed": False, "remaining_seconds": 0, "recheck_after": settings.AUTHORIZE_RECHECK_SECONDS,
+                    "expires_at": None, "reason": "not_found", "source": source}
+
+        seconds = int(remaining)
+        return {
+            "allowed": seconds > 0,
+            "remaining_seconds": seconds,
+            # O controlador pode liberar até recheck_after sem consultar de novo
+            "recheck_after": min(seconds, settings.AUTHORIZE_RECHECK_SECONDS) if seconds > 0 else settings.AUTHORIZE_RECHECK_SECONDS,
+            "expires_at": int(time.time()) + seconds if seconds > 0 else None,
+            "reason": None if seconds > 0 else "no_balance",
+            "source": source
+        }
@@ -0,0 +1,163 @@
+"""
+Resolução de empresas (lojas) com cache em memória
+"""
+import re
+import time
+from typing import Dict, Optional
+from bson import ObjectId
+from app.core import cache_sync
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.database.mongo import get_database
+
+
+def generate_slug(name: str) -> str:
+    """Gera um slug a partir do nome da empresa"""
+    # Remove acentos e caracteres especiais
+    slug = name.lower().strip()
+    slug = re.sub(r'[àáâãäå]', 'a', slug)
+    slug = re.sub(r'[èéêë]', 'e', slug)
+    slug = re.sub(r'[ìíîï]', 'i', slug)
+    slug = re.sub(r'[òóôõö]', 'o', slug)
+    slug = re.sub(r'[ùúûü]', 'u', slug)
+    slug = re.sub(r'[ç]', 'c', slug)
+    slug = re.sub(r'[^a-z0-9\s-]', '', slug)
+    slug = re.sub(r'[\s_]+', '-', slug)
+    slug = re.sub(r'-+', '-', slug)
+    slug = slug.strip('-')
+    return slug
+
+
+class CompanyService:
+    """
+    Mantém em memória as empresas (por slug e por ID) e os documentos da
+    coleção antiga `config`. Os documentos retornados são compartilhados
+    e não devem ser alterados pelos chamadores.
+    """
+
+    _by_slug: Dict[str, dict] = {}
+    _by_id: Dict[str, dict] = {}
+    _default: Optional[dict] = None
+    _configs: Dict[str, Optional[dict]] = {}
+    _loaded_at: Optional[float] = None
+
+    # Slugs desconhecidos, para não consultar o banco a cada requisição
+    _missing_slugs = TTLCache(maxsize=10_000, ttl=settings.COMPANY_NEGATIVE_CACHE_SECONDS)
+
+    @classmethod
+    async def load(cls) -> None:
+        """Carrega todas as empresas e as configurações antigas"""
+        db = get_database()
+
+        companies = await db.companies.find({}).to_list(length=None)
+        configs = await db.config.find({"type": {"$in": ["company", "financial"]}}).to_list(length=None)
+
+        by_slug = {}
+        by_id = {}
+        for company in companies:
+            by_id[str(company["_id"])] = company
+            slug = company.get("slug") or generate_slug(company.get("name", ""))
+            if slug:
+                by_slug.setdefault(slug, company)
+
+        # A empresa principal também responde pelo slug gerado a partir do nome
+        if companies:
+            expected_slug = generate_slug(companies[0].get("name", ""))
+            if expected_slug:
+                by_slug.setdefault(expected_slug, companies[0])
+
+        legacy = {"company": None, "financial": None}
+        for config in configs:
+            if legacy.get(config["type"]) is None:
+                legacy[config["type"]] = config
+
+        # Troca atômica: leitores nunca veem um estado parcial
+        cls._by_slug = by_slug
+        cls._by_id = by_id
+        cls._default = companies[0] if companies else None
+        cls._configs = legacy
+        cls._missing_slugs.clear()
+        cls._loaded_at = time.monotonic()
+
+    @classmethod
+    async def _ensure_loaded(cls) -> None:
+        if cls._loaded_at is None or time.monotonic() - cls._loaded_at > settings.COMPANY_CACHE_TTL_SECONDS:
+            await cls.load()
+
+    @classmethod
+    def _drop(cls) -> None:
+        cls._loaded_at = None
+        cls._missing_slugs.clear()
+
+    @classmethod
+    async def invalidate(cls) -> None:
+        """Descarta o cache em todos os workers (chamado após alterações em /admin/config e afins)"""
+        await cache_sync.publish("company")
+
+    @classmethod
+    async def get_by_slug(cls, slug: str) -> Optional[dict]:
+        """Busca a empresa pelo slug; None se não existir"""
+        await cls._ensure_loaded()
+
+        company = cls._by_slug.get(slug)
+        if company is not None:
+            return company
+
+        if slug in cls._missing_slugs:
+            return None
+
+        # Empresa criada por outro processo desde a última carga
+        db = get_database()
+        company = await db.companies.find_one({"slug": slug})
+        if company is None:
+            cls._missing_slugs.set(slug, True)
+            return None
+
+        cls._by_slug[slug] = company
+        cls._by_id[str(company["_id"])] = company
+        return company
+
+    @classmethod
+    async def get_by_id(cls, company_id: str) -> Optional[dict]:
+        """Busca a empresa pelo ID"""
+        await cls._ensure_loaded()
+
+        company = cls._by_id.get(company_id)
+        if company is not None or not ObjectId.is_valid(company_id):
+            return company
+
+        db = get_database()
+        company = await db.companies.find_one({"_id": ObjectId(company_id)})
+        if company is not None:
+            cls._by_id[company_id] = company
+        return company
+
+    @classmethod
+    async def get_default(cls) -> Optional[dict]:
+        """Retorna a empresa principal (única por admin no momento)"""
+        await cls._ensure_loaded()
+        return cls._default
+
+    @classmethod
+    async def get_legacy_config(cls, config_type: str) -> Optional[dict]:
+        """Retorna o documento da coleção antiga `config` (company | financial)"""
+        await cls._ensure_loaded()
+        return cls._configs.get(config_type)
+
+    @classmethod
+    async def get_order_company(cls, company_slug: Optional[str]) -> Optional[dict]:
+        """Dados da empresa gravados junto com cada pedido"""
+        company_config = await cls.get_legacy_config("company")
+        if not company_config:
+            return None
+        return {
+            "name": company_config.get("name", ""),
+            "slug": company_config.get("slug", company_slug),
+            "cnpj": company_config.get("cnpj", ""),
+            "email": company_config.get("email", ""),
+            "phone": company_config.get("phone", ""),
+            "address": company_config.get("address", "")
+        }
+
+
+cache_sync.subscribe("company", CompanyService._drop)
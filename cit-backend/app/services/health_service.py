@@ -0,0 +1,105 @@
+"""
+Liveness, readiness e aquecimento (warm-up) do worker
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+from app.core import cache_sync
+from app.core.config import settings
+from app.database.mongo import ensure_indexes, ping_database, warm_connection_pool
+from app.services.access_code_service import AccessCodeFilter
+from app.services.auth_service import AuthService
+from app.services.company_service import CompanyService
+from app.services.job_service import JobService
+from app.services.mercadopago_service import MercadoPagoService
+from app.services.voucher_service import VoucherService
+
+logger = logging.getLogger(__name__)
+
+
+class HealthService:
+    """Estado de prontidão do worker"""
+
+    indexes_ready: bool = False
+    warm: bool = False
+    warmup_error: Optional[str] = None
+
+    _warmup_task: Optional[asyncio.Task] = None
+    _cached_report: Optional[dict] = None
+    _cached_at: float = 0.0
+
+    @classmethod
+    def start_warm_up(cls) -> None:
+        """Dispara o warm-up em segundo plano (a aplicação já aceita conexões)"""
+        if cls._warmup_task is None or cls._warmup_task.done():
+            cls._warmup_task = asyncio.create_task(cls.warm_up())
+
+    @classmethod
+    async def warm_up(cls) -> None:
+        """Prepara índices, caches e pools; repete até conseguir"""
+        delay = 1.0
+        while True:
+            try:
+                await ensure_indexes()
+                cls.indexes_ready = True
+
+                # Versões compartilhadas antes de aquecer os caches que elas invalidam
+                await cache_sync.start()
+                await VoucherService.initialize_default_vouchers()
+                await AuthService.load_revoked_sessions()
+                await CompanyService.load()
+                await VoucherService.load_catalog()
+                await AccessCodeFilter.rebuild()
+                await warm_connection_pool(settings.MONGODB_MIN_POOL_SIZE)
+                MercadoPagoService.get_http_client()
+
+                cls.warm = True
+                cls.warmup_error = None
+                AccessCodeFilter.start()
+                JobService.start()
+                logger.info("Warm-up concluído")
+                return
+            except Exception as e:
+                cls.warmup_error = type(e).__name__
+                logger.warning(f"Warm-up falhou, nova tentativa em {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    @classmethod
+    async def cancel_warm_up(cls) -> None:
+        if cls._warmup_task is not None and not cls._warmup_task.done():
+            cls._warmup_task.cancel()
+
+    @classmethod
+    async def readiness(cls) -> dict:
+        """Relatório de prontidão, cacheado por READINESS_CACHE_SECONDS"""
+        now = time.monotonic()
+        if cls._cached_report is not None and now - cls._cached_at < settings.READINESS_CACHE_SECONDS:
+            return cls._cached_report
+
+        mongo_ok = await ping_database(settings.READINESS_MONGO_TIMEOUT_SECONDS)
+
+        if not MercadoPagoService.has_access_token():
+            mercadopago = "not_configured"
+        elif MercadoPagoService._http_client is None or MercadoPagoService._http_client.is_closed:
+            mercadopago = "not_initialized"
+        else:
+            mercadopago = "ok"
+
+        checks = {
+            "mongo": "ok" if mongo_ok else "unreachable",
+            "indexes": "ok" if cls.indexes_ready else "building",
+            "mercadopago": mercadopago,
+            "cache": "warm" if cls.warm else "cold"
+        }
+        # Mercado Pago não bloqueia a prontidão: pagamentos têm modo fallback
+        ready = mongo_ok and cls.indexes_ready and cls.warm
+
+        report = {"status": "ready" if ready else "not_ready", "checks": checks}
+        if cls.warmup_error and not cls.warm:
+            report["error"] = cls.warmup_error
+
+        cls._cached_report = report
+        cls._cached_at = now
+        return report
@@ -0,0 +1,177 @@
+"""
+Tarefas em segundo plano executadas por um único worker (líder)
+
+Com vários workers (e várias réplicas), rotinas como expiração de pedidos
+ou compactação não podem rodar em todos. Os workers disputam um lease na
+coleção `leases`; quem o detém renova o lease a cada heartbeat e executa
+as tarefas registradas. Se o líder cair, o lease expira e outro assume.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.core.config import settings
+from app.core.request_context import set_task_label
+from app.database.mongo import get_database
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "background-jobs"
+
+
+class Job:
+    """Tarefa periódica registrada"""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable[None]]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.last_run: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class LeaderLease:
+    """Lease com expiração armazenado em um documento do MongoDB"""
+
+    def __init__(self, name: str, ttl_seconds: float):
+        self.name = name
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+
+    async def acquire(self) -> bool:
+        """Adquire ou renova o lease; False se outro worker o detém"""
+        db = get_database()
+        now = datetime.now(timezone.utc)
+        try:
+            doc = await db.leases.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + self.ttl, "heartbeat_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # O documento existe, pertence a outro worker e ainda não expirou
+            return False
+        return doc is not None and doc["owner"] == self.owner
+
+    async def release(self) -> None:
+        db = get_database()
+        await db.leases.delete_one({"_id": self.name, "owner": self.owner})
+
+
+class JobService:
+    """Registro das tarefas periódicas e laço de eleição do líder"""
+
+    _jobs: Dict[str, Job] = {}
+    _lease: Optional[LeaderLease] = None
+    _loop_task: Optional[asyncio.Task] = None
+    is_leader: bool = False
+
+    @classmethod
+    def register(cls, name: str, interval_seconds: float, func: Callable[[], Awaitable[None]]) -> None:
+        """
+        Registra uma tarefa executada a cada `interval_seconds` apenas no líder
+        (a granularidade é o LEADER_HEARTBEAT_SECONDS)
+        """
+        cls._jobs[name] = Job(name=name, interval=interval_seconds, func=func)
+
+    @classmethod
+    def start(cls) -> None:
+        if not settings.BACKGROUND_JOBS_ENABLED:
+            return
+        if cls._lease is None:
+            cls._lease = LeaderLease(LEASE_NAME, settings.LEADER_LEASE_SECONDS)
+        if cls._loop_task is None or cls._loop_task.done():
+            cls._loop_task = asyncio.create_task(cls._run())
+
+    @classmethod
+    async def stop(cls) -> None:
+        """Cancela as tarefas e libera o lease para outro worker assumir logo"""
+        if cls._loop_task is not None:
+            cls._loop_task.cancel()
+            cls._loop_task = None
+        cls._cancel_jobs()
+        if cls.is_leader and cls._lease is not None:
+            try:
+                await cls._lease.release()
+            except Exception as e:
+                logger.warning(f"Erro ao liberar o lease: {e}")
+        cls.is_leader = False
+
+    @classmethod
+    def status(cls) -> dict:
+        return {
+            "leader": cls.is_leader,
+            "owner": cls._lease.owner if cls._lease else None,
+            "jobs": {
+                job.name: {
+                    "interval_seconds": job.interval,
+                    "running": job.task is not None and not job.task.done()
+                }
+                for job in cls._jobs.values()
+            }
+        }
+
+    @staticmethod
+    async def current_lease() -> Optional[dict]:
+        """Documento do lease no MongoDB (quem é o líder da frota)"""
+        db = get_database()
+        return await db.leases.find_one({"_id": LEASE_NAME}, {"_id": 0})
+
+    @classmethod
+    def _cancel_jobs(cls) -> None:
+        for job in cls._jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+            job.task = None
+
+    @classmethod
+    async def _run(cls) -> None:
+        while True:
+            try:
+                leader = await cls._lease.acquire()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Sem conseguir renovar, o lease pode expirar e outro worker assumir
+                logger.warning(f"Falha ao renovar o lease: {e}")
+                leader = False
+
+            if leader != cls.is_leader:
+                logger.info("Lease adquirido: executando tarefas em segundo plano" if leader else "Lease perdido")
+                if not leader:
+                    cls._cancel_jobs()
+            cls.is_leader = leader
+
+            if leader:
+                cls._dispatch()
+
+            await asyncio.sleep(settings.LEADER_HEARTBEAT_SECONDS)
+
+    @classmethod
+    def _dispatch(cls) -> None:
+        """Dispara as tarefas vencidas; uma tarefa nunca roda em paralelo com ela mesma"""
+        now = time.monotonic()
+        for job in cls._jobs.values():
+            if job.task is not None and not job.task.done():
+                continue
+            if job.last_run is not None and now - job.last_run < job.interval:
+                continue
+            job.last_run = now
+            job.task = asyncio.create_task(cls._run_job(job))
+
+    @staticmethod
+    async def _run_job(job: Job) -> None:
+        set_task_label(f"job:{job.name}")
+        try:
+            await job.func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Erro na tarefa '{job.name}': {e}")
@@ -0,0 +1,392 @@
+"""
+Livro-razão de horas (append-only)
+
+Toda movimentação de saldo vira uma entrada em `hours_ledger` com valor
+assinado, tipo e chave de idempotência (índice único). O saldo de leitura
+continua em `users.hours_balance` (O(1)), atualizado junto com cada entrada
+por um $inc que só é aplicado se a chave ainda não estiver entre as
+últimas aplicadas no próprio documento (`ledger_recent`): repetir a mesma
+movimentação (webhook duplicado, retry) não credita duas vezes.
+
+Sequência de uma movimentação (sem transações, MongoDB standalone):
+1. insere a entrada com applied=False (chave repetida -> reaproveita);
+2. aplica o $inc idempotente no usuário, que no mesmo update guarda o _id
+   da entrada em `ledger_unmarked`;
+3. marca a entrada como applied e a retira de `ledger_unmarked`.
+
+O compactador (tarefa do líder) reaplica entradas que ficaram presas entre
+1 e 3 e dobra as entradas antigas em `hours_snapshots`: saldo auditável =
+snapshot + soma da cauda ainda não dobrada. A reaplicação é exata: uma
+entrada presa já aplicada continua em `ledger_unmarked` até ser marcada,
+por mais movimentações que tenham empurrado a chave para fora de
+`ledger_recent` nesse meio-tempo.
+
+Saldos anteriores ao livro recebem, uma vez, uma entrada "adjustment" de
+abertura (chave `opening:{user_id}`) que explica o saldo sem movê-lo; o
+usuário fica com `ledger_opened`. Sem ela o extrato acusaria o saldo
+legado como divergência.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app.core.config import settings
+from app.database.mongo import get_database
+from app.services.auth_service import AuthService
+from app.services.job_service import JobService
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("purchase", "redeem", "usage", "adjustment")
+
+
+def _entry(user_id: str, amount: float, kind: str, key: str, ref: Optional[dict], now: datetime) -> dict:
+    return {
+        "user_id": str(user_id),
+        "amount": amount,
+        "kind": kind,
+        "idempotency_key": key,
+        "ref": ref or {},
+        "at": now,
+        "applied": False
+    }
+
+
+def _apply_update(entry: dict, now: datetime) -> dict:
+    return {
+        "$inc": {"hours_balance": entry["amount"]},
+        "$set": {"updated_at": now},
+        "$push": {"ledger_recent": {"$each": [entry["idempotency_key"]], "$slice": -settings.LEDGER_RECENT_KEYS}},
+        "$addToSet": {"ledger_unmarked": entry["_id"]}
+    }
+
+
+def _apply_filter(entry: dict, extra: Optional[dict] = None) -> dict:
+    query = {
+        "_id": ObjectId(entry["user_id"]),
+        "ledger_unmarked": {"$ne": entry["_id"]},
+        "ledger_recent": {"$ne": entry["idempotency_key"]}
+    }
+    if extra:
+        query.update(extra)
+    return query
+
+
+class LedgerService:
+
+    # Todos os usuários já têm a entrada de abertura (vale até o worker reiniciar)
+    _balances_opened = False
+
+    @staticmethod
+    async def _mark_applied(db, entries: List[dict]) -> None:
+        """Passo 3: marca as entradas e só então as tira de ledger_unmarked dos usuários"""
+        ids = [entry["_id"] for entry in entries]
+        await db.hours_ledger.update_many({"_id": {"$in": ids}}, {"$set": {"applied": True}})
+        await db.users.update_many(
+            {"_id": {"$in": [ObjectId(user_id) for user_id in {entry["user_id"] for entry in entries}]}},
+            {"$pull": {"ledger_unmarked": {"$in": ids}}}
+        )
+
+    @staticmethod
+    async def record(user_id: str, amount: float, kind: str, key: str, ref: Optional[dict] = None) -> Optional[float]:
+        """
+        Registra e aplica uma movimentação. Retorna o novo saldo, ou None se
+        a chave já tinha sido aplicada (nada muda).
+        """
+        db = get_database()
+        now = datetime.now(timezone.utc)
+        entry = _entry(user_id, amount, kind, key, ref, now)
+
+        try:
+            await db.hours_ledger.insert_one(entry)
+        except DuplicateKeyError:
+            entry = await db.hours_ledger.find_one({"idempotency_key": key})
+            if entry is None or entry["applied"]:
+                return None
+
+        user = await db.users.find_one_and_update(
+            _apply_filter(entry),
+            _apply_update(entry, now),
+            projection={"hours_balance": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        await LedgerService._mark_applied(db, [entry])
+        AuthService.invalidate_user(entry["user_id"])
+        return user["hours_balance"] if user else None
+
+    @staticmethod
+    async def record_many(movements: List[dict]) -> List[str]:
+        """
+        Várias movimentações de uma vez (consumo coalescido por usuário):
+        um insert_many no livro e um bulk_write nos usuários. Cada item:
+        {user_id, amount, kind, key, ref}. Retorna os usuários alterados.
+        """
+        db = get_database()
+        now = datetime.now(timezone.utc)
+        entries = [_entry(m["user_id"], m["amount"], m["kind"], m["key"], m.get("ref"), now) for m in movements]
+        if not entries:
+            return []
+
+        try:
+            await db.hours_ledger.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            # Chaves já registradas: aplica só as que ainda não foram aplicadas
+            duplicated = {error["op"]["idempotency_key"] for error in errors}
+            existing = await db.hours_ledger.find(
+                {"idempotency_key": {"$in": list(duplicated)}, "applied": False}
+            ).to_list(length=None)
+            entries = [entry for entry in entries if entry["idempotency_key"] not in duplicated] + existing
+
+        if not entries:
+            return []
+
+        await db.users.bulk_write(
+            [UpdateOne(_apply_filter(entry), _apply_update(entry, now)) for entry in entries],
+            ordered=False
+        )
+        await LedgerService._mark_applied(db, entries)
+        return list({entry["user_id"] for entry in entries})
+
+    @staticmethod
+    async def set_balance(user_id: str, hours: float, expected: Optional[float] = None, ref: Optional[dict] = None) -> float:
+        """
+        Ajuste administrativo para um saldo absoluto, como compare-and-set:
+        a diferença só é aplicada se o saldo não mudou desde a leitura. Com
+        `expected`, o chamador informa o saldo que viu; se outro crédito entrou
+        nesse meio-tempo, responde 409 em vez de sobrescrevê-lo.
+        """
+        db = get_database()
+
+        for _ in range(settings.LEDGER_CAS_ATTEMPTS):
+            user = await db.users.find_one({"_id": ObjectId(user_id)}, {"hours_balance": 1})
+            if user is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuário não encontrado")
+
+            current = user.get("hours_balance", 0.0)
+            if expected is not None and abs(current - expected) > 1e-9:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=f"Saldo alterado desde a leitura (atual: {current})"
+                )
+
+            now = datetime.now(timezone.utc)
+            entry = _entry(user_id, hours - current, "adjustment", f"adjustment:{ObjectId()}", ref, now)
+            await db.hours_ledger.insert_one(entry)
+
+            result = await db.users.update_one(
+                _apply_filter(entry, {"hours_balance": current}),
+                _apply_update(entry, now)
+            )
+            if result.modified_count:
+                await LedgerService._mark_applied(db, [entry])
+                AuthService.invalidate_user(user_id)
+                return hours
+
+            # Outro movimento entrou entre a leitura e a escrita: descarta a entrada e relê
+            await db.hours_ledger.delete_one({"_id": entry["_id"], "applied": False})
+            if expected is not None:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Saldo alterado durante o ajuste"
+                )
+
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Saldo em alteração constante; tente novamente"
+        )
+
+    @staticmethod
+    async def statement(user_id: str, limit: int = 100) -> dict:
+        """Snapshot, cauda e comparação com o saldo materializado (auditoria)"""
+        db = get_database()
+        snapshot = await db.hours_snapshots.find_one({"_id": user_id}) or {"balance": 0.0, "through": None}
+        tail = await db.hours_ledger.aggregate([
+            {"$match": {"user_id": user_id, "applied": True, "folded": {"$ne": True}}},
+            {"$group": {"_id": None, "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+        ]).to_list(length=1)
+        entries = await db.hours_ledger.find({"user_id": user_id}).sort("_id", -1).limit(limit).to_list(length=limit)
+        for entry in entries:
+            entry["id"] = str(entry.pop("_id"))
+        user = await db.users.find_one({"_id": ObjectId(user_id)}, {"hours_balance": 1}) if ObjectId.is_valid(user_id) else None
+
+        tail_total = tail[0]["total"] if tail else 0.0
+        computed = snapshot["balance"] + tail_total
+        materialized = user.get("hours_balance", 0.0) if user else None
+        return {
+            "user_id": user_id,
+            "snapshot_balance": snapshot["balance"],
+            "snapshot_through": snapshot.get("through"),
+            "tail_entries": tail[0]["count"] if tail else 0,
+            "tail_total": tail_total,
+            "ledger_balance": computed,
+            "hours_balance": materialized,
+            "drift": None if materialized is None else round(materialized - computed, 9),
+            "entries": entries
+        }
+
+    @classmethod
+    async def open_balances(cls) -> int:
+        """
+        Backfill das entradas de abertura: uma leva de usuários sem
+        `ledger_opened`. Retorna quantos foram abertos.
+        """
+        db = get_database()
+        users = await db.users.find(
+            {"ledger_opened": {"$exists": False}},
+            {"hours_balance": 1, "ledger_recent": 1, "ledger_unmarked": 1}
+        ).limit(settings.LEDGER_COMPACT_BATCH_SIZE).to_list(length=settings.LEDGER_COMPACT_BATCH_SIZE)
+        if not users:
+            cls._balances_opened = True
+            return 0
+
+        opened = 0
+        for user in users:
+            if await LedgerService._open_balance(db, user):
+                opened += 1
+        if opened:
+            logger.info("Saldos abertos no livro", extra={"count": opened})
+        return opened
+
+    @staticmethod
+    async def _open_balance(db, user: dict) -> bool:
+        """
+        Abertura = saldo atual menos as entradas já refletidas nele (aplicadas
+        ou ainda em ledger_unmarked/ledger_recent). Gravada por compare-and-set: se o
+        saldo mudou desde a leitura, a entrada é descartada e o usuário volta
+        na próxima rodada.
+        """
+        user_id = str(user["_id"])
+        recent = user.get("ledger_recent", [])
+        reflected = await db.hours_ledger.aggregate([
+            {"$match": {"user_id": user_id, "$or": [
+                {"applied": True},
+                {"_id": {"$in": user.get("ledger_unmarked", [])}},
+                {"idempotency_key": {"$in": recent}}
+            ]}},
+            {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+        ]).to_list(length=1)
+        amount = user.get("hours_balance", 0.0) - (reflected[0]["total"] if reflected else 0.0)
+
+        now = datetime.now(timezone.utc)
+        entry = _entry(user_id, amount, "adjustment", f"opening:{user_id}", {"opening": True}, now)
+        try:
+            await db.hours_ledger.insert_one(entry)
+        except DuplicateKeyError:
+            # Abertura interrompida que não chegou ao usuário: o compactador a descarta
+            return False
+
+        # Mesmo saldo e mesmas chaves recentes da leitura: nenhuma movimentação entrou no meio
+        unchanged = {
+            field: user[field] if field in user else {"$exists": False}
+            for field in ("hours_balance", "ledger_recent")
+        }
+        result = await db.users.update_one(
+            {"_id": user["_id"], "ledger_opened": {"$exists": False}, **unchanged},
+            {
+                "$set": {"ledger_opened": True},
+                "$push": {"ledger_recent": {"$each": [entry["idempotency_key"]], "$slice": -settings.LEDGER_RECENT_KEYS}},
+                "$addToSet": {"ledger_unmarked": entry["_id"]}
+            }
+        )
+        if not result.modified_count:
+            await db.hours_ledger.delete_one({"_id": entry["_id"], "applied": False})
+            return False
+
+        await LedgerService._mark_applied(db, [entry])
+        return True
+
+    @staticmethod
+    async def compact() -> None:
+        """Tarefa do líder: reaplica entradas presas e dobra as antigas em snapshots"""
+        db = get_database()
+        now = datetime.now(timezone.utc)
+
+        # 0. Abertura dos saldos anteriores ao livro (até não restar nenhum usuário)
+        if not LedgerService._balances_opened:
+            await LedgerService.open_balances()
+
+        # 1. Entradas gravadas mas não marcadas (queda entre os passos)
+        stuck = await db.hours_ledger.find({
+            "applied": False,
+            "at": {"$lt": now - timedelta(seconds=settings.LEDGER_APPLY_GRACE_SECONDS)}
+        }).limit(settings.LEDGER_COMPACT_BATCH_SIZE).to_list(length=settings.LEDGER_COMPACT_BATCH_SIZE)
+        for entry in stuck:
+            # O $inc grava o _id em ledger_unmarked no mesmo update: presença exata de
+            # "já aplicada" (ledger_recent cobre entradas gravadas antes desse campo)
+            landed = await db.users.count_documents(
+                {
+                    "_id": ObjectId(entry["user_id"]),
+                    "$or": [{"ledger_unmarked": entry["_id"]}, {"ledger_recent": entry["idempotency_key"]}]
+                },
+                limit=1
+            )
+            if not landed:
+                if entry["kind"] == "adjustment":
+                    # Ajuste é compare-and-set: só vale se chegou ao usuário; senão, descarta
+                    await db.hours_ledger.delete_one({"_id": entry["_id"], "applied": False})
+                    continue
+                await db.users.update_one(_apply_filter(entry), _apply_update(entry, now))
+            await LedgerService._mark_applied(db, [entry])
+            AuthService.invalidate_user(entry["user_id"])
+        if stuck:
+            logger.warning("Entradas do livro reaplicadas", extra={"count": len(stuck)})
+
+        # 2. Dobras interrompidas antes de marcar as entradas como dobradas
+        for fold_id in await db.hours_ledger.distinct("fold_id", {"fold_id": {"$exists": True}, "folded": {"$ne": True}}):
+            await LedgerService._fold(db, fold_id)
+
+        # 3. Nova dobra: entradas aplicadas mais antigas que LEDGER_FOLD_AFTER_HOURS
+        cutoff = ObjectId.from_datetime(now - timedelta(hours=settings.LEDGER_FOLD_AFTER_HOURS))
+        candidates = await db.hours_ledger.find(
+            {"_id": {"$lte": cutoff}, "applied": True, "fold_id": {"$exists": False}}, {"_id": 1}
+        ).sort("_id", 1).limit(settings.LEDGER_COMPACT_BATCH_SIZE).to_list(length=settings.LEDGER_COMPACT_BATCH_SIZE)
+        if not candidates:
+            return
+
+        fold_id = ObjectId()
+        await db.hours_ledger.update_many(
+            {"_id": {"$in": [doc["_id"] for doc in candidates]}, "fold_id": {"$exists": False}},
+            {"$set": {"fold_id": fold_id}}
+        )
+        await LedgerService._fold(db, fold_id)
+
+    @staticmethod
+    async def _fold(db, fold_id: ObjectId) -> None:
+        """Soma as entradas marcadas com fold_id nos snapshots (idempotente por fold_id)"""
+        totals: List[Dict] = await db.hours_ledger.aggregate([
+            {"$match": {"fold_id": fold_id}},
+            {"$group": {"_id": "$user_id", "total": {"$sum": "$amount"}, "through": {"$max": "$_id"}, "count": {"$sum": 1}}}
+        ]).to_list(length=None)
+
+        now = datetime.now(timezone.utc)
+        operations = [
+            UpdateOne(
+                # Snapshot que já contém esta dobra não casa; o upsert colide com o _id e é ignorado
+                {"_id": row["_id"], "folds": {"$ne": fold_id}},
+                {
+                    "$inc": {"balance": row["total"], "entries": row["count"]},
+                    "$max": {"through": row["through"]},
+                    "$set": {"updated_at": now},
+                    "$push": {"folds": {"$each": [fold_id], "$slice": -settings.LEDGER_RECENT_KEYS}}
+                },
+                upsert=True
+            )
+            for row in totals
+        ]
+        if operations:
+            try:
+                await db.hours_snapshots.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+
+        await db.hours_ledger.update_many({"fold_id": fold_id}, {"$set": {"folded": True}})
+
+
+JobService.register("hours-ledger-compactor", settings.LEDGER_COMPACT_INTERVAL_SECONDS, LedgerService.compact)
@@ -2,10 +2,55 @@
 Serviço de integração com Mercado Pago
 Documentação: https://www.mercadopago.com.br/developers/pt/reference/
 """
+import logging
 import os
+import re
+import time
 import httpx
-from typing import Dict, Any, Optional
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Any, Optional
 from fastapi import HTTPException, status
+from app.core import tracing
+from app.core.config import settings
+from app.core.metrics import mercadopago_request_duration
+
+logger = logging.getLogger(__name__)
+
+# IDs na URL viram "{id}" para manter a cardinalidade das métricas baixa
+_ID_SEGMENT = re.compile(r"/(?:\d+|[0-9A-Za-z-]{20,})(?=/|$)")
+
+
+def _endpoint(request: httpx.Request) -> str:
+    return _ID_SEGMENT.sub("/{id}", request.url.path)
+
+
+async def _on_request(request: httpx.Request) -> None:
+    request.extensions["started_at"] = time.perf_counter()
+    span = tracing.start_span(f"mercadopago.{request.method} {_endpoint(request)}", kind=3)
+    if span is not None:
+        request.extensions["span"] = span
+
+
+async def _on_response(response: httpx.Response) -> None:
+    request = response.request
+    elapsed = time.perf_counter() - request.extensions.get("started_at", time.perf_counter())
+    mercadopago_request_duration.observe(
+        elapsed, request.method, _endpoint(request), f"{response.status_code // 100}xx"
+    )
+    span = request.extensions.get("span")
+    if span is not None:
+        span.attributes["http.status_code"] = response.status_code
+        span.error = response.status_code >= 500
+        span.end()
+
+
+def _record_error(request: httpx.Request) -> None:
+    elapsed = time.perf_counter() - request.extensions.get("started_at", time.perf_counter())
+    mercadopago_request_duration.observe(elapsed, request.method, _endpoint(request), "error")
+    span = request.extensions.get("span")
+    if span is not None:
+        span.error = True
+        span.end()
 
 
 class MercadoPagoService:
@@ -13,6 +58,38 @@ class MercadoPagoService:
     
     BASE_URL = "https://api.mercadopago.com"
     
+    # Cliente HTTP compartilhado (pool de conexões keep-alive com a API)
+    _http_client: Optional[httpx.AsyncClient] = None
+    
+    @staticmethod
+    def get_http_client() -> httpx.AsyncClient:
+        """Retorna o cliente HTTP compartilhado, criando-o na primeira chamada"""
+        if MercadoPagoService._http_client is None or MercadoPagoService._http_client.is_closed:
+            MercadoPagoService._http_client = httpx.AsyncClient(
+                timeout=30.0,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=10),
+                event_hooks={"request": [_on_request], "response": [_on_response]}
+            )
+        return MercadoPagoService._http_client
+    
+    @staticmethod
+    @asynccontextmanager
+    async def client() -> AsyncIterator[httpx.AsyncClient]:
+        """Empresta o cliente compartilhado (não fecha a conexão ao sair)"""
+        try:
+            yield MercadoPagoService.get_http_client()
+        except httpx.RequestError as e:
+            # Timeouts e falhas de conexão não passam pelo hook de resposta
+            _record_error(e.request)
+            raise
+    
+    @staticmethod
+    async def close_http_client() -> None:
+        """Fecha o pool de conexões (encerramento da aplicação)"""
+        if MercadoPagoService._http_client is not None:
+            await MercadoPagoService._http_client.aclose()
+            MercadoPagoService._http_client = None
+    
     @staticmethod
     def get_access_token() -> str:
         """Retorna o access token do Mercado Pago das variáveis de ambiente"""
@@ -24,12 +101,18 @@ class MercadoPagoService:
             )
         return token
     
+    @staticmethod
+    def has_access_token() -> bool:
+        """Indica se o access token do Mercado Pago está configurado"""
+        return bool(os.getenv("MERCADOPAGO_ACCESS_TOKEN", ""))
+    
     @staticmethod
     def get_public_key() -> str:
         """Retorna a public key do Mercado Pago"""
         return os.getenv("MERCADOPAGO_PUBLIC_KEY", "")
     
     @staticmethod
+    @tracing.traced("mercadopago.create_card_payment")
     async def create_card_payment(
         amount: float,
         description: str,
@@ -94,7 +177,7 @@ class MercadoPagoService:
         }
         
         try:
-            async with httpx.AsyncClient() as client:
+            async with MercadoPagoService.client() as client:
                 response = await client.post(
                     f"{MercadoPagoService.BASE_URL}/v1/payments",
                     json=payload,
@@ -104,9 +187,12 @@ class MercadoPagoService:
                 
                 payment_data = response.json()
                 
-                # Log para debug
-                print(f"MP Response Status: {response.status_code}")
-                print(f"MP Response: {payment_data}")
+                # Corpo completo só em DEBUG; dados de cartão são redigidos pelo logging
+                logger.info(
+                    "Resposta do Mercado Pago (cartão)",
+                    extra={"status_code": response.status_code, "payment_status": payment_data.get("status")}
+                )
+                logger.debug("Corpo da resposta do Mercado Pago", extra={"response": payment_data})
                 
                 if response.status_code not in [200, 201]:
                     error_message = payment_data.get("message", "Erro ao processar pagamento")
@@ -116,7 +202,7 @@ class MercadoPagoService:
                     
                     # Em modo teste, simula aprovação se token inválido
                     if is_test_mode and "token" in error_message.lower():
-                        print("Modo teste: Simulando aprovação do pagamento")
+                        logger.warning("Modo teste: simulando aprovação do pagamento")
                         return {
                             "id": f"test_{external_reference}",
                             "status": "approved",
@@ -143,7 +229,7 @@ class MercadoPagoService:
                 
                 # Em modo teste, se rejeitado por razões de teste, simula aprovação
                 if is_test_mode and payment_status == "rejected" and "cc_rejected" in status_detail:
-                    print(f"Modo teste: Pagamento rejeitado ({status_detail}), simulando aprovação")
+                    logger.warning(f"Modo teste: pagamento rejeitado ({status_detail}), simulando aprovação")
                     return {
                         "id": payment_data.get("id", f"test_{external_reference}"),
                         "status": "approved",
@@ -193,7 +279,7 @@ class MercadoPagoService:
         }
         
         try:
-            async with httpx.AsyncClient() as client:
+            async with MercadoPagoService.client() as client:
                 response = await client.get(
                     f"{MercadoPagoService.BASE_URL}/v1/payment_methods",
                     headers=headers,
@@ -209,6 +295,7 @@ class MercadoPagoService:
             return {"payment_methods": []}
     
     @staticmethod
+    @tracing.traced("mercadopago.get_payment")
     async def get_payment(payment_id: str) -> Optional[Dict[str, Any]]:
         """
         Busca os dados de um pagamento específico pelo ID
@@ -227,7 +314,7 @@ class MercadoPagoService:
         }
         
         try:
-            async with httpx.AsyncClient() as client:
+            async with MercadoPagoService.client() as client:
                 response = await client.get(
                     f"{MercadoPagoService.BASE_URL}/v1/payments/{payment_id}",
                     headers=headers,
@@ -240,10 +327,11 @@ class MercadoPagoService:
                 return response.json()
                 
         except httpx.RequestError as e:
-            print(f"Erro ao buscar pagamento {payment_id}: {e}")
+            logger.error(f"Erro ao buscar pagamento {payment_id}: {e}")
             return None
     
     @staticmethod
+    @tracing.traced("mercadopago.create_qr_order")
     async def create_qr_order(
         amount: float,
         description: str,
@@ -268,7 +356,7 @@ class MercadoPagoService:
             "total_amount": f"{amount:.2f}",
             "description": description,
             "external_reference": external_reference,
-            "expiration_time": "PT1H",  # 1 hora de validade
+            "expiration_time": f"PT{settings.ORDER_PAYMENT_WINDOW_MINUTES}M",  # Prazo antes da expiração do pedido
             "config": {
                 "qr": {
                     "mode": "dynamic"  # QR code dinâmico
@@ -297,7 +385,7 @@ class MercadoPagoService:
         }
         
         try:
-            async with httpx.AsyncClient() as client:
+            async with MercadoPagoService.client() as client:
                 response = await client.post(
                     f"{MercadoPagoService.BASE_URL}/v1/orders",
                     json=payload,
@@ -321,6 +409,45 @@ class MercadoPagoService:
                 detail=f"Erro de comunicação com Mercado Pago: {str(e)}"
             )
     
+    @staticmethod
+    @tracing.traced("mercadopago.cancel_order")
+    async def cancel_order(order_id: str) -> bool:
+        """
+        Cancela uma ordem PIX ainda não paga
+        
+        Args:
+            order_id: ID da ordem no Mercado Pago
+            
+        Returns:
+            True se a ordem foi cancelada
+        """
+        access_token = MercadoPagoService.get_access_token()
+        
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json",
+            "X-Idempotency-Key": f"cancel-{order_id}"
+        }
+        
+        try:
+            async with MercadoPagoService.client() as client:
+                response = await client.post(
+                    f"{MercadoPagoService.BASE_URL}/v1/orders/{order_id}/cancel",
+                    headers=headers,
+                    timeout=30.0
+                )
+                
+                if response.status_code not in [200, 201]:
+                    # Ordem já paga, já cancelada ou expirada no próprio Mercado Pago
+                    logger.warning(f"Ordem {order_id} não cancelada no Mercado Pago: HTTP {response.status_code}")
+                    return False
+                
+                return True
+                
+        except httpx.RequestError as e:
+            logger.error(f"Erro ao cancelar ordem {order_id}: {e}")
+            return False
+    
     @staticmethod
     async def check_payment_status(external_reference: str) -> Dict[str, Any]:
         """
@@ -340,7 +467,7 @@ class MercadoPagoService:
         }
         
         try:
-            async with httpx.AsyncClient() as client:
+            async with MercadoPagoService.client() as client:
                 # Busca pela referência externa
                 response = await client.get(
                     f"{MercadoPagoService.BASE_URL}/v1/payments/search",
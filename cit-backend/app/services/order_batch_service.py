@@ -0,0 +1,362 @@
+"""
+Pedidos em lote (revendedores)
+
+Um carrinho (voucher × quantidade) vira um documento em `order_batches` e
+um pedido por unidade em `orders`, gravados com um único insert_many. O
+lote é cobrado em uma só ordem PIX cujo external_reference é o ID do lote.
+
+Com fulfillment "code" cada pedido recebe um código de acesso do estoque
+(AccessCodeService); com "balance" (padrão) as horas vão para o saldo.
+
+A confirmação é decidida por uma única transição atômica do documento do
+lote (pending|expired -> paid): só quem vence essa troca marca os pedidos e
+credita as horas, então webhooks repetidos e confirmações concorrentes não
+creditam duas vezes. Um lote expirado (OrderExpiryService) ainda é aceito
+se o pagamento foi aprovado.
+
+`fulfilled_at` só é gravado depois da entrega. Um lote pago sem ele (queda
+entre a transição e a entrega) é concluído pela tarefa do líder após
+FULFILLMENT_RECOVERY_GRACE_SECONDS; a entrega é idempotente.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument, UpdateOne
+from app.core.config import settings
+from app.database.mongo import get_database
+from app.schemas.order import BulkOrderCreate
+from app.services.access_code_service import AccessCodeService
+from app.services.company_service import CompanyService
+from app.services.job_service import JobService
+from app.services.ledger_service import LedgerService
+from app.services.mercadopago_service import MercadoPagoService
+from app.services.payment_service import FULFILLMENT_MODES, PaymentService
+from app.services.voucher_service import VoucherService
+
+logger = logging.getLogger(__name__)
+
+
+class OrderBatchService:
+
+    @staticmethod
+    async def create_batch(user_id: str, batch_data: BulkOrderCreate) -> dict:
+        """Cria os pedidos do carrinho e a cobrança PIX do total"""
+        db = get_database()
+
+        if batch_data.payment_method != "pix":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Pedidos em lote aceitam apenas pagamento PIX"
+            )
+
+        if batch_data.fulfillment not in FULFILLMENT_MODES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Modo de entrega inválido"
+            )
+
+        if not batch_data.items:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Carrinho vazio"
+            )
+
+        total_units = sum(max(item.quantity, 0) for item in batch_data.items)
+        if total_units > settings.BULK_ORDER_MAX_UNITS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Máximo de {settings.BULK_ORDER_MAX_UNITS} vouchers por lote"
+            )
+
+        batch_id = ObjectId()
+        now = datetime.now(timezone.utc)
+        company_data = await CompanyService.get_order_company(batch_data.company_slug)
+
+        items = []
+        orders = []
+        for item in batch_data.items:
+            result = {"voucher_id": item.voucher_id, "quantity": item.quantity, "order_ids": []}
+            items.append(result)
+
+            if item.quantity < 1:
+                result.update(status="rejected", error="Quantidade inválida")
+                continue
+
+            voucher = await VoucherService.find_voucher(item.voucher_id, active_only=True)
+            if voucher is None:
+                result.update(status="rejected", error="Voucher não disponível")
+                continue
+
+            result.update(status="created", unit_price=voucher["price"], hours=voucher["hours"])
+            for _ in range(item.quantity):
+                order_id = ObjectId()
+                result["order_ids"].append(str(order_id))
+                orders.append({
+                    "_id": order_id,
+                    "user_id": user_id,
+                    "voucher_id": item.voucher_id,
+                    "payment_method": "pix",
+                    "status": "pending",
+                    "total_amount": voucher["price"],
+                    "voucher_hours": voucher["hours"],
+                    "voucher_name": voucher["name"],
+                    "company": company_data,
+                    "company_slug": batch_data.company_slug,
+                    "fulfillment": batch_data.fulfillment,
+                    "batch_id": str(batch_id),
+                    "created_at": now,
+                    "paid_at": None
+                })
+
+        if not orders:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Nenhum item válido no carrinho"
+            )
+
+        total_amount = round(sum(order["total_amount"] for order in orders), 2)
+        total_hours = sum(order["voucher_hours"] for order in orders)
+
+        batch = {
+            "_id": batch_id,
+            "user_id": user_id,
+            "status": "pending",
+            "payment_method": "pix",
+            "fulfillment": batch_data.fulfillment,
+            "items": items,
+            "total_orders": len(orders),
+            "total_amount": total_amount,
+            "total_hours": total_hours,
+            "company_slug": batch_data.company_slug,
+            "created_at": now,
+            "paid_at": None
+        }
+
+        await db.order_batches.insert_one(batch)
+        try:
+            await db.orders.insert_many(orders, ordered=False)
+        except Exception:
+            # Sem transações: desfaz o que entrou para não deixar lote parcial
+            await db.orders.delete_many({"batch_id": str(batch_id)})
+            await db.order_batches.update_one({"_id": batch_id}, {"$set": {"status": "failed"}})
+            raise
+
+        batch["payment"] = await OrderBatchService._create_charge(str(batch_id), total_amount, len(orders))
+        await db.order_batches.update_one({"_id": batch_id}, {"$set": {"payment": batch["payment"]}})
+
+        return batch
+
+    @staticmethod
+    async def _create_charge(batch_id: str, amount: float, total_orders: int) -> dict:
+        """Uma ordem PIX para o total do lote (QR code manual se o Mercado Pago falhar)"""
+        pix_key = await PaymentService.get_pix_key_from_config()
+        try:
+            mp_order = await MercadoPagoService.create_qr_order(
+                amount=amount,
+                description=f"Lote de {total_orders} vouchers de internet",
+                external_reference=batch_id
+            )
+            return {
+                "pix_key": pix_key,
+                "pix_qrcode": mp_order.get("qr_data", ""),
+                "mercadopago_order_id": mp_order.get("id"),
+                "fallback_mode": False
+            }
+        except HTTPException:
+            return {
+                "pix_key": pix_key,
+                "pix_qrcode": await PaymentService.generate_pix_qrcode(amount, pix_key, batch_id),
+                "mercadopago_order_id": None,
+                "fallback_mode": True
+            }
+
+    @staticmethod
+    async def get_batch(batch_id: str, user_id: str) -> dict:
+        """Busca um lote do usuário"""
+        db = get_database()
+
+        if not ObjectId.is_valid(batch_id):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="ID do lote inválido"
+            )
+
+        batch = await db.order_batches.find_one({"_id": ObjectId(batch_id), "user_id": user_id})
+        if not batch:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Lote não encontrado"
+            )
+
+        return batch
+
+    @staticmethod
+    async def confirm_batch(batch_id: str, user_id: str) -> dict:
+        """Confirma o pagamento PIX do lote (consulta o Mercado Pago quando houver ordem)"""
+        batch = await OrderBatchService.get_batch(batch_id, user_id)
+
+        if batch["status"] == "paid":
+            return {"message": "Lote já foi confirmado"}
+
+        if batch["status"] == "expired":
+            # Só um pagamento aprovado no Mercado Pago (feito antes do cancelamento) reabre o lote
+            mp_status = await MercadoPagoService.check_payment_status(batch_id)
+            if mp_status.get("status") != "confirmed":
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Lote expirado sem pagamento confirmado"
+                )
+        elif batch["status"] != "pending":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Lote não pode ser confirmado (status: {batch['status']})"
+            )
+        elif (batch.get("payment") or {}).get("mercadopago_order_id"):
+            # Sem aprovação não há confirmação: com o Mercado Pago fora do ar
+            # check_payment_status responde "pending" e o lote fica para o
+            # webhook ou para a recuperação
+            mp_status = await MercadoPagoService.check_payment_status(batch_id)
+            if mp_status.get("status") != "confirmed":
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Pagamento ainda não foi confirmado pelo Mercado Pago"
+                )
+
+        confirmed = await OrderBatchService.mark_paid(batch_id)
+        if confirmed is None:
+            return {"message": "Lote já foi confirmado"}
+
+        if confirmed.get("fulfillment") == "code":
+            return {
+                "message": "Pagamento confirmado e códigos de acesso emitidos",
+                "orders_paid": confirmed["total_orders"]
+            }
+
+        return {
+            "message": "Pagamento confirmado e horas adicionadas",
+            "orders_paid": confirmed["total_orders"],
+            "hours_added": confirmed["total_hours"]
+        }
+
+    @staticmethod
+    async def mark_paid(batch_id: str, payment_id: Optional[str] = None) -> Optional[dict]:
+        """
+        Transição pending|expired -> paid do lote. Retorna o lote atualizado,
+        ou None se outro processo já o confirmou (nada é creditado de novo).
+        """
+        db = get_database()
+        now = datetime.now(timezone.utc)
+
+        paid_fields = {"status": "paid", "paid_at": now}
+        if payment_id:
+            paid_fields["payment_id"] = payment_id
+
+        batch = await db.order_batches.find_one_and_update(
+            {"_id": ObjectId(batch_id), "status": {"$in": ["pending", "expired"]}},
+            {"$set": paid_fields},
+            return_document=ReturnDocument.AFTER
+        )
+        if batch is None:
+            return None
+
+        await OrderBatchService._complete(batch)
+
+        logger.info("Lote confirmado", extra={"batch_id": batch_id, "orders": batch["total_orders"]})
+        return batch
+
+    @staticmethod
+    async def _complete(batch: dict) -> None:
+        """Marca os pedidos do lote pago e entrega; fulfilled_at só no fim (pode ser repetido)"""
+        db = get_database()
+
+        paid_fields = {"status": "paid", "paid_at": batch["paid_at"]}
+        if batch.get("payment_id"):
+            paid_fields["payment_id"] = batch["payment_id"]
+
+        await db.orders.update_many(
+            {"batch_id": str(batch["_id"]), "status": {"$in": ["pending", "expired"]}},
+            {"$set": paid_fields}
+        )
+
+        await OrderBatchService._fulfill(batch)
+        await db.order_batches.update_one({"_id": batch["_id"]}, {"$set": {"fulfilled_at": datetime.now(timezone.utc)}})
+
+    @staticmethod
+    async def recover_unfulfilled() -> int:
+        """Tarefa do líder: conclui lotes pagos cuja entrega foi interrompida"""
+        db = get_database()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.FULFILLMENT_RECOVERY_GRACE_SECONDS)
+
+        batches = await db.order_batches.find(
+            {"status": "paid", "fulfilled_at": {"$exists": False}, "paid_at": {"$lt": cutoff}}
+        ).limit(settings.FULFILLMENT_RECOVERY_BATCH_SIZE).to_list(length=settings.FULFILLMENT_RECOVERY_BATCH_SIZE)
+
+        for batch in batches:
+            await OrderBatchService._complete(batch)
+            logger.warning("Entrega do lote concluída pela recuperação", extra={"batch_id": str(batch["_id"])})
+        return len(batches)
+
+    @staticmethod
+    async def _fulfill(batch: dict) -> None:
+        """Entrega o lote pago: credita todas as horas ou emite um código por pedido"""
+        db = get_database()
+
+        if batch.get("fulfillment") == "code":
+            batch_id = str(batch["_id"])
+            orders = await db.orders.find(
+                {"batch_id": batch_id},
+                {"user_id": 1, "voucher_id": 1, "voucher_hours": 1}
+            ).to_list(length=None)
+            codes = await AccessCodeService.claim_many(orders)
+
+            await db.orders.bulk_write(
+                [UpdateOne({"_id": ObjectId(order_id)}, {"$set": {"access_code": code}}) for order_id, code in codes.items()],
+                ordered=False
+            )
+            # Códigos também no lote, na ordem dos pedidos de cada item
+            items_codes = {
+                f"items.{index}.codes": [codes[order_id] for order_id in item["order_ids"] if order_id in codes]
+                for index, item in enumerate(batch["items"])
+                if item.get("order_ids")
+            }
+            await db.order_batches.update_one({"_id": batch["_id"]}, {"$set": items_codes})
+            return
+
+        await LedgerService.record(
+            batch["user_id"],
+            batch["total_hours"],
+            "purchase",
+            f"batch:{batch['_id']}",
+            {"batch_id": str(batch["_id"])}
+        )
+
+    @staticmethod
+    async def apply_payment_status(batch_id: str, new_status: str, payment_id: str) -> bool:
+        """
+        Aplica a notificação do Mercado Pago a um lote. Retorna False se o
+        external_reference não for um lote.
+        """
+        db = get_database()
+
+        if not ObjectId.is_valid(batch_id):
+            return False
+
+        if new_status == "paid":
+            if await OrderBatchService.mark_paid(batch_id, payment_id) is not None:
+                return True
+        elif new_status in ("failed", "cancelled", "refunded"):
+            fields = {"status": new_status, "payment_id": payment_id, "updated_at": datetime.now(timezone.utc)}
+            result = await db.order_batches.update_one(
+                {"_id": ObjectId(batch_id), "status": "pending"},
+                {"$set": fields}
+            )
+            if result.modified_count:
+                await db.orders.update_many({"batch_id": batch_id, "status": "pending"}, {"$set": fields})
+                return True
+
+        return await db.order_batches.count_documents({"_id": ObjectId(batch_id)}, limit=1) > 0
+
+
+JobService.register("batch-fulfillment-recovery", settings.FULFILLMENT_RECOVERY_INTERVAL_SECONDS, OrderBatchService.recover_unfulfilled)
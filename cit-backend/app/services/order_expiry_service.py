@@ -0,0 +1,156 @@
+"""
+Expiração de pedidos pendentes
+
+A cobrança PIX vale ORDER_PAYMENT_WINDOW_MINUTES (expiration_time da ordem
+no Mercado Pago). Passado esse prazo, mais ORDER_EXPIRY_GRACE_MINUTES para
+notificações atrasadas, pedidos e lotes ainda `pending` viram `expired`.
+A tarefa do líder percorre o índice (status, created_at) em lotes de
+ORDER_EXPIRY_BATCH_SIZE, marca os documentos com update_many e cancela a
+ordem no Mercado Pago quando houver uma.
+
+Um pagamento aprovado que chegue depois da expiração ainda é aceito: o
+webhook e a confirmação manual tiram o pedido de `expired` para `paid`.
+Notificações de outros status (inclusive a do próprio cancelamento) não
+mudam um pedido expirado.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List
+from app.core.config import settings
+from app.core.metrics import order_expirations
+from app.database.mongo import get_database
+from app.services.job_service import JobService
+from app.services.mercadopago_service import MercadoPagoService
+
+logger = logging.getLogger(__name__)
+
+# Cancelamentos simultâneos no Mercado Pago por rodada
+_CANCEL_CONCURRENCY = 10
+
+
+class OrderExpiryService:
+
+    @staticmethod
+    def cutoff(now: datetime) -> datetime:
+        """Pedidos criados antes disso já passaram do prazo de pagamento"""
+        return now - timedelta(minutes=settings.ORDER_PAYMENT_WINDOW_MINUTES + settings.ORDER_EXPIRY_GRACE_MINUTES)
+
+    @staticmethod
+    async def expire_stale() -> dict:
+        """Tarefa do líder: expira pedidos e lotes vencidos. Retorna as contagens"""
+        now = datetime.now(timezone.utc)
+        cutoff = OrderExpiryService.cutoff(now)
+        totals = {"orders": 0, "batches": 0, "cancelled": 0}
+
+        for _ in range(settings.ORDER_EXPIRY_MAX_ROUNDS):
+            expired, cancelled = await OrderExpiryService._expire_orders(cutoff, now)
+            totals["orders"] += expired
+            totals["cancelled"] += cancelled
+            if expired < settings.ORDER_EXPIRY_BATCH_SIZE:
+                break
+
+        for _ in range(settings.ORDER_EXPIRY_MAX_ROUNDS):
+            expired, orders, cancelled = await OrderExpiryService._expire_batches(cutoff, now)
+            totals["batches"] += expired
+            totals["orders"] += orders
+            totals["cancelled"] += cancelled
+            if expired < settings.ORDER_EXPIRY_BATCH_SIZE:
+                break
+
+        if totals["orders"] or totals["batches"]:
+            logger.info("Pedidos pendentes expirados", extra=totals)
+        return totals
+
+    @staticmethod
+    async def _expire_orders(cutoff: datetime, now: datetime):
+        """Um lote de pedidos avulsos (os de lotes expiram junto com o lote)"""
+        db = get_database()
+        candidates = await db.orders.find(
+            {"status": "pending", "created_at": {"$lt": cutoff}, "batch_id": {"$exists": False}},
+            {"_id": 1}
+        ).sort("created_at", 1).limit(settings.ORDER_EXPIRY_BATCH_SIZE).to_list(length=settings.ORDER_EXPIRY_BATCH_SIZE)
+        if not candidates:
+            return 0, 0
+
+        ids = [doc["_id"] for doc in candidates]
+        # O filtro de status evita sobrescrever um pedido pago entre a busca e a escrita
+        result = await db.orders.update_many(
+            {"_id": {"$in": ids}, "status": "pending"},
+            {"$set": {"status": "expired", "expired_at": now}}
+        )
+        if not result.modified_count:
+            return 0, 0
+        order_expirations.inc("order", amount=result.modified_count)
+
+        expired_ids = [
+            str(doc["_id"]) for doc in await db.orders.find(
+                {"_id": {"$in": ids}, "status": "expired", "expired_at": now}, {"_id": 1}
+            ).to_list(length=None)
+        ]
+        payments = await db.payments.find(
+            {"order_id": {"$in": expired_ids}, "status": "pending"},
+            {"mercadopago_order_id": 1}
+        ).to_list(length=None)
+        await db.payments.update_many(
+            {"_id": {"$in": [payment["_id"] for payment in payments]}, "status": "pending"},
+            {"$set": {"status": "expired", "expired_at": now}}
+        )
+
+        cancelled = await OrderExpiryService._cancel_upstream(
+            [payment["mercadopago_order_id"] for payment in payments if payment.get("mercadopago_order_id")]
+        )
+        return result.modified_count, cancelled
+
+    @staticmethod
+    async def _expire_batches(cutoff: datetime, now: datetime):
+        """Um lote de pedidos em lote: expira o lote e todos os seus pedidos"""
+        db = get_database()
+        candidates = await db.order_batches.find(
+            {"status": "pending", "created_at": {"$lt": cutoff}},
+            {"_id": 1}
+        ).sort("created_at", 1).limit(settings.ORDER_EXPIRY_BATCH_SIZE).to_list(length=settings.ORDER_EXPIRY_BATCH_SIZE)
+        if not candidates:
+            return 0, 0, 0
+
+        ids = [doc["_id"] for doc in candidates]
+        result = await db.order_batches.update_many(
+            {"_id": {"$in": ids}, "status": "pending"},
+            {"$set": {"status": "expired", "expired_at": now}}
+        )
+        if not result.modified_count:
+            return 0, 0, 0
+        order_expirations.inc("batch", amount=result.modified_count)
+
+        batches = await db.order_batches.find(
+            {"_id": {"$in": ids}, "status": "expired", "expired_at": now},
+            {"payment.mercadopago_order_id": 1}
+        ).to_list(length=None)
+        orders = await db.orders.update_many(
+            {"batch_id": {"$in": [str(batch["_id"]) for batch in batches]}, "status": "pending"},
+            {"$set": {"status": "expired", "expired_at": now}}
+        )
+        order_expirations.inc("order", amount=orders.modified_count)
+
+        cancelled = await OrderExpiryService._cancel_upstream([
+            batch["payment"]["mercadopago_order_id"]
+            for batch in batches
+            if (batch.get("payment") or {}).get("mercadopago_order_id")
+        ])
+        return result.modified_count, orders.modified_count, cancelled
+
+    @staticmethod
+    async def _cancel_upstream(mp_order_ids: List[str]) -> int:
+        """Cancela as ordens PIX no Mercado Pago para que o QR code deixe de ser pago"""
+        if not mp_order_ids or not MercadoPagoService.has_access_token():
+            return 0
+
+        cancelled = 0
+        for start in range(0, len(mp_order_ids), _CANCEL_CONCURRENCY):
+            chunk = mp_order_ids[start:start + _CANCEL_CONCURRENCY]
+            results = await asyncio.gather(*(MercadoPagoService.cancel_order(mp_order_id) for mp_order_id in chunk))
+            cancelled += sum(1 for ok in results if ok)
+        return cancelled
+
+
+JobService.register("order-expiry", settings.ORDER_EXPIRY_INTERVAL_SECONDS, OrderExpiryService.expire_stale)
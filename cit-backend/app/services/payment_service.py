@@ -1,13 +1,25 @@
-from datetime import datetime, timezone
+import logging
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from bson import ObjectId
-import random
-import string
+from app.core import tracing
+from app.core.config import settings
 from app.database.mongo import get_database
 from app.schemas.order import PaymentCreate
 from app.services.mercadopago_service import MercadoPagoService
+from app.services.ledger_service import LedgerService
+from app.services.access_code_service import AccessCodeService
+from app.services.archive_service import ArchiveService
+from app.services.company_service import CompanyService
+from app.services.job_service import JobService
+from app.services.voucher_service import VoucherService
 from fastapi import HTTPException, status
 
+logger = logging.getLogger(__name__)
+
+# Entrega do pedido pago: crédito no saldo do comprador ou código de acesso
+FULFILLMENT_MODES = ("balance", "code")
+
 
 class PaymentService:
     
@@ -28,17 +40,16 @@ class PaymentService:
         return f"{crc:04X}"
     
     @staticmethod
+    @tracing.traced("payment.get_pix_key_from_config")
     async def get_pix_key_from_config() -> str:
         """Busca a chave PIX das configurações do admin"""
-        db = get_database()
-        
-        # Primeiro tenta buscar da nova coleção companies
-        company = await db.companies.find_one({})
+        # Primeiro tenta a empresa da nova coleção companies (em cache)
+        company = await CompanyService.get_default()
         if company and company.get("pixKey"):
             return company["pixKey"]
         
         # Fallback para coleção antiga config
-        config = await db.config.find_one({"type": "financial"})
+        config = await CompanyService.get_legacy_config("financial")
         if config and config.get("pixKey"):
             return config["pixKey"]
         
@@ -46,6 +57,7 @@ class PaymentService:
         return "contato@cit.com"
     
     @staticmethod
+    @tracing.traced("payment.generate_pix_qrcode")
     async def generate_pix_qrcode(amount: float, pix_key: str, order_id: str) -> str:
         """
         Gera um payload PIX copia e cola (BR Code)
@@ -127,6 +139,12 @@ class PaymentService:
                 detail="Pedido já foi pago"
             )
         
+        if order["status"] == "expired":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Pedido expirado; crie um novo pedido"
+            )
+        
         # Cria o registro de pagamento
         payment_dict = {
             "order_id": payment_data.order_id,
@@ -139,7 +157,7 @@ class PaymentService:
         # Processa conforme o método
         if payment_data.payment_method == "pix":
             # Busca dados do voucher para descrição
-            voucher = await db.vouchers.find_one({"_id": ObjectId(order["voucher_id"])})
+            voucher = await VoucherService.find_voucher(order["voucher_id"])
             description = f"{voucher['name']} - {voucher['hours']}h" if voucher else "Voucher de Internet"
             
             try:
@@ -175,7 +193,7 @@ class PaymentService:
             
         elif payment_data.payment_method in ["credit", "debit"]:
             # Busca dados do voucher para descrição
-            voucher = await db.vouchers.find_one({"_id": ObjectId(order["voucher_id"])})
+            voucher = await VoucherService.find_voucher(order["voucher_id"])
             description = f"{voucher['name']} - {voucher['hours']}h" if voucher else "Voucher de Internet"
             
             # Busca o usuário para pegar o email
@@ -321,19 +339,56 @@ class PaymentService:
             {
                 "$set": {
                     "status": "paid",
-                    "paid_at": datetime.now(timezone.utc)
+                    "paid_at": datetime.now(timezone.utc),
+                    "fulfillment_pending": True
                 }
             }
         )
         
-        # Adiciona horas ao usuário
-        await db.users.update_one(
-            {"_id": ObjectId(order["user_id"])},
-            {
-                "$inc": {"hours_balance": order["voucher_hours"]},
-                "$set": {"updated_at": datetime.now(timezone.utc)}
-            }
+        await PaymentService.fulfill_order(order)
+    
+    @staticmethod
+    async def fulfill_order(order: dict) -> Optional[str]:
+        """
+        Entrega o pedido pago: credita as horas no saldo do comprador ou,
+        com fulfillment "code", emite um código de acesso. Retorna o código.
+        Idempotente; ao terminar remove a marca fulfillment_pending.
+        """
+        db = get_database()
+        
+        if order.get("fulfillment") == "code":
+            code = await AccessCodeService.claim(order)
+            await db.orders.update_one(
+                {"_id": order["_id"]},
+                {"$set": {"access_code": code}, "$unset": {"fulfillment_pending": ""}}
+            )
+            return code
+        
+        # Adiciona horas ao usuário (idempotente: o pedido só credita uma vez)
+        await LedgerService.record(
+            order["user_id"],
+            order["voucher_hours"],
+            "purchase",
+            f"order:{order['_id']}",
+            {"order_id": str(order["_id"])}
         )
+        await db.orders.update_one({"_id": order["_id"]}, {"$unset": {"fulfillment_pending": ""}})
+        return None
+    
+    @staticmethod
+    async def recover_unfulfilled() -> int:
+        """Tarefa do líder: entrega pedidos pagos cuja entrega foi interrompida (fulfillment_pending)"""
+        db = get_database()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.FULFILLMENT_RECOVERY_GRACE_SECONDS)
+        
+        orders = await db.orders.find(
+            {"fulfillment_pending": True, "status": "paid", "paid_at": {"$lt": cutoff}}
+        ).limit(settings.FULFILLMENT_RECOVERY_BATCH_SIZE).to_list(length=settings.FULFILLMENT_RECOVERY_BATCH_SIZE)
+        
+        for order in orders:
+            await PaymentService.fulfill_order(order)
+            logger.warning("Entrega do pedido concluída pela recuperação", extra={"order_id": str(order["_id"])})
+        return len(orders)
     
     @staticmethod
     async def confirm_payment_and_add_hours(order_id: str):
@@ -360,20 +415,26 @@ class PaymentService:
         # Busca o pagamento
         payment = await db.payments.find_one({"order_id": order_id})
         
+        if order["status"] == "expired":
+            # Só um pagamento aprovado no Mercado Pago (feito antes do cancelamento) reabre o pedido
+            mp_status = await MercadoPagoService.check_payment_status(order_id)
+            if mp_status.get("status") != "confirmed":
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Pedido expirado sem pagamento confirmado"
+                )
         # Se tiver mercadopago_order_id, verifica status real no Mercado Pago
-        if payment and payment.get("mercadopago_order_id"):
-            try:
-                mp_status = await MercadoPagoService.check_payment_status(order_id)
-                
-                # Se ainda está pendente no Mercado Pago, não confirma
-                if mp_status.get("status") != "confirmed":
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Pagamento ainda não foi confirmado pelo Mercado Pago"
-                    )
-            except Exception as e:
-                # Em caso de erro na consulta, permite confirmar (modo fallback)
-                pass
+        elif payment and payment.get("mercadopago_order_id"):
+            mp_status = await MercadoPagoService.check_payment_status(order_id)
+            
+            # Se ainda está pendente no Mercado Pago, não confirma. Com o Mercado
+            # Pago fora do ar check_payment_status responde "pending": o pedido
+            # fica para o webhook ou para a recuperação
+            if mp_status.get("status") != "confirmed":
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Pagamento ainda não foi confirmado pelo Mercado Pago"
+                )
         
         # Atualiza o status do pedido
         await db.orders.update_one(
@@ -381,19 +442,13 @@ class PaymentService:
             {
                 "$set": {
                     "status": "paid",
-                    "paid_at": datetime.now(timezone.utc)
+                    "paid_at": datetime.now(timezone.utc),
+                    "fulfillment_pending": True
                 }
             }
         )
         
-        # Adiciona horas ao usuário
-        await db.users.update_one(
-            {"_id": ObjectId(order["user_id"])},
-            {
-                "$inc": {"hours_balance": order["voucher_hours"]},
-                "$set": {"updated_at": datetime.now(timezone.utc)}
-            }
-        )
+        access_code = await PaymentService.fulfill_order(order)
         
         # Atualiza o pagamento
         await db.payments.update_one(
@@ -406,6 +461,13 @@ class PaymentService:
             }
         )
         
+        if access_code:
+            return {
+                "message": "Pagamento confirmado e código de acesso emitido",
+                "access_code": access_code,
+                "hours": order["voucher_hours"]
+            }
+        
         return {
             "message": "Pagamento confirmado e horas adicionadas",
             "hours_added": order["voucher_hours"]
@@ -413,7 +475,8 @@ class PaymentService:
     
     @staticmethod
     async def get_payment_by_order_id(order_id: str):
-        """Busca um pagamento pelo ID do pedido"""
-        db = get_database()
-        payment = await db.payments.find_one({"order_id": order_id})
-        return payment
+        """Busca um pagamento pelo ID do pedido (inclusive de pedidos arquivados)"""
+        return await ArchiveService.find_payment(order_id)
+
+
+JobService.register("order-fulfillment-recovery", settings.FULFILLMENT_RECOVERY_INTERVAL_SECONDS, PaymentService.recover_unfulfilled)
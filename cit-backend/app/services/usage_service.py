@@ -0,0 +1,406 @@
+"""
+Medição de uso reportada pelos controladores de hotspot
+
+Os eventos recebidos entram em um lote em memória compartilhado pelas
+requisições concorrentes (group commit). O lote é gravado quando atinge
+USAGE_FLUSH_MAX_EVENTS ou após USAGE_FLUSH_INTERVAL_SECONDS, e cada
+requisição só recebe a resposta depois que o seu lote foi gravado: a
+confirmação ao controlador significa que o evento está no banco.
+
+Gravação de um lote:
+1. `usage_event_ids` (_id = event_id) deduplica: IDs já vistos e aplicados
+   são descartados; os ainda não aplicados só são reprocessados depois que
+   o lease da tentativa anterior expira.
+2. Os eventos novos vão para a coleção time-series `usage_events`.
+3. Cada evento recebe a chave da cobrança em que entra (`charge_key`, por
+   gravação e usuário/código) e o consumo é descontado: usuários com uma
+   entrada no livro de horas cada (LedgerService.record_many, chave
+   `usage:{gravação}:{usuário}`), códigos com um único bulk_write que
+   guarda a chave em `usage_pending` no mesmo update do $inc.
+4. Os IDs são marcados como `applied`.
+
+O reenvio de um lote que falhou no meio é exatamente uma vez: eventos com
+charge_key cuja chave já está no livro (ou em `usage_pending` do código)
+não são cobrados de novo, e todos os eventos dessa chave são marcados como
+aplicados; as linhas da time-series de eventos retomados só são gravadas
+se ainda não existirem.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+from app.core.config import settings
+from app.core.metrics import usage_events
+from app.database.mongo import get_database
+from app.schemas.usage import UsageEvent
+from app.services.access_code_service import ALPHABET, normalize_code
+from app.services.auth_service import AuthService
+from app.services.balance_index import BalanceIndex
+from app.services.ledger_service import LedgerService
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "usage_events"
+
+
+class _PendingBatch:
+    """Eventos aguardando a próxima gravação e o future que a sinaliza"""
+
+    __slots__ = ("events", "future", "timer")
+
+    def __init__(self):
+        self.events: Dict[str, dict] = {}
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class UsageService:
+
+    _batch: Optional[_PendingBatch] = None
+    _flushes: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def validate(event: UsageEvent) -> Optional[str]:
+        """Mensagem de erro do evento, ou None se válido"""
+        if not event.event_id or len(event.event_id) > 128:
+            return "event_id inválido"
+        if (event.user_id is None) == (event.code is None):
+            return "Informe user_id ou code"
+        if event.user_id is not None and not ObjectId.is_valid(event.user_id):
+            return "user_id inválido"
+        if event.code is not None:
+            code = normalize_code(event.code)
+            if len(code) != settings.ACCESS_CODE_LENGTH or any(char not in ALPHABET for char in code):
+                return "code inválido"
+        if event.seconds < 0 or event.seconds > settings.USAGE_MAX_EVENT_SECONDS:
+            return "seconds fora do intervalo"
+        if event.bytes_in < 0 or event.bytes_out < 0:
+            return "bytes inválidos"
+        return None
+
+    @classmethod
+    async def ingest(cls, controller: str, events: List[UsageEvent]) -> dict:
+        """Enfileira os eventos e espera a gravação do lote em que entraram"""
+        now = datetime.now(timezone.utc)
+        rejected = []
+        event_ids = []
+
+        batch = cls._current_batch()
+        for event in events:
+            error = cls.validate(event)
+            if error:
+                rejected.append({"event_id": event.event_id, "error": error})
+                usage_events.inc("rejected")
+                continue
+            event_ids.append(event.event_id)
+            batch.events[event.event_id] = {
+                "event_id": event.event_id,
+                "controller": controller,
+                "user_id": event.user_id,
+                "code": normalize_code(event.code) if event.code else None,
+                "session_id": event.session_id,
+                "seconds": event.seconds,
+                "bytes_in": event.bytes_in,
+                "bytes_out": event.bytes_out,
+                "at": event.at or now,
+                "received_at": now
+            }
+
+        if not event_ids:
+            return {"accepted": 0, "duplicates": 0, "pending": [], "rejected": rejected}
+
+        if len(batch.events) >= settings.USAGE_FLUSH_MAX_EVENTS:
+            cls._seal(batch)
+
+        try:
+            # shield: o cancelamento de uma requisição não cancela a gravação do lote
+            outcome = await asyncio.shield(batch.future)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Falha ao gravar os eventos de uso; reenvie o lote"
+            )
+
+        accepted = sum(1 for event_id in event_ids if outcome.get(event_id) == "applied")
+        pending = [event_id for event_id in event_ids if outcome.get(event_id) == "pending"]
+        return {
+            "accepted": accepted,
+            "duplicates": len(event_ids) - accepted - len(pending),
+            "pending": pending,
+            "rejected": rejected
+        }
+
+    @classmethod
+    def _current_batch(cls) -> _PendingBatch:
+        batch = cls._batch
+        if batch is None:
+            batch = cls._batch = _PendingBatch()
+            batch.timer = asyncio.get_running_loop().call_later(
+                settings.USAGE_FLUSH_INTERVAL_SECONDS, cls._seal, batch
+            )
+        return batch
+
+    @classmethod
+    def _seal(cls, batch: _PendingBatch) -> None:
+        """Fecha o lote (novos eventos vão para outro) e dispara a gravação"""
+        if cls._batch is not batch:
+            return
+        cls._batch = None
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.create_task(cls._run(batch))
+        cls._flushes.add(task)
+        task.add_done_callback(cls._flushes.discard)
+
+    @classmethod
+    async def _run(cls, batch: _PendingBatch) -> None:
+        try:
+            outcome = await cls.flush(list(batch.events.values()))
+        except Exception as e:
+            logger.error(f"Erro ao gravar eventos de uso: {e}")
+            batch.future.set_exception(e)
+            # Marca a exceção como lida: evita o aviso do asyncio se nenhuma requisição aguarda
+            batch.future.exception()
+            return
+        batch.future.set_result(outcome)
+
+    @classmethod
+    async def flush(cls, events: List[dict]) -> Dict[str, str]:
+        """Grava um lote; retorna event_id -> applied | duplicate | pending"""
+        db = get_database()
+        now = datetime.now(timezone.utc)
+        token = ObjectId()
+
+        owned, outcome, resumed = await cls._claim_ids(db, events, token, now)
+        to_apply = [event for event in events if event["event_id"] in owned]
+
+        if to_apply:
+            try:
+                await cls._store(db, to_apply, resumed)
+                user_ids, landed, code_keys = await cls._apply_balances(db, to_apply, resumed, token, now)
+                await db.usage_event_ids.update_many(
+                    {"_id": {"$in": list(owned)}, "lease": token},
+                    {"$set": {"applied": True, "applied_at": now}, "$unset": {"lease": ""}}
+                )
+                await cls._finish_charges(db, landed, code_keys, now)
+            except Exception:
+                # Libera o lease para que o reenvio reprocesse na hora
+                try:
+                    await db.usage_event_ids.update_many(
+                        {"_id": {"$in": list(owned)}, "lease": token, "applied": False},
+                        {"$set": {"leased_at": datetime.min.replace(tzinfo=timezone.utc)}}
+                    )
+                except Exception:
+                    pass
+                raise
+            for event in to_apply:
+                if event["user_id"]:
+                    BalanceIndex.consume("user", event["user_id"], event["seconds"])
+                else:
+                    BalanceIndex.consume("code", event["code"], event["seconds"])
+            if user_ids:
+                AuthService.invalidate_users(user_ids)
+
+        for event_id in owned:
+            outcome[event_id] = "applied"
+        for result in outcome.values():
+            usage_events.inc(result)
+        return outcome
+
+    @staticmethod
+    async def _claim_ids(
+        db, events: List[dict], token: ObjectId, now: datetime
+    ) -> Tuple[Set[str], Dict[str, str], Dict[str, dict]]:
+        """
+        Registra os IDs do lote; retorna os que esta gravação deve aplicar,
+        o resultado dos demais e o estado dos retomados de uma tentativa anterior
+        """
+        outcome: Dict[str, str] = {}
+        resumed: Dict[str, dict] = {}
+        ids = [event["event_id"] for event in events]
+        try:
+            await db.usage_event_ids.insert_many(
+                [{"_id": event_id, "applied": False, "lease": token, "leased_at": now, "received_at": now} for event_id in ids],
+                ordered=False
+            )
+            return set(ids), outcome, resumed
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            duplicates = {error["op"]["_id"] for error in errors}
+
+        # Vistos antes e ainda não aplicados: retoma se o lease anterior expirou
+        await db.usage_event_ids.update_many(
+            {
+                "_id": {"$in": list(duplicates)},
+                "applied": False,
+                "leased_at": {"$lt": now - timedelta(seconds=settings.USAGE_LEASE_SECONDS)}
+            },
+            {"$set": {"lease": token, "leased_at": now}}
+        )
+        states = await db.usage_event_ids.find(
+            {"_id": {"$in": list(duplicates)}}, {"applied": 1, "lease": 1, "charge_key": 1}
+        ).to_list(length=None)
+
+        owned = set(ids) - duplicates
+        for state in states:
+            if state.get("lease") == token:
+                owned.add(state["_id"])
+                resumed[state["_id"]] = state
+            else:
+                outcome[state["_id"]] = "duplicate" if state.get("applied") else "pending"
+        return owned, outcome, resumed
+
+    @staticmethod
+    async def _store(db, events: List[dict], resumed: Dict[str, dict]) -> None:
+        """Grava as linhas na time-series, sem repetir as de uma tentativa anterior"""
+        # Retomado com charge_key: a tentativa anterior gravou as linhas antes de cobrar
+        rows = [event for event in events if not resumed.get(event["event_id"], {}).get("charge_key")]
+        retried = [event for event in rows if event["event_id"] in resumed]
+        if retried:
+            # A tentativa anterior pode ter caído logo depois do insert_many
+            stored = set(await db[COLLECTION].distinct("event_id", {
+                "event_id": {"$in": [event["event_id"] for event in retried]},
+                "at": {"$gte": min(event["at"] for event in retried), "$lte": max(event["at"] for event in retried)}
+            }))
+            rows = [event for event in rows if event["event_id"] not in stored]
+        if not rows:
+            return
+
+        await db[COLLECTION].insert_many(
+            [
+                {
+                    "at": event["at"],
+                    "meta": {
+                        "controller": event["controller"],
+                        "user_id": event["user_id"],
+                        "code": event["code"]
+                    },
+                    "event_id": event["event_id"],
+                    "session_id": event["session_id"],
+                    "seconds": event["seconds"],
+                    "bytes_in": event["bytes_in"],
+                    "bytes_out": event["bytes_out"]
+                }
+                for event in rows
+            ],
+            ordered=False
+        )
+
+    @staticmethod
+    async def _landed_charges(db, keys: Set[str]) -> Set[str]:
+        """Chaves de cobrança de tentativas anteriores que chegaram ao livro ou ao código"""
+        user_keys = [key for key in keys if key.startswith("usage:")]
+        code_keys = [key for key in keys if key.startswith("code:")]
+        landed: Set[str] = set()
+        if user_keys:
+            # Entrada ainda não aplicada é concluída pelo compactador do livro
+            landed.update(await db.hours_ledger.distinct("idempotency_key", {"idempotency_key": {"$in": user_keys}}))
+        if code_keys:
+            pending = await db.access_codes.distinct(
+                "usage_pending", {"code": {"$in": [key.rsplit(":", 1)[1] for key in code_keys]}}
+            )
+            landed.update(set(pending) & set(code_keys))
+        return landed
+
+    @staticmethod
+    async def _apply_balances(
+        db, events: List[dict], resumed: Dict[str, dict], token: ObjectId, now: datetime
+    ) -> Tuple[List[str], List[str], List[str]]:
+        """
+        Soma o consumo por usuário e por código; usuários via livro de horas,
+        códigos em um bulk_write. Retorna os usuários cobrados, as chaves de
+        tentativas anteriores já cobradas e as chaves de código a liberar.
+        """
+        previous = {
+            resumed[event["event_id"]]["charge_key"]
+            for event in events
+            if resumed.get(event["event_id"], {}).get("charge_key")
+        }
+        landed = await UsageService._landed_charges(db, previous) if previous else set()
+
+        by_user: Dict[str, float] = {}
+        by_code: Dict[str, float] = {}
+        charges: Dict[str, List[str]] = {}
+        for event in events:
+            if resumed.get(event["event_id"], {}).get("charge_key") in landed:
+                continue
+            if event["user_id"]:
+                key = f"usage:{token}:{event['user_id']}"
+                by_user[event["user_id"]] = by_user.get(event["user_id"], 0.0) + event["seconds"]
+            else:
+                key = f"code:{token}:{event['code']}"
+                by_code[event["code"]] = by_code.get(event["code"], 0.0) + event["seconds"]
+            charges.setdefault(key, []).append(event["event_id"])
+
+        if charges:
+            # Antes de cobrar: o reenvio sabe qual chave procurar
+            await db.usage_event_ids.bulk_write(
+                [
+                    UpdateMany({"_id": {"$in": event_ids}, "lease": token}, {"$set": {"charge_key": key}})
+                    for key, event_ids in charges.items()
+                ],
+                ordered=False
+            )
+
+        if by_user:
+            # Uma entrada no livro por usuário e gravação. Sem limite em zero: o
+            # consumo além do saldo fica registrado e a autorização já o trata como sem saldo
+            await LedgerService.record_many([
+                {
+                    "user_id": user_id,
+                    "amount": -seconds / 3600,
+                    "kind": "usage",
+                    "key": f"usage:{token}:{user_id}",
+                    "ref": {"flush": str(token), "seconds": seconds}
+                }
+                for user_id, seconds in by_user.items()
+            ])
+        if by_code:
+            await db.access_codes.bulk_write(
+                [
+                    UpdateOne(
+                        {"code": code, "usage_pending": {"$ne": f"code:{token}:{code}"}},
+                        {
+                            "$inc": {"used_seconds": seconds},
+                            "$set": {"last_used_at": now},
+                            "$addToSet": {"usage_pending": f"code:{token}:{code}"}
+                        }
+                    )
+                    for code, seconds in by_code.items()
+                ],
+                ordered=False
+            )
+
+        code_keys = [key for key in list(charges) + list(landed) if key.startswith("code:")]
+        return list(by_user), list(landed), code_keys
+
+    @staticmethod
+    async def _finish_charges(db, landed: List[str], code_keys: List[str], now: datetime) -> None:
+        """Depois de marcar o lote: fecha as cobranças anteriores e libera as chaves dos códigos"""
+        if landed:
+            # Eventos da mesma cobrança que não vieram neste reenvio também já foram descontados
+            await db.usage_event_ids.update_many(
+                {"charge_key": {"$in": landed}, "applied": False},
+                {"$set": {"applied": True, "applied_at": now}, "$unset": {"lease": ""}}
+            )
+        if code_keys:
+            await db.access_codes.update_many(
+                {"code": {"$in": list({key.rsplit(":", 1)[1] for key in code_keys})}},
+                {"$pull": {"usage_pending": {"$in": code_keys}}}
+            )
+
+    @classmethod
+    async def stop(cls) -> None:
+        """Grava o lote aberto e espera as gravações em andamento"""
+        if cls._batch is not None:
+            cls._seal(cls._batch)
+        if cls._flushes:
+            await asyncio.gather(*cls._flushes, return_exceptions=True)
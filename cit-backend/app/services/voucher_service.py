@@ -1,12 +1,82 @@
+import asyncio
+import logging
 from datetime import datetime, timezone
-from typing import List, Optional
+from types import MappingProxyType
+from typing import List, Mapping, Optional, Tuple
 from bson import ObjectId
+from app.core import cache_sync
 from app.database.mongo import get_database
 from app.schemas.voucher import VoucherCreate, VoucherUpdate
 from fastapi import HTTPException, status
 
+logger = logging.getLogger(__name__)
+
+
+class VoucherCatalog:
+    """
+    Snapshot imutável do catálogo de vouchers. Cada recarga cria um novo
+    snapshot e troca a referência de uma vez: quem já pegou o anterior
+    continua lendo um estado consistente.
+    """
+
+    __slots__ = ("version", "by_id", "active", "all")
+
+    def __init__(self, version: int, vouchers: List[dict]):
+        frozen = tuple(MappingProxyType(voucher) for voucher in vouchers)
+        self.version = version
+        self.by_id: Mapping[str, Mapping] = MappingProxyType({str(voucher["_id"]): voucher for voucher in frozen})
+        self.all: Tuple[Mapping, ...] = frozen
+        self.active: Tuple[Mapping, ...] = tuple(voucher for voucher in frozen if voucher.get("active"))
+
 
 class VoucherService:
+    """
+    As leituras de vouchers vêm do catálogo em memória, recarregado quando
+    o escopo "catalog" muda (neste ou em outro worker). Os documentos
+    retornados são somente leitura.
+    """
+
+    _catalog: Optional[VoucherCatalog] = None
+    _catalog_stale: bool = True
+    _load_lock = asyncio.Lock()
+
+    @classmethod
+    async def load_catalog(cls) -> VoucherCatalog:
+        """Lê a coleção inteira e publica um novo snapshot"""
+        async with cls._load_lock:
+            # Outra corrotina pode ter recarregado enquanto esta esperava
+            if cls._catalog is not None and not cls._catalog_stale:
+                return cls._catalog
+            cls._catalog_stale = False
+            version = cache_sync.get_version("catalog")
+            try:
+                vouchers = await get_database().vouchers.find({}).to_list(length=None)
+            except Exception:
+                cls._catalog_stale = True
+                raise
+            cls._catalog = VoucherCatalog(version, vouchers)
+            return cls._catalog
+
+    @classmethod
+    async def _reload_catalog(cls) -> None:
+        cls._catalog_stale = True
+        await cls.load_catalog()
+
+    @classmethod
+    async def get_catalog(cls) -> VoucherCatalog:
+        catalog = cls._catalog
+        if catalog is None or cls._catalog_stale:
+            catalog = await cls.load_catalog()
+        return catalog
+
+    @classmethod
+    async def find_voucher(cls, voucher_id: str, active_only: bool = False) -> Optional[Mapping]:
+        """Voucher do catálogo pelo ID; None se não existir (ou inativo, com active_only)"""
+        catalog = await cls.get_catalog()
+        voucher = catalog.by_id.get(voucher_id)
+        if voucher is None or (active_only and not voucher.get("active")):
+            return None
+        return voucher
     
     @staticmethod
     async def create_voucher(voucher_data: VoucherCreate):
@@ -24,31 +94,26 @@ class VoucherService:
         
         result = await db.vouchers.insert_one(voucher_dict)
         voucher_dict["_id"] = result.inserted_id
+        await cache_sync.publish("catalog")
         
         return voucher_dict
     
-    @staticmethod
-    async def get_all_vouchers(active_only: bool = True) -> List:
+    @classmethod
+    async def get_all_vouchers(cls, active_only: bool = True) -> Tuple[Mapping, ...]:
         """Retorna todos os vouchers"""
-        db = get_database()
-        
-        query = {"active": True} if active_only else {}
-        vouchers = await db.vouchers.find(query).to_list(length=100)
-        
-        return vouchers
+        catalog = await cls.get_catalog()
+        return catalog.active if active_only else catalog.all
     
-    @staticmethod
-    async def get_voucher_by_id(voucher_id: str):
+    @classmethod
+    async def get_voucher_by_id(cls, voucher_id: str):
         """Busca um voucher pelo ID"""
-        db = get_database()
-        
         if not ObjectId.is_valid(voucher_id):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="ID do voucher inválido"
             )
         
-        voucher = await db.vouchers.find_one({"_id": ObjectId(voucher_id)})
+        voucher = await cls.find_voucher(voucher_id)
         
         if not voucher:
             raise HTTPException(
@@ -89,6 +154,7 @@ class VoucherService:
                 detail="Voucher não encontrado"
             )
         
+        await cache_sync.publish("catalog")
         return await VoucherService.get_voucher_by_id(voucher_id)
     
     @staticmethod
@@ -113,6 +179,7 @@ class VoucherService:
                 detail="Voucher não encontrado"
             )
         
+        await cache_sync.publish("catalog")
         return {"message": "Voucher desativado com sucesso"}
     
     @staticmethod
@@ -153,4 +220,8 @@ class VoucherService:
         ]
         
         await db.vouchers.insert_many(default_vouchers)
-        print("✓ Vouchers padrão inicializados")
+        await cache_sync.publish("catalog")
+        logger.info("Vouchers padrão inicializados")
+
+
+cache_sync.subscribe("catalog", VoucherService._reload_catalog)
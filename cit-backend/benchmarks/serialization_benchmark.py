@@ -0,0 +1,183 @@
+"""
+Benchmark do custo de serialização por endpoint (antes x depois)
+
+"Antes" reproduz o caminho original: modelos Pydantic montados à mão,
+revalidados pelo FastAPI contra o `response_model` e serializados com o
+encoder da stdlib (JSONResponse / jsonable_encoder). "Depois" usa os
+encoders dict -> bytes de app.core.serialization.
+
+Uso (na pasta cit-backend):
+    python -m benchmarks.serialization_benchmark [--items 100] [--rounds 200]
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import List
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from app.core.serialization import dumps, order_to_dict, payment_to_dict, voucher_to_dict
+from app.schemas.order import OrderResponse, PaymentResponse
+from app.schemas.voucher import VoucherResponse
+
+# Campos de resposta criados uma única vez, como o FastAPI faz ao registrar a rota
+VOUCHERS_FIELD = create_response_field(name="resp", type_=List[VoucherResponse], mode="serialization")
+ORDERS_FIELD = create_response_field(name="resp", type_=List[OrderResponse], mode="serialization")
+PAYMENT_FIELD = create_response_field(name="resp", type_=PaymentResponse, mode="serialization")
+
+
+def make_vouchers(n: int) -> List[dict]:
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "name": f"{i} Horas",
+            "hours": float(i),
+            "price": 5.0 * i,
+            "active": True,
+            "description": f"Pacote de {i} horas de acesso",
+            "created_at": now - timedelta(days=i)
+        }
+        for i in range(1, n + 1)
+    ]
+
+
+def make_orders(n: int) -> List[dict]:
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "user_id": str(ObjectId()),
+            "voucher_id": str(ObjectId()),
+            "payment_method": "pix",
+            "status": "paid" if i % 2 else "pending",
+            "total_amount": 10.0,
+            "voucher_hours": 3.0,
+            "voucher_name": "3 Horas",
+            "company": {"name": "CIT", "slug": "cit", "cnpj": "", "email": "", "phone": "", "address": ""},
+            "company_slug": "cit",
+            "created_at": now - timedelta(minutes=i),
+            "paid_at": now if i % 2 else None
+        }
+        for i in range(n)
+    ]
+
+
+def make_payment() -> dict:
+    return {
+        "_id": ObjectId(),
+        "order_id": str(ObjectId()),
+        "payment_method": "pix",
+        "status": "pending",
+        "amount": 10.0,
+        "pix_qrcode": "00020126" + "0" * 180,
+        "pix_key": "contato@cit.com",
+        "created_at": datetime.utcnow()
+    }
+
+
+async def legacy_vouchers(docs):
+    models = [
+        VoucherResponse(
+            id=str(v["_id"]), name=v["name"], hours=v["hours"], price=v["price"],
+            active=v["active"], description=v.get("description"), created_at=v["created_at"].isoformat()
+        )
+        for v in docs
+    ]
+    content = await serialize_response(field=VOUCHERS_FIELD, response_content=models)
+    return JSONResponse(content).body
+
+
+async def legacy_orders(docs):
+    models = [
+        OrderResponse(
+            id=str(o["_id"]), user_id=o["user_id"], voucher_id=o["voucher_id"],
+            payment_method=o["payment_method"], status=o["status"], total_amount=o["total_amount"],
+            voucher_hours=o["voucher_hours"], created_at=o["created_at"].isoformat(),
+            paid_at=o["paid_at"].isoformat() if o.get("paid_at") else None
+        )
+        for o in docs
+    ]
+    content = await serialize_response(field=ORDERS_FIELD, response_content=models)
+    return JSONResponse(content).body
+
+
+async def legacy_payment(doc):
+    model = PaymentResponse(
+        id=str(doc["_id"]), order_id=doc["order_id"], payment_method=doc["payment_method"],
+        status=doc["status"], amount=doc["amount"], pix_qrcode=doc.get("pix_qrcode"),
+        pix_key=doc.get("pix_key"), card_last_digits=doc.get("card_last_digits"),
+        created_at=doc["created_at"].isoformat()
+    )
+    content = await serialize_response(field=PAYMENT_FIELD, response_content=model)
+    return JSONResponse(content).body
+
+
+async def legacy_admin_orders(docs):
+    # Rotas admin retornavam dicts crus: jsonable_encoder + json.dumps
+    rows = []
+    for o in docs:
+        row = dict(o)
+        row["id"] = str(row.pop("_id"))
+        rows.append(row)
+    content = await serialize_response(response_content=rows)
+    return JSONResponse(content).body
+
+
+async def fast_vouchers(docs):
+    return dumps([voucher_to_dict(v) for v in docs])
+
+
+async def fast_orders(docs):
+    return dumps([order_to_dict(o) for o in docs])
+
+
+async def fast_payment(doc):
+    return dumps(payment_to_dict(doc, detailed=False))
+
+
+async def fast_admin_orders(docs):
+    rows = []
+    for o in docs:
+        row = dict(o)
+        row["id"] = str(row.pop("_id"))
+        rows.append(row)
+    return dumps(rows)
+
+
+async def measure(fn, arg, rounds: int) -> float:
+    await fn(arg)  # aquecimento
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await fn(arg)
+    return (time.perf_counter() - start) / rounds * 1_000_000
+
+
+async def main(items: int, rounds: int):
+    vouchers = make_vouchers(items)
+    orders = make_orders(items)
+    payment = make_payment()
+
+    cases = [
+        ("GET /client/vouchers", legacy_vouchers, fast_vouchers, vouchers),
+        ("GET /store/{slug}/vouchers", legacy_vouchers, fast_vouchers, vouchers),
+        ("GET /client/orders", legacy_orders, fast_orders, orders),
+        ("GET /payment/status/{id}", legacy_payment, fast_payment, payment),
+        ("GET /admin/orders", legacy_admin_orders, fast_admin_orders, orders),
+    ]
+
+    print(f"{'endpoint':<28}{'antes (µs)':>12}{'depois (µs)':>13}{'ganho':>8}")
+    for name, before, after, data in cases:
+        t_before = await measure(before, data, rounds)
+        t_after = await measure(after, data, rounds)
+        print(f"{name:<28}{t_before:>12.1f}{t_after:>13.1f}{t_before / t_after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=100, help="documentos por listagem")
+    parser.add_argument("--rounds", type=int, default=200, help="repetições por caso")
+    args = parser.parse_args()
+    asyncio.run(main(args.items, args.rounds))
@@ -0,0 +1,27 @@
+"""
+Fixtures comuns: banco em memória (mongomock-motor) no lugar do MongoDB
+
+As configurações abaixo são lidas na importação de app.core.config, então
+precisam vir antes de qualquer import da aplicação.
+"""
+import os
+
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("BACKGROUND_JOBS_ENABLED", "false")
+os.environ.setdefault("METRICS_ENABLED", "false")
+
+import asyncio
+import pytest
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+from app.core import cache_sync
+from app.database import mongo
+
+
+@pytest.fixture
+async def db(monkeypatch):
+    database = AsyncMongoMockClient()[f"cit_test_{ObjectId()}"]
+    monkeypatch.setattr(mongo, "database", database)
+    yield database
+    # Publicações agendadas (publish_nowait) terminam antes de o banco sair
+    await asyncio.gather(*cache_sync._pending, return_exceptions=True)
@@ -0,0 +1,75 @@
+import asyncio
+from bson import ObjectId
+from app.database.mongo import _ensure_access_code_order_index
+from app.services.access_code_service import AccessCodeService
+
+
+def _order(hours: float = 2.0) -> dict:
+    return {"_id": ObjectId(), "user_id": str(ObjectId()), "voucher_id": "v1", "voucher_hours": hours}
+
+
+async def _pool(db, size: int) -> None:
+    await db.access_codes.create_index("code", unique=True)
+    await _ensure_access_code_order_index()
+    await AccessCodeService.generate_batch(size)
+
+
+async def test_concurrent_claims_for_one_order_issue_one_code(db):
+    await _pool(db, 10)
+    order = _order()
+
+    codes = await asyncio.gather(*(AccessCodeService.claim(order) for _ in range(5)))
+
+    assert len(set(codes)) == 1
+    assert await db.access_codes.count_documents({"order_id": str(order["_id"])}) == 1
+    assert await db.access_codes.count_documents({"status": "available"}) == 9
+
+
+async def test_claim_losing_the_race_returns_the_winner_code(db, monkeypatch):
+    await _pool(db, 10)
+    order = _order()
+    winner = await AccessCodeService.claim(order)
+
+    # Leitura feita antes de a confirmação concorrente gravar: não vê o código dela
+    lookups = []
+    original = AccessCodeService.find_by_order
+
+    async def stale_lookup(order_id):
+        lookups.append(order_id)
+        return None if len(lookups) == 1 else await original(order_id)
+
+    monkeypatch.setattr(AccessCodeService, "find_by_order", staticmethod(stale_lookup))
+
+    assert await AccessCodeService.claim(order) == winner
+    assert await db.access_codes.count_documents({"order_id": str(order["_id"])}) == 1
+    assert await db.access_codes.count_documents({"status": "available"}) == 9
+
+
+async def test_claim_many_writes_each_code_in_one_update(db):
+    await _pool(db, 5)
+    orders = [_order(hours=index + 1) for index in range(3)]
+
+    codes = await AccessCodeService.claim_many(orders)
+
+    assert len(set(codes.values())) == 3
+    for order in orders:
+        doc = await db.access_codes.find_one({"code": codes[str(order["_id"])]})
+        assert doc["status"] == "issued"
+        assert doc["order_id"] == str(order["_id"])
+        assert doc["hours"] == order["voucher_hours"]
+    # Nenhum código emitido sem pedido/horas
+    assert await db.access_codes.count_documents({"status": "issued", "hours": {"$exists": False}}) == 0
+
+    # Entrega repetida (retry após queda) devolve os mesmos códigos
+    assert await AccessCodeService.claim_many(orders) == codes
+    assert await db.access_codes.count_documents({"status": "issued"}) == 3
+
+
+async def test_claim_many_falls_back_to_generated_codes(db):
+    await _pool(db, 1)
+    orders = [_order() for _ in range(3)]
+
+    codes = await AccessCodeService.claim_many(orders)
+
+    assert len(set(codes.values())) == 3
+    assert await db.access_codes.count_documents({"status": "issued"}) == 3
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from bson import ObjectId
+from app.services import archive_service
+from app.services.archive_service import ArchiveService
+
+
+@pytest.fixture(autouse=True)
+def archive_state(monkeypatch):
+    monkeypatch.setattr(ArchiveService, "_archived_before", None)
+    monkeypatch.setattr(ArchiveService, "_state_loaded", False)
+    ArchiveService._summaries.clear()
+
+
+def _days_ago(days: int) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+async def _order(db, status: str, created_at: datetime, user_id: str = "u1") -> ObjectId:
+    order_id = ObjectId()
+    await db.orders.insert_one({"_id": order_id, "user_id": user_id, "status": status, "created_at": created_at})
+    await db.payments.insert_one({"order_id": str(order_id), "status": status})
+    return order_id
+
+
+async def test_run_moves_old_finished_orders_with_their_payments(db):
+    old_paid = await _order(db, "paid", _days_ago(800))
+    old_expired = await _order(db, "expired", _days_ago(700))
+    old_pending = await _order(db, "pending", _days_ago(700))
+    recent = await _order(db, "paid", _days_ago(10))
+
+    await ArchiveService.run()
+
+    assert set(await db.orders.distinct("_id")) == {old_pending, recent}
+    assert set(await db.orders_archive.distinct("_id")) == {old_paid, old_expired}
+    assert set(await db.payments_archive.distinct("order_id")) == {str(old_paid), str(old_expired)}
+    assert set(await db.payments.distinct("order_id")) == {str(old_pending), str(recent)}
+    assert await ArchiveService.archived_before() is not None
+    # Leituras pelo ID alcançam o arquivo
+    assert (await ArchiveService.find_order(old_paid))["status"] == "paid"
+    assert (await ArchiveService.find_payment(str(old_paid)))["status"] == "paid"
+
+
+async def test_run_ignores_copies_left_by_an_interrupted_round(db):
+    order_id = await _order(db, "paid", _days_ago(800))
+    await db.orders_archive.insert_one(await db.orders.find_one({"_id": order_id}))
+
+    await ArchiveService.run()
+
+    assert await db.orders.count_documents({}) == 0
+    assert await db.orders_archive.count_documents({"_id": order_id}) == 1
+
+
+async def test_order_changed_during_the_move_stays_hot(db, monkeypatch):
+    refunded = await _order(db, "paid", _days_ago(800))
+    moved = await _order(db, "paid", _days_ago(790))
+    insert = archive_service._insert_ignoring_duplicates
+
+    async def insert_then_refund(collection, docs):
+        await insert(collection, docs)
+        if collection.name == "orders_archive":
+            # Estorno que chega depois da cópia e antes da remoção
+            await db.orders.update_one({"_id": refunded}, {"$set": {"status": "refunded"}})
+
+    monkeypatch.setattr(archive_service, "_insert_ignoring_duplicates", insert_then_refund)
+
+    await ArchiveService.run()
+
+    assert (await db.orders.find_one({"_id": refunded}))["status"] == "refunded"
+    assert await db.orders_archive.count_documents({"_id": refunded}) == 0
+    assert await db.payments.count_documents({"order_id": str(refunded)}) == 1
+    assert await db.payments_archive.count_documents({"order_id": str(refunded)}) == 0
+    assert await db.orders_archive.count_documents({"_id": moved}) == 1
+    assert await db.payments.count_documents({"order_id": str(moved)}) == 0
+
+
+async def test_find_orders_merges_hot_and_archived_history(db):
+    created = [_days_ago(900), _days_ago(800), _days_ago(20), _days_ago(10)]
+    ids = [await _order(db, "paid", when) for when in created]
+    await ArchiveService.run()
+    assert await db.orders_archive.count_documents({}) == 2
+
+    orders = await ArchiveService.find_orders({"user_id": "u1"}, limit=10)
+    assert [order["_id"] for order in orders] == list(reversed(ids))
+
+    # Página que ainda cabe só na coleção quente
+    page = await ArchiveService.find_orders({"user_id": "u1"}, limit=2)
+    assert [order["_id"] for order in page] == [ids[3], ids[2]]
+    # Página que atravessa para o arquivo
+    page = await ArchiveService.find_orders({"user_id": "u1"}, skip=1, limit=2)
+    assert [order["_id"] for order in page] == [ids[2], ids[1]]
+    # Período recente: o arquivo não entra
+    recent = await ArchiveService.find_orders({"user_id": "u1"}, since=_days_ago(30), limit=10)
+    assert [order["_id"] for order in recent] == [ids[3], ids[2]]
@@ -0,0 +1,69 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from app.routes.auth import get_current_admin, get_current_principal
+from app.schemas.user import UserCreate, UserLogin
+from app.services.auth_service import AuthService
+
+
+async def _principal(access_token: str) -> dict:
+    return await get_current_principal(HTTPAuthorizationCredentials(scheme="Bearer", credentials=access_token))
+
+
+async def _register(role: str = "client", password: str = "senha-antiga") -> dict:
+    user = await AuthService.register_user(UserCreate(name="Ana", email="ana@example.com", password=password, role=role))
+    session = await AuthService.authenticate_user(UserLogin(email="ana@example.com", password=password))
+    return {"user": user, **session}
+
+
+async def test_demoted_admin_loses_admin_access(db):
+    session = await _register(role="admin")
+    principal = await _principal(session["access_token"])
+    assert (await get_current_admin(principal))["role"] == "admin"
+
+    await AuthService.set_role(str(session["user"]["_id"]), "client")
+
+    # O token antigo (emitido como admin) não vale mais
+    with pytest.raises(HTTPException) as error:
+        await _principal(session["access_token"])
+    assert error.value.status_code == 401
+
+    # Nem o refresh token da sessão antiga
+    with pytest.raises(HTTPException):
+        await AuthService.refresh_session(session["refresh_token"])
+
+    # Um login novo traz o papel atual
+    fresh = await AuthService.authenticate_user(UserLogin(email="ana@example.com", password="senha-antiga"))
+    principal = await _principal(fresh["access_token"])
+    assert principal["role"] == "client"
+    with pytest.raises(HTTPException) as error:
+        await get_current_admin(principal)
+    assert error.value.status_code == 403
+
+
+async def test_password_change_invalidates_previous_tokens(db):
+    session = await _register()
+    user_id = str(session["user"]["_id"])
+
+    with pytest.raises(HTTPException) as error:
+        await AuthService.change_password(user_id, "errada", "senha-nova")
+    assert error.value.status_code == 401
+
+    fresh = await AuthService.change_password(user_id, "senha-antiga", "senha-nova")
+
+    with pytest.raises(HTTPException):
+        await _principal(session["access_token"])
+    with pytest.raises(HTTPException):
+        await AuthService.refresh_session(session["refresh_token"])
+
+    assert str((await _principal(fresh["access_token"]))["_id"]) == user_id
+    with pytest.raises(HTTPException):
+        await AuthService.authenticate_user(UserLogin(email="ana@example.com", password="senha-antiga"))
+    await AuthService.authenticate_user(UserLogin(email="ana@example.com", password="senha-nova"))
+
+
+async def test_invalid_role_is_rejected(db):
+    session = await _register()
+    with pytest.raises(HTTPException) as error:
+        await AuthService.set_role(str(session["user"]["_id"]), "root")
+    assert error.value.status_code == 400
@@ -0,0 +1,63 @@
+import asyncio
+from app.core import cache_sync
+from app.services import auth_service
+from app.services.auth_service import AuthService
+
+
+def _subscribe(monkeypatch, scope: str):
+    calls = {"keys": [], "full": 0}
+
+    def on_keys(keys):
+        calls["keys"].append(list(keys))
+
+    def on_full():
+        calls["full"] += 1
+
+    monkeypatch.setitem(cache_sync._key_handlers, scope, [on_keys])
+    monkeypatch.setitem(cache_sync._handlers, scope, [on_full])
+    return calls
+
+
+async def test_other_workers_drop_only_published_keys(db, monkeypatch):
+    calls = _subscribe(monkeypatch, "users-test")
+
+    await cache_sync.publish_keys("users-test", ["a"])
+    await cache_sync.publish_keys("users-test", ["b"])
+    assert calls == {"keys": [["a"], ["b"]], "full": 0}
+
+    # Outro worker, que ainda não viu nenhuma das duas versões
+    monkeypatch.setitem(cache_sync._known_versions, "users-test", 0)
+    await cache_sync.poll_once()
+    assert calls["keys"][-1] == ["a", "b"]
+    assert calls["full"] == 0
+
+
+async def test_version_without_keys_falls_back_to_full_invalidation(db, monkeypatch):
+    calls = _subscribe(monkeypatch, "users-test")
+
+    await cache_sync.publish_keys("users-test", ["a"])
+    await cache_sync.publish("users-test")
+    monkeypatch.setitem(cache_sync._known_versions, "users-test", 0)
+    await cache_sync.poll_once()
+    assert calls["full"] == 2  # o publish local e o polling
+
+
+async def test_invalidations_in_the_same_tick_are_coalesced(db, monkeypatch):
+    monkeypatch.setitem(cache_sync._known_versions, "users", 0)
+    for user_id in ("u1", "u2", "u1"):
+        AuthService.invalidate_user(user_id)
+    await asyncio.gather(*cache_sync._pending)
+
+    docs = await db.cache_invalidations.find({}).to_list(length=None)
+    assert [doc["keys"] for doc in docs] == [["u1", "u2"]]
+
+
+async def test_keyed_poll_keeps_other_users_cached(db, monkeypatch):
+    cache = auth_service._user_cache
+    monkeypatch.setattr(auth_service, "_user_cache", type(cache)(maxsize=10, ttl=60))
+    auth_service._user_cache.set("u1", {"name": "um"})
+    auth_service._user_cache.set("u2", {"name": "dois"})
+
+    await cache_sync.publish_keys("users", ["u1"])
+    assert auth_service._user_cache.get("u1") is None
+    assert auth_service._user_cache.get("u2") is not None
@@ -0,0 +1,39 @@
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+from app.core import http_cache
+
+app = FastAPI()
+
+
+@app.get("/items/{slug}")
+async def get_item(slug: str, request: Request):
+    async def build():
+        if slug != "loja":
+            raise HTTPException(status_code=404, detail="Empresa não encontrada")
+        return {"slug": slug, "description": "x" * 4096}
+
+    return await http_cache.cached_json_response(request, ("company",), build)
+
+
+client = TestClient(app)
+
+
+def test_encodings_share_a_weak_etag():
+    identity = client.get("/items/loja", headers={"Accept-Encoding": "identity"})
+    gzip = client.get("/items/loja", headers={"Accept-Encoding": "gzip"})
+
+    assert gzip.headers["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in identity.headers
+    assert identity.headers["ETag"].startswith('W/"')
+    assert identity.headers["ETag"] == gzip.headers["ETag"]
+
+    # Revalidação com o ETag de qualquer representação
+    revalidated = client.get(
+        "/items/loja", headers={"Accept-Encoding": "identity", "If-None-Match": gzip.headers["ETag"]}
+    )
+    assert revalidated.status_code == 304
+
+
+def test_wildcard_only_matches_existing_resources():
+    assert client.get("/items/loja", headers={"If-None-Match": "*"}).status_code == 304
+    assert client.get("/items/outra", headers={"If-None-Match": "*"}).status_code == 404
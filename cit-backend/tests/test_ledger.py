@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from app.core.config import settings
+from app.services.access_code_service import AccessCodeService
+from app.services.ledger_service import LedgerService, _apply_filter, _apply_update, _entry
+
+
+@pytest.fixture(autouse=True)
+async def ledger(db, monkeypatch):
+    await db.hours_ledger.create_index("idempotency_key", unique=True)
+    monkeypatch.setattr(LedgerService, "_balances_opened", False)
+
+
+async def _user(db, balance: float = 0.0, **fields) -> str:
+    user_id = ObjectId()
+    await db.users.insert_one({"_id": user_id, "email": f"{user_id}@cit.com", "hours_balance": balance, **fields})
+    return str(user_id)
+
+
+async def _balance(db, user_id: str) -> float:
+    return (await db.users.find_one({"_id": ObjectId(user_id)}))["hours_balance"]
+
+
+async def test_record_is_idempotent_by_key(db):
+    user_id = await _user(db, ledger_opened=True)
+
+    assert await LedgerService.record(user_id, 2.0, "purchase", "order:1") == 2.0
+    assert await LedgerService.record(user_id, 2.0, "purchase", "order:1") is None
+
+    assert await _balance(db, user_id) == 2.0
+    assert await db.hours_ledger.count_documents({"user_id": user_id}) == 1
+
+
+async def test_set_balance_rejects_stale_expected_balance(db):
+    user_id = await _user(db, ledger_opened=True)
+    await LedgerService.record(user_id, 3.0, "purchase", "order:1")
+
+    with pytest.raises(HTTPException) as error:
+        await LedgerService.set_balance(user_id, 10.0, expected=0.0)
+
+    assert error.value.status_code == 409
+    assert await _balance(db, user_id) == 3.0
+    assert await LedgerService.set_balance(user_id, 10.0, expected=3.0) == 10.0
+    assert (await LedgerService.statement(user_id))["drift"] == 0
+
+
+async def test_opening_balance_explains_legacy_balance(db):
+    # Saldo de antes do livro (8h) mais uma compra já registrada nele
+    user_id = await _user(db, balance=8.0)
+    await LedgerService.record(user_id, 2.0, "purchase", "order:1")
+    assert (await LedgerService.statement(user_id))["drift"] == 8.0
+
+    assert await LedgerService.open_balances() == 1
+
+    statement = await LedgerService.statement(user_id)
+    assert statement["drift"] == 0
+    assert statement["hours_balance"] == 10.0
+    opening = await db.hours_ledger.find_one({"idempotency_key": f"opening:{user_id}"})
+    assert opening["amount"] == 8.0 and opening["applied"]
+    # Uma vez só
+    assert await LedgerService.open_balances() == 0
+    assert LedgerService._balances_opened
+
+
+async def test_opening_balance_is_discarded_if_balance_moves(db):
+    user_id = await _user(db, balance=5.0)
+    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    # Crédito que entra entre a leitura e o compare-and-set
+    await LedgerService.record(user_id, 1.0, "purchase", "order:1")
+
+    assert not await LedgerService._open_balance(db, user)
+    assert await db.hours_ledger.count_documents({"idempotency_key": f"opening:{user_id}"}) == 0
+
+    await LedgerService.open_balances()
+    assert (await LedgerService.statement(user_id))["drift"] == 0
+
+
+async def test_compact_reapplies_stuck_entries(db):
+    user_id = await _user(db, ledger_opened=True)
+    # Queda depois de gravar a entrada e antes de aplicar no usuário
+    entry = _entry(user_id, 4.0, "purchase", "order:stuck", None, datetime.now(timezone.utc) - timedelta(hours=1))
+    await db.hours_ledger.insert_one(entry)
+
+    await LedgerService.compact()
+    await LedgerService.compact()
+
+    assert await _balance(db, user_id) == 4.0
+    assert (await db.hours_ledger.find_one({"_id": entry["_id"]}))["applied"]
+
+
+async def test_compact_does_not_reapply_landed_entry_pushed_out_of_recent_keys(db):
+    user_id = await _user(db, ledger_opened=True)
+    # Queda depois do $inc e antes de marcar a entrada
+    entry = _entry(user_id, 4.0, "purchase", "order:stuck", None, datetime.now(timezone.utc) - timedelta(hours=1))
+    await db.hours_ledger.insert_one(entry)
+    await db.users.update_one(_apply_filter(entry), _apply_update(entry, datetime.now(timezone.utc)))
+    # Consumo de um usuário ativo: mais chaves que LEDGER_RECENT_KEYS até o compactador passar
+    for flush in range(settings.LEDGER_RECENT_KEYS + 10):
+        await LedgerService.record_many(
+            [{"user_id": user_id, "amount": -0.01, "kind": "usage", "key": f"usage:{flush}:{user_id}"}]
+        )
+    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    assert "order:stuck" not in user["ledger_recent"]
+
+    await LedgerService.compact()
+
+    assert await _balance(db, user_id) == pytest.approx(4.0 - 0.01 * (settings.LEDGER_RECENT_KEYS + 10))
+    assert (await db.hours_ledger.find_one({"_id": entry["_id"]}))["applied"]
+    assert (await db.users.find_one({"_id": ObjectId(user_id)}))["ledger_unmarked"] == []
+
+
+async def test_interrupted_redeem_is_credited_by_reconciliation(db, monkeypatch):
+    user_id = await _user(db, ledger_opened=True)
+    await AccessCodeService.generate_batch(1)
+    order = {"_id": ObjectId(), "user_id": user_id, "voucher_id": "v1", "voucher_hours": 3.0}
+    code = await AccessCodeService.claim(order)
+
+    async def crash(*args, **kwargs):
+        raise RuntimeError("queda do worker")
+
+    record = LedgerService.record
+    monkeypatch.setattr(LedgerService, "record", staticmethod(crash))
+    with pytest.raises(RuntimeError):
+        await AccessCodeService.redeem(code, user_id)
+    monkeypatch.setattr(LedgerService, "record", staticmethod(record))
+
+    assert await _balance(db, user_id) == 0.0
+    # Dentro da tolerância o resgate pode estar em andamento
+    assert await AccessCodeService.reconcile_redeemed() == 0
+    await db.access_codes.update_one(
+        {"code": code}, {"$set": {"redeemed_at": datetime.now(timezone.utc) - timedelta(hours=1)}}
+    )
+
+    assert await AccessCodeService.reconcile_redeemed() == 1
+    assert await AccessCodeService.reconcile_redeemed() == 0
+    assert await _balance(db, user_id) == 3.0
+    assert "credit_pending" not in await db.access_codes.find_one({"code": code})
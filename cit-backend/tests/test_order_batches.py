@@ -0,0 +1,222 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import httpx
+import json
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from app.routes import payment, webhooks
+from app.services.mercadopago_service import MercadoPagoService
+from app.services.order_batch_service import OrderBatchService
+from app.services.payment_service import PaymentService
+
+
+async def _user(db) -> str:
+    user_id = ObjectId()
+    await db.users.insert_one({"_id": user_id, "email": f"{user_id}@cit.com", "hours_balance": 0.0})
+    return str(user_id)
+
+
+async def _batch(db, user_id: str, units: int = 3, hours: float = 2.0, **fields) -> dict:
+    batch_id = ObjectId()
+    order_ids = [ObjectId() for _ in range(units)]
+    batch = {
+        "_id": batch_id,
+        "user_id": user_id,
+        "status": "pending",
+        "payment_method": "pix",
+        "fulfillment": "balance",
+        "items": [{"voucher_id": "v1", "quantity": units, "order_ids": [str(order_id) for order_id in order_ids]}],
+        "total_orders": units,
+        "total_amount": 5.0 * units,
+        "total_hours": hours * units,
+        "created_at": datetime.now(timezone.utc),
+        "paid_at": None,
+        "payment": {"mercadopago_order_id": "mp-1"}
+    }
+    batch.update(fields)
+    await db.order_batches.insert_one(batch)
+    await db.orders.insert_many([
+        {
+            "_id": order_id,
+            "user_id": user_id,
+            "voucher_id": "v1",
+            "status": "pending",
+            "total_amount": 5.0,
+            "voucher_hours": hours,
+            "fulfillment": "balance",
+            "batch_id": str(batch_id),
+            "created_at": batch["created_at"]
+        }
+        for order_id in order_ids
+    ])
+    return batch
+
+
+async def _balance(db, user_id: str) -> float:
+    return (await db.users.find_one({"_id": ObjectId(user_id)}))["hours_balance"]
+
+
+def _mp_status(monkeypatch, result):
+    async def check_payment_status(external_reference):
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(MercadoPagoService, "check_payment_status", staticmethod(check_payment_status))
+
+
+async def test_confirm_rejects_charge_not_approved_by_mercadopago(db, monkeypatch):
+    user_id = await _user(db)
+    batch = await _batch(db, user_id)
+    _mp_status(monkeypatch, {"status": "pending"})
+
+    with pytest.raises(HTTPException) as error:
+        await OrderBatchService.confirm_batch(str(batch["_id"]), user_id)
+
+    assert error.value.status_code == 400
+    assert (await db.order_batches.find_one({"_id": batch["_id"]}))["status"] == "pending"
+    assert await db.orders.count_documents({"batch_id": str(batch["_id"]), "status": "paid"}) == 0
+    assert await _balance(db, user_id) == 0.0
+
+
+async def test_confirm_keeps_batch_pending_when_mercadopago_is_unreachable(db, monkeypatch):
+    user_id = await _user(db)
+    batch = await _batch(db, user_id)
+
+    def unreachable(request):
+        raise httpx.ConnectError("sem rota", request=request)
+
+    monkeypatch.setenv("MERCADOPAGO_ACCESS_TOKEN", "token")
+    monkeypatch.setattr(
+        MercadoPagoService, "get_http_client",
+        staticmethod(lambda: httpx.AsyncClient(transport=httpx.MockTransport(unreachable)))
+    )
+
+    with pytest.raises(HTTPException) as error:
+        await OrderBatchService.confirm_batch(str(batch["_id"]), user_id)
+
+    assert error.value.status_code == 400
+    assert (await db.order_batches.find_one({"_id": batch["_id"]}))["status"] == "pending"
+    assert await _balance(db, user_id) == 0.0
+
+
+async def test_concurrent_mark_paid_credits_once(db):
+    user_id = await _user(db)
+    batch = await _batch(db, user_id)
+
+    results = await asyncio.gather(*(OrderBatchService.mark_paid(str(batch["_id"])) for _ in range(4)))
+
+    assert sum(result is not None for result in results) == 1
+    assert await _balance(db, user_id) == 6.0
+    assert await db.hours_ledger.count_documents({"user_id": user_id}) == 1
+    stored = await db.order_batches.find_one({"_id": batch["_id"]})
+    assert stored["fulfilled_at"] is not None
+
+
+async def test_recovery_completes_paid_batch_left_unfulfilled(db):
+    user_id = await _user(db)
+    # Queda entre a transição para "paid" e a entrega
+    paid_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    batch = await _batch(db, user_id, status="paid", paid_at=paid_at)
+    recent = await _batch(db, user_id, status="paid", paid_at=datetime.now(timezone.utc))
+
+    assert await OrderBatchService.recover_unfulfilled() == 1
+
+    assert await db.orders.count_documents({"batch_id": str(batch["_id"]), "status": "paid"}) == 3
+    assert (await db.order_batches.find_one({"_id": batch["_id"]})).get("fulfilled_at") is not None
+    # Dentro da tolerância: a confirmação pode estar em andamento
+    assert (await db.order_batches.find_one({"_id": recent["_id"]})).get("fulfilled_at") is None
+    assert await _balance(db, user_id) == 6.0
+    assert await OrderBatchService.recover_unfulfilled() == 0
+
+
+async def test_repeated_approved_webhook_fulfills_order_once(db, monkeypatch):
+    user_id = await _user(db)
+    order_id = ObjectId()
+    await db.orders.insert_one({
+        "_id": order_id,
+        "user_id": user_id,
+        "voucher_id": "v1",
+        "status": "pending",
+        "voucher_hours": 3.0,
+        "fulfillment": "balance",
+        "created_at": datetime.now(timezone.utc)
+    })
+    notifications = {"status": "approved"}
+
+    async def get_payment(payment_id):
+        return {"status": notifications["status"], "external_reference": str(order_id)}
+
+    fulfilled = []
+    fulfill_order = PaymentService.fulfill_order
+
+    async def counting_fulfill(order):
+        fulfilled.append(order["_id"])
+        return await fulfill_order(order)
+
+    monkeypatch.setattr(MercadoPagoService, "get_payment", staticmethod(get_payment))
+    monkeypatch.setattr(PaymentService, "fulfill_order", staticmethod(counting_fulfill))
+
+    await webhooks.process_payment_notification("123")
+    await webhooks.process_payment_notification("123")
+    # Notificação "pending" atrasada não rebaixa o pedido pago
+    notifications["status"] = "pending"
+    await webhooks.process_payment_notification("122")
+
+    order = await db.orders.find_one({"_id": order_id})
+    assert fulfilled == [order_id]
+    assert order["status"] == "paid"
+    assert "fulfillment_pending" not in order
+    assert await _balance(db, user_id) == 3.0
+
+
+async def test_recovery_fulfills_paid_order_left_pending(db):
+    user_id = await _user(db)
+    order_id = ObjectId()
+    await db.orders.insert_one({
+        "_id": order_id,
+        "user_id": user_id,
+        "voucher_id": "v1",
+        "status": "paid",
+        "paid_at": datetime.now(timezone.utc) - timedelta(hours=1),
+        "fulfillment_pending": True,
+        "voucher_hours": 3.0,
+        "fulfillment": "balance",
+        "created_at": datetime.now(timezone.utc) - timedelta(hours=2)
+    })
+
+    assert await PaymentService.recover_unfulfilled() == 1
+    assert "fulfillment_pending" not in await db.orders.find_one({"_id": order_id})
+    assert await _balance(db, user_id) == 3.0
+    assert await PaymentService.recover_unfulfilled() == 0
+
+
+async def test_status_of_pix_not_yet_approved_returns_pending_payment(db, monkeypatch):
+    user_id = await _user(db)
+    order_id = ObjectId()
+    await db.orders.insert_one({
+        "_id": order_id,
+        "user_id": user_id,
+        "voucher_id": "v1",
+        "status": "pending",
+        "voucher_hours": 3.0,
+        "fulfillment": "balance",
+        "created_at": datetime.now(timezone.utc)
+    })
+    await db.payments.insert_one({
+        "order_id": str(order_id),
+        "payment_method": "pix",
+        "status": "pending",
+        "amount": 5.0,
+        "mercadopago_order_id": "mp-1",
+        "created_at": datetime.now(timezone.utc)
+    })
+    _mp_status(monkeypatch, {"status": "pending"})
+
+    response = await payment.get_payment_status(str(order_id), current_user={"id": user_id})
+
+    assert response.status_code == 200
+    assert json.loads(response.body)["status"] == "pending"
+    assert (await db.orders.find_one({"_id": order_id}))["status"] == "pending"
+    assert await _balance(db, user_id) == 0.0
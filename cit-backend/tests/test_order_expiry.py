@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from bson import ObjectId
+from app.routes import webhooks
+from app.services.mercadopago_service import MercadoPagoService
+from app.services.order_expiry_service import OrderExpiryService
+
+
+@pytest.fixture
+def cancelled(monkeypatch):
+    """Ordens canceladas no Mercado Pago (sem chamadas reais)"""
+    calls = []
+
+    async def cancel_order(mp_order_id):
+        calls.append(mp_order_id)
+        return True
+
+    monkeypatch.setattr(MercadoPagoService, "has_access_token", staticmethod(lambda: True))
+    monkeypatch.setattr(MercadoPagoService, "cancel_order", staticmethod(cancel_order))
+    return calls
+
+
+def _stale() -> datetime:
+    return OrderExpiryService.cutoff(datetime.now(timezone.utc)) - timedelta(minutes=1)
+
+
+async def _order(db, status: str = "pending", created_at=None, **fields) -> ObjectId:
+    order_id = ObjectId()
+    await db.orders.insert_one({
+        "_id": order_id,
+        "user_id": str(ObjectId()),
+        "voucher_id": "v1",
+        "status": status,
+        "voucher_hours": 2.0,
+        "fulfillment": "balance",
+        "created_at": created_at or _stale(),
+        **fields
+    })
+    return order_id
+
+
+async def _status(collection, doc_id) -> str:
+    return (await collection.find_one({"_id": doc_id}))["status"]
+
+
+async def test_expires_stale_pending_orders_only(db, cancelled):
+    stale = await _order(db)
+    await db.payments.insert_one({"order_id": str(stale), "status": "pending", "mercadopago_order_id": "mp-stale"})
+    recent = await _order(db, created_at=datetime.now(timezone.utc))
+    paid = await _order(db, status="paid")
+
+    totals = await OrderExpiryService.expire_stale()
+
+    assert totals == {"orders": 1, "batches": 0, "cancelled": 1}
+    assert await _status(db.orders, stale) == "expired"
+    assert (await db.payments.find_one({"order_id": str(stale)}))["status"] == "expired"
+    assert await _status(db.orders, recent) == "pending"
+    assert await _status(db.orders, paid) == "paid"
+    assert cancelled == ["mp-stale"]
+    # Nada mais a expirar
+    assert await OrderExpiryService.expire_stale() == {"orders": 0, "batches": 0, "cancelled": 0}
+
+
+async def test_expires_batch_with_its_orders(db, cancelled):
+    batch_id = ObjectId()
+    await db.order_batches.insert_one({
+        "_id": batch_id, "status": "pending", "created_at": _stale(), "payment": {"mercadopago_order_id": "mp-batch"}
+    })
+    orders = [await _order(db, batch_id=str(batch_id)) for _ in range(3)]
+    paid_batch = ObjectId()
+    await db.order_batches.insert_one({"_id": paid_batch, "status": "paid", "created_at": _stale()})
+
+    totals = await OrderExpiryService.expire_stale()
+
+    assert totals == {"orders": 3, "batches": 1, "cancelled": 1}
+    assert await _status(db.order_batches, batch_id) == "expired"
+    assert [await _status(db.orders, order_id) for order_id in orders] == ["expired"] * 3
+    assert await _status(db.order_batches, paid_batch) == "paid"
+    assert cancelled == ["mp-batch"]
+
+
+async def test_expired_order_still_accepts_approved_payment(db, cancelled, monkeypatch):
+    user_id = ObjectId()
+    await db.users.insert_one({"_id": user_id, "hours_balance": 0.0, "ledger_opened": True})
+    order_id = await _order(db, user_id=str(user_id))
+    await OrderExpiryService.expire_stale()
+    notification = {}
+
+    async def get_payment(payment_id):
+        return {"status": notification["status"], "external_reference": str(order_id)}
+
+    monkeypatch.setattr(MercadoPagoService, "get_payment", staticmethod(get_payment))
+
+    # A notificação do próprio cancelamento não mexe no pedido expirado
+    notification["status"] = "cancelled"
+    await webhooks.process_payment_notification("1")
+    assert await _status(db.orders, order_id) == "expired"
+
+    notification["status"] = "approved"
+    await webhooks.process_payment_notification("2")
+    assert await _status(db.orders, order_id) == "paid"
+    assert (await db.users.find_one({"_id": user_id}))["hours_balance"] == 2.0
@@ -0,0 +1,95 @@
+import asyncio
+import secrets
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from app.core.config import settings
+from app.services.access_code_service import ALPHABET, AccessCodeFilter, AccessCodeService, format_code
+
+
+@pytest.fixture(autouse=True)
+async def portal(db, monkeypatch):
+    await db.access_codes.create_index("code", unique=True)
+    await db.hours_ledger.create_index("idempotency_key", unique=True)
+    # Filtro por teste: o estado de classe não passa de um banco para outro
+    monkeypatch.setattr(AccessCodeFilter, "_filter", None)
+    monkeypatch.setattr(AccessCodeFilter, "_last_id", None)
+
+
+async def _user(db) -> str:
+    user_id = ObjectId()
+    await db.users.insert_one({"_id": user_id, "email": f"{user_id}@cit.com", "hours_balance": 0.0, "ledger_opened": True})
+    return str(user_id)
+
+
+async def _issued_code(user_id: str, hours: float = 3.0) -> str:
+    await AccessCodeService.generate_batch(1)
+    return await AccessCodeService.claim({"_id": ObjectId(), "user_id": user_id, "voucher_id": "v1", "voucher_hours": hours})
+
+
+async def _balance(db, user_id: str) -> float:
+    return (await db.users.find_one({"_id": ObjectId(user_id)}))["hours_balance"]
+
+
+async def test_redeem_credits_once(db):
+    user_id = await _user(db)
+    code = await _issued_code(user_id)
+
+    # Aceita o formato de exibição, em minúsculas
+    result = await AccessCodeService.redeem(format_code(code).lower(), user_id)
+    assert result["hours_added"] == 3.0
+    assert result["hours_balance"] == 3.0
+
+    with pytest.raises(HTTPException) as error:
+        await AccessCodeService.redeem(code, user_id)
+    assert error.value.status_code == 404
+    assert await _balance(db, user_id) == 3.0
+
+
+async def test_concurrent_redeems_credit_once(db):
+    user_id = await _user(db)
+    other_id = await _user(db)
+    code = await _issued_code(user_id)
+
+    results = await asyncio.gather(
+        AccessCodeService.redeem(code, user_id),
+        AccessCodeService.redeem(code, other_id),
+        return_exceptions=True
+    )
+
+    assert sum(not isinstance(result, Exception) for result in results) == 1
+    assert await _balance(db, user_id) + await _balance(db, other_id) == 3.0
+
+
+async def test_code_still_in_stock_is_rejected(db):
+    user_id = await _user(db)
+    await AccessCodeService.generate_batch(1)
+    code = (await db.access_codes.find_one({"status": "available"}))["code"]
+
+    with pytest.raises(HTTPException) as error:
+        await AccessCodeService.redeem(code, user_id)
+
+    assert error.value.status_code == 404
+    assert (await db.access_codes.find_one({"code": code}))["status"] == "available"
+    assert await _balance(db, user_id) == 0.0
+
+
+async def test_codes_outside_the_filter_are_rejected_without_the_database(db):
+    user_id = await _user(db)
+    await AccessCodeFilter.rebuild()
+
+    # Emitido depois da carga do filtro, por outro worker: o banco aceitaria,
+    # mas o filtro ainda não o conhece
+    code = "".join(secrets.choice(ALPHABET) for _ in range(settings.ACCESS_CODE_LENGTH))
+    await db.access_codes.insert_one(
+        {"code": code, "status": "issued", "order_id": str(ObjectId()), "user_id": user_id, "hours": 3.0}
+    )
+    assert not AccessCodeFilter.might_exist(code)
+    with pytest.raises(HTTPException) as error:
+        await AccessCodeService.redeem(code, user_id)
+    assert error.value.status_code == 404
+    assert (await db.access_codes.find_one({"code": code}))["status"] == "issued"
+
+    # O refresh periódico traz os códigos novos
+    await AccessCodeFilter.refresh()
+    assert (await AccessCodeService.redeem(code, user_id))["hours_added"] == 3.0
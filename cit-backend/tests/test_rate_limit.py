@@ -0,0 +1,72 @@
+from app.core.config import settings
+from app.core.rate_limit import RateLimitMiddleware, RateLimitRule, get_client_ip
+
+
+def _scope(path: str = "/auth/login", client: str = "10.0.0.1", forwarded_for: str = None) -> dict:
+    headers = []
+    if forwarded_for is not None:
+        headers.append((b"x-forwarded-for", forwarded_for.encode()))
+    return {"type": "http", "method": "POST", "path": path, "headers": headers, "client": (client, 1234)}
+
+
+async def _call(middleware, scope) -> int:
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    await middleware(scope, receive, send)
+    return next(message["status"] for message in sent if message["type"] == "http.response.start")
+
+
+async def _app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def _middleware(capacity: int = 3) -> RateLimitMiddleware:
+    return RateLimitMiddleware(_app, rules=[RateLimitRule("login", "POST", "/auth/login", "ip", capacity, 60)])
+
+
+def test_forwarded_for_is_ignored_by_default(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_TRUST_PROXY", False)
+    assert get_client_ip(_scope(forwarded_for="1.2.3.4")) == "10.0.0.1"
+
+
+def test_trusted_proxy_uses_rightmost_address(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_TRUST_PROXY", True)
+    monkeypatch.setattr(settings, "RATE_LIMIT_PROXY_HOPS", 1)
+    assert get_client_ip(_scope(forwarded_for="6.6.6.6, 203.0.113.7")) == "203.0.113.7"
+
+    monkeypatch.setattr(settings, "RATE_LIMIT_PROXY_HOPS", 2)
+    assert get_client_ip(_scope(forwarded_for="6.6.6.6, 203.0.113.7, 10.1.1.1")) == "203.0.113.7"
+    # Menos entradas que proxies: o header não é confiável
+    assert get_client_ip(_scope(forwarded_for="203.0.113.7")) == "10.0.0.1"
+
+
+async def test_bucket_blocks_after_capacity(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(settings, "RATE_LIMIT_TRUST_PROXY", False)
+    middleware = _middleware(capacity=3)
+
+    statuses = [await _call(middleware, _scope()) for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+    # Outro cliente tem o próprio balde; rotas sem regra não são limitadas
+    assert await _call(middleware, _scope(client="10.0.0.2")) == 200
+    assert await _call(middleware, _scope(path="/auth/me")) == 200
+
+
+async def test_rotating_forwarded_for_does_not_reset_bucket(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(settings, "RATE_LIMIT_TRUST_PROXY", True)
+    monkeypatch.setattr(settings, "RATE_LIMIT_PROXY_HOPS", 1)
+    middleware = _middleware(capacity=2)
+
+    statuses = [
+        await _call(middleware, _scope(forwarded_for=f"198.51.100.{attempt}, 203.0.113.7"))
+        for attempt in range(3)
+    ]
+    assert statuses == [200, 200, 429]
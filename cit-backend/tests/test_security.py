@@ -0,0 +1,55 @@
+import threading
+import pytest
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from app.core import security
+from app.core.config import settings
+from app.schemas.user import UserLogin
+from app.services.auth_service import AuthService
+
+
+async def test_bcrypt_runs_on_the_dedicated_executor():
+    thread = await security._run_hash_task(lambda: threading.current_thread().name)
+
+    assert thread.startswith("password-hash")
+    assert thread != threading.current_thread().name
+
+
+async def test_full_hash_queue_answers_503(monkeypatch):
+    monkeypatch.setattr(
+        security.hash_metrics, "in_flight", settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_QUEUE
+    )
+    rejected = security.hash_metrics.rejected
+
+    with pytest.raises(HTTPException) as error:
+        await security.get_password_hash_async("senha")
+
+    assert error.value.status_code == 503
+    assert error.value.headers["Retry-After"] == "1"
+    assert security.hash_metrics.rejected == rejected + 1
+
+
+async def test_login_rehashes_password_with_current_cost(db):
+    # Hash gravado com um custo diferente de BCRYPT_ROUNDS
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=settings.BCRYPT_ROUNDS + 1).hash("senha-antiga")
+    await db.users.insert_one({
+        "name": "Ana",
+        "email": "ana@example.com",
+        "password_hash": old_hash,
+        "role": "client",
+        "hours_balance": 0.0,
+        "token_version": 0
+    })
+    rehashed = security.hash_metrics.rehashed
+
+    await AuthService.authenticate_user(UserLogin(email="ana@example.com", password="senha-antiga"))
+
+    stored = (await db.users.find_one({"email": "ana@example.com"}))["password_hash"]
+    assert stored != old_hash
+    assert stored.startswith(f"$2b${settings.BCRYPT_ROUNDS:02d}$")
+    assert security.verify_password("senha-antiga", stored)
+    assert security.hash_metrics.rehashed == rehashed + 1
+
+    # Hash já no custo atual: nada a regravar
+    await AuthService.authenticate_user(UserLogin(email="ana@example.com", password="senha-antiga"))
+    assert (await db.users.find_one({"email": "ana@example.com"}))["password_hash"] == stored
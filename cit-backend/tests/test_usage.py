@@ -0,0 +1,103 @@
+from datetime import datetime, timezone
+import pytest
+from bson import ObjectId
+from app.services.ledger_service import LedgerService
+from app.services.usage_service import COLLECTION, UsageService
+
+
+@pytest.fixture(autouse=True)
+async def usage(db):
+    await db.hours_ledger.create_index("idempotency_key", unique=True)
+
+
+async def _user(db) -> str:
+    user_id = ObjectId()
+    await db.users.insert_one({"_id": user_id, "email": f"{user_id}@cit.com", "hours_balance": 10.0, "ledger_opened": True})
+    return str(user_id)
+
+
+async def _code(db) -> str:
+    await db.access_codes.insert_one({"code": "ABCD2345", "status": "redeemed", "hours": 3.0, "used_seconds": 0.0})
+    return "ABCD2345"
+
+
+def _event(event_id: str, seconds: float, user_id: str = None, code: str = None) -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        "event_id": event_id,
+        "controller": "ctrl-1",
+        "user_id": user_id,
+        "code": code,
+        "session_id": "s1",
+        "seconds": seconds,
+        "bytes_in": 0,
+        "bytes_out": 0,
+        "at": now,
+        "received_at": now
+    }
+
+
+async def _charged(db, user_id: str, code: str):
+    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    access_code = await db.access_codes.find_one({"code": code})
+    return user["hours_balance"], access_code["used_seconds"]
+
+
+async def test_flush_charges_once_and_skips_duplicates(db):
+    user_id = await _user(db)
+    code = await _code(db)
+    events = [_event("e1", 1800, user_id=user_id), _event("e2", 600, code=code)]
+
+    assert await UsageService.flush(events) == {"e1": "applied", "e2": "applied"}
+    assert await UsageService.flush(events) == {"e1": "duplicate", "e2": "duplicate"}
+
+    assert await _charged(db, user_id, code) == (9.5, 600)
+    assert await db[COLLECTION].count_documents({}) == 2
+    assert (await db.access_codes.find_one({"code": code}))["usage_pending"] == []
+
+
+async def test_retry_after_ledger_write_does_not_charge_user_twice(db, monkeypatch):
+    user_id = await _user(db)
+    code = await _code(db)
+    events = [_event("e1", 1800, user_id=user_id), _event("e2", 600, code=code)]
+    record_many = LedgerService.record_many
+
+    async def record_then_crash(entries):
+        await record_many(entries)
+        raise RuntimeError("queda antes de descontar os códigos")
+
+    monkeypatch.setattr(LedgerService, "record_many", staticmethod(record_then_crash))
+    with pytest.raises(RuntimeError):
+        await UsageService.flush(events)
+    monkeypatch.setattr(LedgerService, "record_many", staticmethod(record_many))
+
+    # O lease é liberado na falha: o reenvio retoma os eventos na hora
+    assert await UsageService.flush(events) == {"e1": "applied", "e2": "applied"}
+
+    assert await _charged(db, user_id, code) == (9.5, 600)
+    assert await db[COLLECTION].count_documents({}) == 2
+    assert await db.hours_ledger.count_documents({"user_id": user_id}) == 1
+
+
+async def test_retry_after_all_charges_only_marks_events(db, monkeypatch):
+    user_id = await _user(db)
+    code = await _code(db)
+    events = [_event("e1", 1200, user_id=user_id), _event("e2", 600, code=code), _event("e3", 600, user_id=user_id)]
+    apply_balances = UsageService._apply_balances
+
+    async def apply_then_crash(*args):
+        await apply_balances(*args)
+        raise RuntimeError("queda antes de marcar os eventos")
+
+    monkeypatch.setattr(UsageService, "_apply_balances", staticmethod(apply_then_crash))
+    with pytest.raises(RuntimeError):
+        await UsageService.flush(events)
+    monkeypatch.setattr(UsageService, "_apply_balances", staticmethod(apply_balances))
+
+    # Reenvio parcial: o outro evento da mesma cobrança também fica aplicado
+    assert await UsageService.flush(events[1:]) == {"e2": "applied", "e3": "applied"}
+    assert await UsageService.flush(events) == {"e1": "duplicate", "e2": "duplicate", "e3": "duplicate"}
+
+    assert await _charged(db, user_id, code) == (9.5, 600)
+    assert await db[COLLECTION].count_documents({}) == 3
+    assert (await db.access_codes.find_one({"code": code}))["usage_pending"] == []